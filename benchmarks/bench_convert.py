@@ -0,0 +1,68 @@
+"""
+Compare the per-file cost of in-process and pandoc markdown to html
+conversions.
+
+Usage:
+
+    $ python benchmarks/bench_convert.py [number of files]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from buroca.convert import CONVERTERS, _cli
+
+DOCUMENT = """# Report for {n}
+
+John is the *singer* of **Beatles**. He can play:
+
+* guitar
+* keyboard
+* harmonica
+"""
+
+
+def bench(name, n_files, convert):
+    with tempfile.TemporaryDirectory() as tmp:
+        files = []
+        for n in range(n_files):
+            src = os.path.join(tmp, 'doc-%s.md' % n)
+            with open(src, 'w') as F:
+                F.write(DOCUMENT.format(n=n))
+            files.append((src, src[:-3] + '.html'))
+
+        start = time.perf_counter()
+        for src, dest in files:
+            convert(src, dest)
+        elapsed = time.perf_counter() - start
+
+    print('%-12s %8.3f ms/file' % (name, 1000 * elapsed / n_files))
+
+
+def main(n_files=200):
+    formats = ('markdown', 'html')
+    converters = CONVERTERS[formats]
+
+    for converter in converters:
+        if converter.command:
+            if shutil.which('pandoc') is None:
+                print('%-12s pandoc not found' % 'pandoc')
+                continue
+            bench('pandoc', n_files,
+                  lambda src, dest: _cli(*converter.func(src, dest, formats)))
+        else:
+            try:
+                __import__(converter.requires)
+            except ImportError:
+                print('%-12s %s not installed' % ('in-process',
+                                                    converter.requires))
+                continue
+            bench('in-process', n_files,
+                  lambda src, dest: converter.func(src, dest, formats))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,141 @@
+"""
+Build manifest that records the inputs of each generated report, so reports
+whose inputs did not change can be skipped.
+"""
+
+import hashlib
+import json
+import os
+
+from . import __version__
+from . import filters, global_functions
+from .convert import conversion_signature
+from .paths import buroca_path
+
+MANIFEST_VERSION = 1
+_HASHES = {}
+
+
+def manifest_path(base=None):
+    """
+    Return the path of the build manifest of a project.
+    """
+    return buroca_path('manifest.json', base=base)
+
+
+class Manifest:
+    """
+    Map each output file to a record of the inputs used to build it.
+
+    Args:
+        path:
+            Path to the JSON file that stores the manifest.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        try:
+            with open(path) as F:
+                data = json.load(F)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == MANIFEST_VERSION:
+            self.records = data['records']
+
+    def is_up_to_date(self, dest, record):
+        """
+        Return True if dest exists and was built from the given inputs.
+        """
+        dest = os.path.abspath(dest)
+        return os.path.exists(dest) and self.records.get(dest) == record
+
+    def update(self, dest, record):
+        """
+        Register the inputs used to build dest.
+        """
+        self.records[os.path.abspath(dest)] = record
+
+    def save(self):
+        """
+        Write manifest to disk.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = '%s.tmp' % self.path
+        with open(tmp, 'w') as F:
+            json.dump({'version': MANIFEST_VERSION, 'records': self.records},
+                      F, indent=1, sort_keys=True)
+        os.replace(tmp, str(self.path))
+
+
+def build_record(template_path, sources, type=None, includes=()):
+    """
+    Return a JSON serializable record of the inputs of a report.
+
+    Args:
+        template_path:
+            Path to the template file.
+        sources:
+            List of data files read to build the report. Files that do not
+            exist are recorded as missing, so creating them triggers a
+            rebuild.
+        type:
+            Output type passed to the converter. The record includes the
+            converter arguments and tool versions, so changing or upgrading
+            converters triggers a rebuild.
+        includes:
+            List of template files included or extended by the template.
+    """
+    return {
+        'template': file_hash(template_path),
+        'includes': {str(path): file_hash(path) for path in includes},
+        'data': {str(path): file_hash(path) for path in sources},
+        'functions': functions_version(),
+        'conversion': conversion_record(template_path, type),
+    }
+
+
+def conversion_record(template_path, type=None):
+    """
+    Return a record of the converter used to produce outputs of the given
+    type from the template, including its arguments and tool versions.
+    """
+    if type is None:
+        return {'type': None}
+    try:
+        signature = conversion_signature(template_path, '{dest}', outfmt=type)
+    except RuntimeError:
+        signature = None
+    return {'type': type, 'converter': signature}
+
+
+def file_hash(path):
+    """
+    Return the SHA1 hex digest of the file contents or None if file does not
+    exist.
+
+    Results are memoized by file modification time and size.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = (os.fspath(path), stat.st_mtime_ns, stat.st_size)
+    try:
+        return _HASHES[key]
+    except KeyError:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as F:
+            for chunk in iter(lambda: F.read(2 ** 16), b''):
+                digest.update(chunk)
+        result = _HASHES[key] = digest.hexdigest()
+        return result
+
+
+def functions_version():
+    """
+    Return a string that changes whenever filters or global functions change.
+    """
+    hashes = [file_hash(mod.__file__) for mod in [filters, global_functions]]
+    return '%s:%s' % (__version__, ':'.join(hashes))
@@ -0,0 +1,405 @@
+"""
+Caches for parsed resources.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import stat
+import tempfile
+from collections import OrderedDict
+from functools import wraps
+from pathlib import Path
+
+from .paths import buroca_path
+
+# Bump this number to invalidate all persistent caches
+CACHE_VERSION = 1
+
+
+class ResourceCache:
+    """
+    A LRU cache of parsed files.
+
+    Entries are validated against the (st_mtime_ns, st_size) pair of the
+    source file, so changes on disk are always picked up. The cache is bounded
+    both by the number of entries and by the total size of the cached source
+    files in bytes.
+
+    Args:
+        max_entries (int):
+            Maximum number of cached files. None disables the limit.
+        max_bytes (int):
+            Maximum total size (in bytes) of the cached source files. None
+            disables the limit.
+        disk (DiskCache):
+            Optional persistent cache consulted before calling the loader.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, disk=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, path, loader):
+        """
+        Return the result of loader(path), reusing a previous result if the
+        file did not change since it was loaded.
+        """
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        key = (loader, os.fspath(path))
+
+        try:
+            cached_signature, value = self._data[key]
+        except KeyError:
+            pass
+        else:
+            if cached_signature == signature:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            self._discard(key)
+
+        self.misses += 1
+        if self.disk is None:
+            value = loader(path)
+        else:
+            value = self.disk.get(path, loader, signature)
+        self._data[key] = (signature, value)
+        self.total_bytes += signature[1]
+        self._evict()
+        return value
+
+    def cached(self, loader=None, version=0):
+        """
+        Decorator that makes the loader function use this cache.
+
+        The version number is part of the key of persistent caches and must
+        be incremented whenever the loader output changes.
+        """
+        if loader is None:
+            return lambda func: self.cached(func, version)
+
+        loader.version = version
+
+        @wraps(loader)
+        def decorated(path):
+            return self.get(path, loader)
+
+        decorated.uncached = loader
+        return decorated
+
+    def resize(self, max_entries=None, max_bytes=None):
+        """
+        Change cache limits, evicting entries if necessary.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def clear(self):
+        """
+        Remove all entries and reset statistics.
+        """
+        self._data.clear()
+        self.hits = self.misses = self.evictions = self.total_bytes = 0
+
+    def stats(self):
+        """
+        Return a dictionary with cache statistics.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._data),
+            'bytes': self.total_bytes,
+        }
+
+    def _discard(self, key):
+        (_, size), _ = self._data.pop(key)
+        self.total_bytes -= size
+
+    def _evict(self):
+        while self._data and self._is_full():
+            key = next(iter(self._data))
+            self._discard(key)
+            self.evictions += 1
+
+    def _is_full(self):
+        if self.max_entries is not None and len(self._data) > self.max_entries:
+            return True
+        if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+            return True
+        return False
+
+
+class DiskCache:
+    """
+    A persistent cache of parsed files stored as pickles in a directory.
+
+    Each entry is keyed by the file path, its modification time and size and
+    by the name and version of the loader function, so a fresh process only
+    re-parses files that changed.
+
+    Args:
+        path:
+            Directory that stores cached entries.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, loader, signature=None):
+        """
+        Return the result of loader(path), reading it from disk if possible.
+        """
+        path = os.path.abspath(path)
+        if signature is None:
+            stat = os.stat(path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+
+        loader_id = '%s.%s' % (loader.__module__, loader.__qualname__)
+        key = (CACHE_VERSION, path, signature, loader_id,
+               getattr(loader, 'version', 0))
+        entry = self._entry_path(path, loader_id)
+
+        try:
+            with open(str(entry), 'rb') as F:
+                cached_key, value = pickle.load(F)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            # Corrupt entries and entries that refer to classes that were
+            # renamed or moved are misses
+            self._remove(entry)
+        else:
+            if cached_key == key:
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        value = loader(path)
+        try:
+            self._write(entry, (key, value))
+        except (pickle.PicklingError, TypeError, AttributeError, OSError):
+            pass  # value cannot be pickled or saved: just skip the cache
+        return value
+
+    def clear(self):
+        """
+        Remove all cached entries.
+        """
+        for entry in self._entries():
+            entry.unlink()
+
+    def stats(self):
+        """
+        Return a dictionary with cache statistics.
+        """
+        sizes = [entry.stat().st_size for entry in self._entries()]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(sizes),
+            'bytes': sum(sizes),
+        }
+
+    def _entries(self):
+        if not self.path.exists():
+            return []
+        return list(self.path.glob('*/*.pickle'))
+
+    def _entry_path(self, path, loader_id):
+        digest = hashlib.sha1(('%s:%s' % (loader_id, path)).encode('utf8'))
+        digest = digest.hexdigest()
+        return self.path / digest[:2] / (digest[2:] + '.pickle')
+
+    def _write(self, entry, data):
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=str(entry.parent))
+        try:
+            with os.fdopen(fd, 'wb') as F:
+                pickle.dump(data, F, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, str(entry))
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+    def _remove(self, entry):
+        try:
+            entry.unlink()
+        except OSError:
+            pass
+
+
+class ConversionCache:
+    """
+    A content-addressed store of conversion results.
+
+    Entries are keyed by the contents of the input file and by everything
+    else that affects the output (formats, arguments, tool versions). Cached
+    files are copied to the destination, so outputs never share the inode of
+    a cache entry. Least recently used entries are removed when the cache
+    grows beyond max_bytes.
+
+    Args:
+        path:
+            Directory that stores cached files.
+        max_bytes (int):
+            Maximum total size of the cached files.
+    """
+
+    def __init__(self, path, max_bytes=512 * 2 ** 20):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes = None
+
+    def key(self, src, *parts):
+        """
+        Return the key of the conversion of file src. Other arguments must be
+        JSON serializable and describe the conversion.
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps([CACHE_VERSION, *parts]).encode('utf8'))
+        with open(src, 'rb') as F:
+            for chunk in iter(lambda: F.read(2 ** 16), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get(self, key, dest):
+        """
+        Restore the cached result with the given key at dest.
+
+        Returns True if the result was found and False otherwise.
+        """
+        entry = self._entry_path(key)
+        if not entry.exists():
+            self.misses += 1
+            return False
+
+        # A new file is created with the default permissions and replaces
+        # dest atomically
+        tmp = '%s.%s.tmp' % (dest, os.getpid())
+        try:
+            shutil.copyfile(str(entry), tmp)
+            os.replace(tmp, str(dest))
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        os.utime(str(entry))
+        self.hits += 1
+        return True
+
+    def put(self, key, path):
+        """
+        Store the file at path as the result with the given key.
+
+        Cached files are read-only, so they are not modified in place by
+        accident.
+        """
+        entry = self._entry_path(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=str(entry.parent))
+        os.close(fd)
+        try:
+            shutil.copyfile(str(path), tmp)
+            os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(tmp, str(entry))
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+        if self._total_bytes is not None:
+            self._total_bytes += entry.stat().st_size
+        self._evict()
+
+    def clear(self):
+        """
+        Remove all cached files.
+        """
+        for entry in self._entries():
+            entry.unlink()
+        self._total_bytes = 0
+
+    def stats(self):
+        """
+        Return a dictionary with cache statistics.
+        """
+        sizes = [entry.stat().st_size for entry in self._entries()]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(sizes),
+            'bytes': sum(sizes),
+        }
+
+    def _evict(self):
+        if self._total_bytes is None:
+            self._total_bytes = self.stats()['bytes']
+        if self._total_bytes <= self.max_bytes:
+            return
+
+        entries = [(entry.stat(), entry) for entry in self._entries()]
+        entries.sort(key=lambda x: x[0].st_mtime_ns)
+        self._total_bytes = sum(st.st_size for st, _ in entries)
+        for st, entry in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            entry.unlink()
+            self._total_bytes -= st.st_size
+
+    def _entries(self):
+        if not self.path.exists():
+            return []
+        return [path for path in self.path.glob('*/*')
+                if not path.name.startswith('tmp')]
+
+    def _entry_path(self, key):
+        return self.path / key[:2] / key[2:]
+
+
+def cache_path(*args, base=None):
+    """
+    Return a subpath into the project's cache folder.
+    """
+    return buroca_path('cache', *args, base=base)
+
+
+def open_disk_cache(base=None):
+    """
+    Return the persistent resource cache of the project or None if caching
+    was not enabled with "buroca cache enable".
+    """
+    if not cache_path(base=base).exists():
+        return None
+    return DiskCache(cache_path('resources', base=base))
+
+
+def open_conversion_cache(base=None):
+    """
+    Return the conversion cache of the project or None if caching was not
+    enabled with "buroca cache enable".
+    """
+    if not cache_path(base=base).exists():
+        return None
+    return ConversionCache(cache_path('conversions', base=base))
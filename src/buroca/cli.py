@@ -3,10 +3,19 @@ from glob import glob as expand_glob
 
 import click
 
+from . import convert, db
+from .cache import cache_path, open_disk_cache, DiskCache
+from .cache import open_conversion_cache, ConversionCache
 from .convert import join_pdfs
-from .paths import name_for, as_report_path, init as path_init
-from .paths import normalize_path
+from .paths import name_for, joined_name_for, as_report_path
+from .paths import init as path_init
+from .paths import natural_key, normalize_path
+from .store import open_store, store_path, DataStore
+from .errors import BurocaException, TemplateError
+from .global_functions import GLOBALS
 from .templates import save_rendered_for, save_rendered_all
+from .templates import save_rendered_single
+from .templates import template_dependencies, compile_templates
 from .viewers import launch_document_viewer
 
 
@@ -35,39 +44,171 @@ def init():
 @click.option('--type', '-t', help='output format type')
 @click.option('--view', '-v', is_flag=True,
               help='launch document viewer afterwards')
-def create(template, type, view=False, **kwargs):
+@click.option('--force', '-f', is_flag=True,
+              help='rebuild reports even if they are up-to-date')
+@click.option('--jobs', '-j', type=int,
+              help='number of parallel jobs (defaults to the number of CPUs)')
+@click.option('--single', '-s', is_flag=True,
+              help='join the reports of all entities in a single file')
+@click.option('--separator',
+              help='text inserted between reports in a single file '
+                   '(defaults to a page break)')
+def create(template, type, view=False, force=False, jobs=None, single=False,
+           separator=None, **kwargs):
     """
     create reports from resources and templates.
     """
     for_ = kwargs.get('for')
     template = normalize_path(template, 'templates/')
+    db.RESOURCE_CACHE.disk = open_disk_cache()
+    convert.CONVERSION_CACHE = open_conversion_cache()
+    update_store()
 
     if for_ is not None:
-        create_for(for_, template, type, view)
+        create_for(for_, template, type, view, force)
+    elif single:
+        create_single(template, type, view, force,
+                      jobs or os.cpu_count() or 1, separator)
     else:
         if view:
             msg = 'Cannot open viewer when generating multiple files.'
             raise SystemExit(msg)
-        create_sequence(template, type)
+        create_sequence(template, type, force, jobs or os.cpu_count() or 1)
 
 
-def create_for(for_, template, type, view):
+def update_store():
+    """
+    Refresh the compiled data store, if the project uses one.
+    """
+    store = open_store()
+    if store is not None:
+        store.compile()
+        store.close()
+
+
+def create_for(for_, template, type, view, force=False):
     """
     Implements the "buroca create" command with a --for option.
     """
     template_path = template.absolute()
     dest = name_for(as_report_path(template_path), for_, type)
-    save_rendered_for(template_path, dest, for_, type=type)
+    if not save_rendered_for(template_path, dest, for_, type=type,
+                             force=force):
+        click.echo('%s is up-to-date.' % dest)
     if view:
         launch_document_viewer(dest)
 
 
-def create_sequence(template, type):
+def create_single(template, type, view, force=False, jobs=1, separator=None):
+    """
+    Implements the "buroca create" command with a --single option.
+    """
+    template_path = template.absolute()
+    dest = joined_name_for(as_report_path(template_path), type)
+    if separator is not None:
+        separator = '\n\n%s\n\n' % separator
+    try:
+        save_rendered_single(template_path, dest, type=type, force=force,
+                             jobs=jobs, separator=separator)
+    except TemplateError as ex:
+        raise SystemExit(str(ex))
+    if view:
+        launch_document_viewer(dest)
+
+
+def create_sequence(template, type, force=False, jobs=1):
     """
     Generate multiple files for the "buroca create" command.
     """
     template_path = template.absolute()
-    save_rendered_all(template_path, type=type)
+    try:
+        save_rendered_all(template_path, type=type, force=force, jobs=jobs)
+    except TemplateError as ex:
+        raise SystemExit(str(ex))
+
+
+#
+# Rebuild reports on changes: buroca watch <template> [...]
+#
+@buroca.command()
+@click.argument('templates', nargs=-1, required=True)
+@click.option('--type', '-t', help='output format type')
+@click.option('--delay', type=float, default=0.2,
+              help='seconds to wait for more changes before rebuilding')
+@click.option('--poll', is_flag=True,
+              help='poll files for changes instead of using inotify')
+def watch(templates, type, delay=0.2, poll=False):
+    """
+    rebuild reports when data or templates change.
+    """
+    from .watch import WatchSession, new_watcher, changes
+
+    templates = [normalize_path(template, 'templates/')
+                 for template in templates]
+    db.RESOURCE_CACHE.disk = open_disk_cache()
+    convert.CONVERSION_CACHE = open_conversion_cache()
+    session = WatchSession(templates, type)
+    session.build()
+
+    watcher = new_watcher(['data', 'templates'], polling=poll)
+    click.echo('Watching data/ and templates/ (%s). Press Ctrl+C to stop.'
+               % ('polling' if poll or not hasattr(watcher, 'fd')
+                  else 'inotify'))
+    try:
+        for changed in changes(watcher, delay):
+            click.echo('%s files changed.' % len(changed))
+            session.update(changed)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+#
+# Inspect template dependencies: buroca deps <template>
+#
+@buroca.command()
+@click.argument('template')
+def deps(template):
+    """
+    list the resources used by a template.
+    """
+    template = normalize_path(template, 'templates/')
+    builder = db.NamespaceBuilder()
+
+    names = template_dependencies(template)
+    if names is None:
+        click.echo('template references other templates by dynamic names; '
+                   'all resources are loaded.')
+        names = builder.names()
+
+    for name in sorted(names):
+        if name in builder.paths:
+            path = builder.paths[name]
+            source = str(path.relative_to(builder.base))
+            source += '/' if path.is_dir() else ''
+        elif name in GLOBALS:
+            source = '(global function)'
+        else:
+            source = '(undefined)'
+        click.echo('%-20s %s' % (name, source))
+
+
+#
+# Precompile templates: buroca compile
+#
+@buroca.command('compile')
+def compile_():
+    """
+    precompile all templates of the project.
+    """
+    compiled, errors = compile_templates()
+    for name in compiled:
+        click.echo('compiled %s' % name)
+    for name, error in sorted(errors.items()):
+        click.echo('error in %s: %s' % (name, error), err=True)
+    if errors:
+        raise SystemExit(1)
 
 
 #
@@ -77,14 +218,90 @@ def create_sequence(template, type):
 @click.argument('glob')
 @click.option('--view', '-v', is_flag=True,
               help='launch document viewer afterwards')
-def join_pdf(glob, view):
+@click.option('--pdfjam', is_flag=True,
+              help='join files with the external pdfjam command')
+def join_pdf(glob, view, pdfjam=False):
     """
     join pdfs from generated reports.
     """
     glob = str(normalize_path(glob, 'reports/', glob=True))
     out_path = glob + '.pdf'
     glob += '-*.pdf'
-    files = expand_glob(glob)
-    join_pdfs(files, out_path)
+    files = sorted(expand_glob(glob), key=natural_key)
+    if not files:
+        raise SystemExit('no files matching %s' % glob)
+    try:
+        join_pdfs(files, out_path, backend='pdfjam' if pdfjam else 'buroca')
+    except BurocaException as ex:
+        raise SystemExit(str(ex))
+    click.echo('%s files joined at %s.' % (len(files), out_path))
     if view:
         launch_document_viewer(out_path)
+
+
+#
+# Manage the persistent cache: buroca cache <cmd>
+#
+@buroca.group()
+def cache():
+    """
+    manage the persistent cache at .buroca/cache/.
+    """
+
+
+@cache.command('enable')
+def cache_enable():
+    """
+    enable the persistent cache for the current project.
+    """
+    cache_path().mkdir(parents=True, exist_ok=True)
+    click.echo('Cache enabled at %s' % cache_path())
+
+
+@cache.command('clear')
+def cache_clear():
+    """
+    remove all cached entries.
+    """
+    DiskCache(cache_path('resources')).clear()
+    ConversionCache(cache_path('conversions')).clear()
+    click.echo('Cache cleared!')
+
+
+@cache.command('stats')
+def cache_stats():
+    """
+    show statistics about the persistent cache.
+    """
+    if not cache_path().exists():
+        click.echo('Cache is disabled. Use "buroca cache enable" to enable it.')
+        return
+    stats = DiskCache(cache_path('resources')).stats()
+    click.echo('resources: %(entries)s entries, %(bytes)s bytes' % stats)
+    stats = ConversionCache(cache_path('conversions')).stats()
+    click.echo('conversions: %(entries)s entries, %(bytes)s bytes' % stats)
+
+
+#
+# Manage the compiled data store: buroca db <cmd>
+#
+@buroca.group('db')
+def db_group():
+    """
+    manage the compiled SQLite data store.
+    """
+
+
+@db_group.command('compile')
+def db_compile():
+    """
+    compile data/ into an indexed SQLite file.
+
+    After the first compilation, buroca reads data from the compiled store
+    and updates it before each "buroca create".
+    """
+    store = DataStore(store_path())
+    stats = store.compile()
+    store.close()
+    click.echo('%(added)s added, %(updated)s updated, %(removed)s removed, '
+               '%(unchanged)s unchanged.' % stats)
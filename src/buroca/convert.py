@@ -1,9 +1,17 @@
+import asyncio
+import importlib
+import importlib.util
+import os
 import pathlib
 import subprocess
 import tempfile
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from functools import lru_cache
 
-from pyexcel_ods3 import get_data as _get_excel_data
+from . import __version__
+from .errors import ConversionError
 
 UNIVERSAL_FORMATS = [
     'markdown', 'latex', 'html', 'pdf',
@@ -15,33 +23,385 @@ FMT_ALIASES = {
     'htm': 'html',
 }
 
+# A ConversionCache instance, or None to disable caching
+CONVERSION_CACHE = None
+
+# Converters that depend on optional Python modules (e.g. Python-Markdown)
+# avoid starting external tools, but their output may differ slightly. They
+# are only used if enabled here or with the BUROCA_IN_PROCESS environment
+# variable.
+IN_PROCESS_CONVERTERS = bool(os.environ.get('BUROCA_IN_PROCESS'))
+
 
 def convert_file(src, dest, infmt=None, outfmt=None):
     """
     Save file from the given source to the given destination.
 
     If necessary, it infers file types from the source and destination
-    extensions.
+    extensions. Results are reused from :data:`CONVERSION_CACHE` if it is
+    set.
     """
-    infmt = get_format(src, infmt)
-    outfmt = get_format(dest, outfmt)
+    formats = (get_format(src, infmt), get_format(dest, outfmt))
+    converter = get_converter(src, *formats)
+    if converter is None:
+        copy_file(src, dest)
+        return
 
-    if infmt == outfmt:
+    key = _cache_key(converter, src, dest, formats)
+    if key is not None and CONVERSION_CACHE.get(key, dest):
+        return
+
+    if converter.command:
+        _cli(*converter.func(src, dest, formats))
+    else:
+        converter.func(src, dest, formats)
+
+    if key is not None:
+        CONVERSION_CACHE.put(key, dest)
+
+
+async def convert_file_async(src, dest, infmt=None, outfmt=None):
+    """
+    Asynchronous version of :func:`convert_file`.
+
+    External converters run as asyncio subprocesses and in-process
+    converters run in a thread.
+    """
+    formats = (get_format(src, infmt), get_format(dest, outfmt))
+    converter = get_converter(src, *formats)
+    if converter is None:
         copy_file(src, dest)
-    elif (infmt, outfmt) == ('markdown', 'pdf'):
-        _markdown_to_pdf(src, dest)
-    elif (infmt, outfmt) in PANDOC_PAIRS:
-        _pandoc_convert(src, dest, (infmt, outfmt))
+        return
+
+    key = _cache_key(converter, src, dest, formats)
+    if key is not None and CONVERSION_CACHE.get(key, dest):
+        return
+
+    if not converter.command:
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, converter.func, src, dest, formats)
+    else:
+        cmd = converter.func(src, dest, formats)
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError as ex:
+            raise ConversionError(cmd, 127, str(ex))
+        stdout, stderr = await proc.communicate()
+        if proc.returncode != 0:
+            stderr = (stdout + stderr).decode('utf8', 'replace')
+            raise ConversionError(cmd, proc.returncode, stderr)
+
+    if key is not None:
+        CONVERSION_CACHE.put(key, dest)
+
+
+def _cache_key(converter, src, dest, formats):
+    """
+    Return the key of the conversion in :data:`CONVERSION_CACHE` or None if
+    the cache is disabled.
+    """
+    if CONVERSION_CACHE is None:
+        return None
+
+    signature = _signature(converter, src, dest, formats)
+    return CONVERSION_CACHE.key(src, list(formats), signature['args'],
+                                signature['versions'])
+
+
+def conversion_signature(src, dest, infmt=None, outfmt=None):
+    """
+    Describe the converter selected to convert src to dest.
+
+    Returns:
+        A JSON serializable dictionary with the converter arguments, in which
+        src and dest are replaced by "{src}" and "{dest}", and the versions
+        of buroca and of the tools it uses. None if the file is just copied.
+    """
+    formats = (get_format(src, infmt), get_format(dest, outfmt))
+    converter = get_converter(src, *formats)
+    if converter is None:
+        return None
+    return _signature(converter, src, dest, formats)
+
+
+def _signature(converter, src, dest, formats):
+    if converter.command:
+        args = [str(arg).replace(str(src), '{src}').replace(str(dest), '{dest}')
+                for arg in converter.func(src, dest, formats)]
+        tool = args[0]
     else:
-        msg = 'cannot convert %s from %s to %s' % (src, infmt, outfmt)
-        raise RuntimeError(msg)
+        func = converter.func
+        args = ['%s.%s' % (func.__module__, func.__qualname__)]
+        tool = converter.tool
+    versions = [__version__, tool_version(tool) if tool else None,
+                module_version(converter.requires)]
+    return {'args': args, 'versions': versions}
+
+
+@lru_cache()
+def tool_version(tool):
+    """
+    Return the first line printed by "tool --version" or None if tool is not
+    installed.
+    """
+    try:
+        result = subprocess.run([tool, '--version'], stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    lines = result.stdout.decode('utf8', 'replace').splitlines()
+    return lines[0].strip() if lines else ''
+
+
+@lru_cache()
+def module_version(name):
+    """
+    Return the version of an installed Python module or None.
+    """
+    if name is None or not _has_module(name):
+        return None
+    module = importlib.import_module(name)
+    return str(getattr(module, '__version__', None))
+
+
+#
+# Converter registry
+#
+CONVERTERS = defaultdict(list)
+Converter = namedtuple('Converter',
+                       ['func', 'command', 'requires', 'priority', 'tool'])
+Converter.__new__.__defaults__ = (None,)
+
+
+def converter(*pairs, command=False, requires=None, priority=0, tool=None):
+    """
+    Register function as a converter for the given (infmt, outfmt) pairs.
 
+    Converters are called as func(src, dest, (infmt, outfmt)). In-process
+    converters write the dest file. Command converters (command=True) return
+    the arguments of an external program that does the conversion.
 
-def join_pdfs(files, dest):
+    Args:
+        command (bool):
+            True for converters that return command line arguments.
+        requires (str):
+            Name of a Python module required by the converter. The converter
+            is ignored if the module is not installed or if
+            :data:`IN_PROCESS_CONVERTERS` is False.
+        priority (int):
+            Converters with higher priority are preferred.
+        tool (str):
+            External program used by an in-process converter. Its version is
+            part of the key of cached conversions.
+    """
+
+    def decorator(func):
+        for pair in pairs:
+            CONVERTERS[pair].append(
+                Converter(func, command, requires, priority, tool))
+            CONVERTERS[pair].sort(key=lambda x: -x.priority)
+        return func
+
+    return decorator
+
+
+def get_converter(src, infmt, outfmt):
+    """
+    Return the preferred available converter between the given formats or
+    None if file just has to be copied.
+    """
+    if infmt == outfmt:
+        return None
+    for converter in CONVERTERS.get((infmt, outfmt), ()):
+        if converter.requires is None:
+            return converter
+        if IN_PROCESS_CONVERTERS and _has_module(converter.requires):
+            return converter
+    msg = 'cannot convert %s from %s to %s' % (src, infmt, outfmt)
+    raise RuntimeError(msg)
+
+
+@lru_cache()
+def _has_module(name):
+    return importlib.util.find_spec(name) is not None
+
+
+class ConversionScheduler:
+    """
+    Run many independent file conversions concurrently.
+
+    Conversions run in a :class:`ConversionPipeline` and at most max_jobs of
+    them run at the same time.
+
+    Args:
+        max_jobs (int):
+            Maximum number of concurrent conversions. Defaults to the number
+            of CPUs.
+    """
+
+    def __init__(self, max_jobs=None):
+        self.max_jobs = max_jobs or os.cpu_count() or 1
+        self.jobs = []
+
+    def submit(self, src, dest, infmt=None, outfmt=None):
+        """
+        Schedule conversion from src to dest.
+        """
+        self.jobs.append((src, dest, infmt, outfmt))
+
+    def run(self, check=True):
+        """
+        Run all scheduled conversions.
+
+        Returns:
+            A list with one item per job, in submission order. Each item is
+            either None (success) or the exception raised by the job (usually
+            a :class:`ConversionError`, which holds its exit code and stderr
+            output).
+
+        Raises:
+            ConversionError: if check is True, it raises the error of the
+            first failed job after all jobs finish.
+        """
+        jobs, self.jobs = self.jobs, []
+        pipeline = ConversionPipeline(self.max_jobs, cleanup=False)
+        errors = pipeline.run((idx, *job) for idx, job in enumerate(jobs))
+        results = [errors.get(idx) for idx in range(len(jobs))]
+        if check and errors:
+            raise errors[min(errors)]
+        return results
+
+
+class ConversionPipeline:
+    """
+    Convert files while they are being produced.
+
+    Items are pulled from a (possibly blocking) iterator in a background
+    thread and pushed to a bounded queue that is drained by conversion
+    workers. Producer and converters thus run at the same time, and the
+    number of produced files waiting for conversion never exceeds the queue
+    depth.
+
+    Args:
+        max_jobs (int):
+            Maximum number of concurrent conversions. Defaults to the number
+            of CPUs.
+        depth (int):
+            Maximum number of items waiting in the queue. Defaults to
+            2 * max_jobs.
+        cleanup (bool):
+            If True, remove source files after they are converted.
+    """
+
+    def __init__(self, max_jobs=None, depth=None, cleanup=True):
+        self.max_jobs = max_jobs or os.cpu_count() or 1
+        self.depth = depth or 2 * self.max_jobs
+        self.cleanup = cleanup
+
+    def run(self, items, callback=None):
+        """
+        Convert all items.
+
+        Args:
+            items:
+                An iterable of (key, src, dest) tuples. Items may also have
+                input and output formats, as (key, src, dest, infmt, outfmt)
+                tuples.
+            callback (callable):
+                Optional function called with the key of each successful
+                conversion as soon as it finishes.
+
+        Returns:
+            A dictionary mapping keys of the failed conversions to the
+            corresponding exceptions (usually :class:`ConversionError`).
+
+        Raises:
+            The first exception raised by the callback or by the removal of
+            a source file, after all items are processed.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self._run(items, callback))
+        finally:
+            loop.close()
+
+    async def _run(self, items, callback):
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue(self.depth)
+        errors = {}
+        failures = []
+        done = object()
+
+        consumers = [loop.create_task(self._consume(queue, done, callback,
+                                                    errors, failures))
+                     for _ in range(self.max_jobs)]
+        items = iter(items)
+        with ThreadPoolExecutor(1) as executor:
+            try:
+                while True:
+                    item = await loop.run_in_executor(executor, next, items,
+                                                      done)
+                    if item is done:
+                        break
+                    await queue.put(item)
+            finally:
+                for _ in consumers:
+                    await queue.put(done)
+                await asyncio.gather(*consumers)
+        if failures:
+            raise failures[0]
+        return errors
+
+    async def _consume(self, queue, done, callback, errors, failures):
+        # Consumers must keep draining the queue even if the callback or
+        # the cleanup fails, otherwise the producer blocks forever
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            key, src, dest, *formats = item
+            try:
+                await convert_file_async(src, dest, *formats)
+            except Exception as ex:
+                errors[key] = ex
+            else:
+                if callback is not None:
+                    _record_failure(failures, callback, key)
+            if self.cleanup:
+                _record_failure(failures, os.unlink, src)
+
+
+def _record_failure(failures, func, *args):
+    """
+    Call func(*args) and append the exception it raises to failures.
+    """
+    try:
+        func(*args)
+    except Exception as ex:
+        failures.append(ex)
+
+
+def join_pdfs(files, dest, backend='buroca'):
     """
     Join all input PDF files and save it on the given destination.
+
+    Args:
+        files:
+            Sequence of input files, in the order they should be joined.
+        dest:
+            Path to the output file.
+        backend ('buroca' or 'pdfjam'):
+            The default backend copies pages to the output without
+            re-rendering them. 'pdfjam' uses the external pdfjam command.
     """
-    _cli('pdfjam', '-q', '-o', str(dest), '--', *map(str, files))
+    if backend == 'pdfjam':
+        _cli('pdfjam', '-q', '-o', str(dest), '--', *map(str, files))
+    elif backend == 'buroca':
+        from .pdf import merge_pdfs
+        merge_pdfs(files, dest)
+    else:
+        raise ValueError('invalid backend: %r' % backend)
 
 
 def get_format(path, fmt=None):
@@ -65,9 +425,11 @@ def copy_file(src, dest):
 
 def odt_to_pdf(source, dest):
     """
-    Convert .odt file to pdf
+    Convert .odt file to pdf using the shared pool of LibreOffice workers.
     """
-    return _libreoffice_headless('-convert-to', 'pdf', source, '-o', dest)
+    from .officepool import default_pool
+
+    default_pool().convert(str(source), str(dest), 'pdf')
 
 
 def odt_to_txt(source, dest):
@@ -80,8 +442,16 @@ def odt_to_txt(source, dest):
 def read_ods(path):
     """
     Return data from spreadsheet at the given path.
+
+    Returns a list of rows for files with a single sheet and a dictionary
+    mapping sheet names to lists of rows otherwise. Rows of a sheet are
+    padded to the same length and empty cells are empty strings. Use
+    :func:`buroca.readers.iter_rows` to stream rows instead.
     """
-    data = _get_excel_data(str(path))
+    from .readers import read_sheets
+
+    data = {name: _padded_rows(rows)
+            for name, rows in read_sheets(path).items()}
     if len(data) == 1:
         data, = data.values()
         return data
@@ -104,29 +474,77 @@ def intermediate_conversion(file_name):
 def _cli(*args):
     """
     Execute cli command with the given args.
+
+    Raises a ConversionError if command exits with a non-zero code.
     """
-    return subprocess.run(args, stderr=subprocess.STDOUT)
+    args = [str(arg) for arg in args]
+    result = subprocess.run(args, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        output = result.stdout.decode('utf8', 'replace')
+        raise ConversionError(args, result.returncode, output)
+    return result
 
 
-def _pandoc_convert(src, dest, formats):
+def _padded_rows(rows):
     """
-    Use pandoc to convert between two file types.
+    Replace empty cells by empty strings and pad rows to the same length.
     """
+    width = max(map(len, rows), default=0)
+    padding = [None] * width
+    return [['' if value is None else value
+             for value in row + padding[len(row):]] for row in rows]
+
+
+@converter(*PANDOC_PAIRS, command=True)
+def _pandoc_args(src, dest, formats):
     infmt, outfmt = formats
-    _cli('pandoc', str(src), '-o', str(dest), '-r', infmt, '-w', outfmt)
+    return ['pandoc', str(src), '-o', str(dest), '-r', infmt, '-w', outfmt]
 
 
-def _libreoffice_headless(*args):
+def _libreoffice_headless(*args, wait=True):
     """
-    Execute libreoffice in headless mode
+    Execute libreoffice in headless mode.
+
+    If wait is False, return the Popen object of the running process.
     """
-    cmd = ['libreoffice', '-headless']
-    subprocess.check_output(cmd)
+    cmd = ['libreoffice', '--headless', *map(str, args)]
+    if wait:
+        return subprocess.check_output(cmd)
+    return subprocess.Popen(cmd)
 
 
 #
 # Specialized converters
 #
-def _markdown_to_pdf(src, dest):
-    _cli('pandoc', '-f', 'markdown', '-t', 'latex', '--pdf-engine', 'xelatex',
-         src, '-o', dest)
+@converter(('markdown', 'pdf'), command=True, priority=1)
+def _markdown_to_pdf_args(src, dest, formats=None):
+    return ['pandoc', '-f', 'markdown', '-t', 'latex', '--pdf-engine',
+            'xelatex', str(src), '-o', str(dest)]
+
+
+@converter(('markdown', 'html'), requires='markdown', priority=10)
+def _markdown_to_html(src, dest, formats=None):
+    """
+    Convert markdown to html in-process using Python-Markdown.
+    """
+    import markdown
+
+    # Use the same typographic characters as pandoc's smart extension
+    quotes = {'left-single-quote': '\u2018', 'right-single-quote': '\u2019',
+              'left-double-quote': '\u201c', 'right-double-quote': '\u201d',
+              'ndash': '\u2013', 'mdash': '\u2014', 'ellipsis': '\u2026'}
+    with open(src, encoding='utf8') as F:
+        html = markdown.markdown(
+            F.read(), extensions=['smarty'],
+            extension_configs={'smarty': {'substitutions': quotes}})
+    with open(dest, 'w', encoding='utf8') as F:
+        F.write(html + '\n')
+
+
+@converter(('odt', 'pdf'), ('ods', 'pdf'), ('odp', 'pdf'), tool='soffice')
+def _office_to_pdf(src, dest, formats=None):
+    """
+    Convert office documents to pdf in a warm LibreOffice worker.
+    """
+    odt_to_pdf(src, dest)
@@ -2,14 +2,18 @@
 Load and locate YAML resources from the /data/ folder of a project.
 """
 
+import csv
 import os
+import sqlite3
 from collections import defaultdict
-from functools import lru_cache
+from collections.abc import Mapping
 from pathlib import Path
 
+from .cache import ResourceCache
+
 TYPE_PRIORITY = [
     # Collection formats
-    'pickle', 'csv', 'xlsx', 'xls', 'html', 'xml', 'sqlite', 'ini',
+    'pickle', 'csv', 'xlsx', 'xls', 'ods', 'html', 'xml', 'sqlite', 'ini',
 
     # Individual formats
     'yml', 'json',
@@ -34,19 +38,8 @@ def load_for(for_, base=None):
     Return:
         A dictionary mapping resource names to values.
     """
-
-    get_name = (lambda x: os.path.splitext(x.parts[-1])[0])
-    base = (Path(base or '.')).absolute()
-    datadir = base / 'data'
-
-    # Collect names
-    names = defaultdict(list)
-    for path in datadir.iterdir():
-        names[get_name(path)].append(path)
-
-    # Create namespace
-    ns = {name: resource(paths, for_) for name, paths in names.items()}
-    return ns
+    with namespace_builder(base) as builder:
+        return builder.namespace(for_)
 
 
 def path_priority(path):
@@ -69,12 +62,21 @@ def resource(paths, for_):
     * Files have preference over directories
     * Priority is defined by extension in the order of TYPE_PRIORITY
     """
+    path = select_path(paths)
+    return None if path is None else resource_from_path(path, for_)
+
+
+def select_path(paths):
+    """
+    Select which path of a group of paths sharing the same resource name
+    should be used to load the resource.
+    """
     if len(paths) == 0:
         return None
     elif len(paths) == 1:
-        return resource_from_path(paths[0], for_)
+        return paths[0]
     else:
-        return resource_from_path(sorted(paths, key=path_priority)[0], for_)
+        return max(paths, key=path_priority)
 
 
 def resource_from_path(path, for_):
@@ -86,8 +88,11 @@ def resource_from_path(path, for_):
     if path.is_dir():
         path = path / (for_ + '.yml')
         return load_yaml(path) if path.exists() else None
-    elif ext == 'yml':
-        return load_yaml(path)
+    elif ext in LOADER_MAP:
+        data = LOADER_MAP[ext](path)
+        if isinstance(data, Collection) and for_ is not None:
+            return data.get(for_)
+        return data
 
 
 def load_all(reference=None, base=None):
@@ -95,21 +100,485 @@ def load_all(reference=None, base=None):
     Return a mapping of each entity to namespace using the given path as reference
     to locate entity values.
     """
-    base = (Path(base or '.')).absolute()
+    with namespace_builder(base) as builder:
+        return {name: builder.namespace(name)
+                for name in builder.entities(reference)}
+
+
+def namespace_builder(base=None):
+    """
+    Return an object that builds namespaces for the entities of a project.
+
+    It uses the compiled SQLite store if "buroca db compile" was executed for
+    the project and the store is up-to-date with the data/ folder, and a
+    :class:`NamespaceBuilder` otherwise. Both implement the namespace(for_)
+    and entities(reference=None) methods and can be used in a with block
+    that releases their resources.
+    """
+    from .store import open_store
+
+    store = open_store(base)
+    if store is None:
+        return NamespaceBuilder(base)
+    if store.is_up_to_date():
+        return store
+    store.close()
+    return NamespaceBuilder(base)
+
+
+class NamespaceBuilder:
+    """
+    Build namespaces for many entities of a project.
+
+    The data/ folder is scanned a single time and global resources (files
+    directly under data/) are loaded once, when first needed, and shared by
+    all namespaces. Only the resources stored in sub-folders or in
+    collections (files that hold many entities, see :class:`Collection`) are
+    looked up for each entity.
+
+    Args:
+        base (str):
+            Project directory. Must contain a /data/ folder with yaml files.
+    """
+
+    def __init__(self, base=None):
+        self.base = (Path(base or '.')).absolute()
+        self.datadir = self.base / 'data'
+
+        # Collect names
+        names = defaultdict(list)
+        for path in self.datadir.iterdir():
+            names[_resource_name(path)].append(path)
+        self.paths = {name: select_path(paths) for name, paths in names.items()}
+        self.folders = {name: path for name, path in self.paths.items()
+                        if path.is_dir()}
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Release resources. Builders hold no open files, so this does nothing.
+        """
+
+    def names(self):
+        """
+        Return a list with all resource names.
+        """
+        return list(self.paths)
+
+    def resource(self, name, for_):
+        """
+        Return the named resource for the given entity.
+        """
+        if name in self.folders:
+            return resource_from_path(self.folders[name], for_)
+
+        data = self._file(name)
+        if isinstance(data, Collection):
+            return data.get(for_)
+        return data
+
+    def namespace(self, for_, lazy=False, names=None):
+        """
+        Return the namespace for the given entity.
+
+        If lazy is True, return a :class:`LazyNamespace` that only loads
+        resources when they are accessed. If names is given, the namespace
+        only includes resources in this set.
+        """
+        if lazy:
+            return LazyNamespace(self, for_, names)
+        names = _filter_names(self.paths, names)
+        return {name: self.resource(name, for_) for name in names}
+
+    def sources(self, for_, names=None):
+        """
+        Return a list of data files read to build the namespace of the given
+        entity.
+
+        Files in sub-folders are listed even if they do not exist.
+        """
+        result = []
+        for name in _filter_names(self.paths, names):
+            if name in self.folders:
+                result.append(self.folders[name] / (for_ + '.yml'))
+            else:
+                result.append(self.paths[name])
+        return result
+
+    def entities(self, reference=None):
+        """
+        Return a list of entity names found in the reference sub-folder or
+        collection.
+
+        If no reference is given, it uses :func:`locate_entities` to find it.
+        Collections are only used as reference if data/ has no sub-folders.
+        """
+        if reference is None and not self.folders:
+            collections = [name for name in sorted(self.paths)
+                           if isinstance(self._file(name), Collection)]
+            reference = collections[0] if collections else None
+        if reference is None:
+            reference = locate_entities(self.base)
+
+        data = None if reference in self.folders else self._file(reference)
+        if isinstance(data, Collection):
+            return list(data.names())
+
+        resource_path = self.datadir / reference
+        return [_resource_name(path) for path in resource_path.iterdir()
+                if is_resource(path)]
+
+    def _file(self, name):
+        try:
+            return self._files[name]
+        except KeyError:
+            path = self.paths.get(name)
+            if path is None or path.is_dir():
+                return None
+            data = self._files[name] = resource_from_path(path, None)
+            return data
+
+
+class LazyNamespace(Mapping):
+    """
+    A namespace mapping that only loads resources when they are accessed.
+
+    Loaded values are memoized. Use :func:`templates.render` to render Jinja
+    templates without forcing all values.
+
+    Args:
+        builder:
+            A :class:`NamespaceBuilder` or compatible object that implements
+            the names() and resource(name, for_) methods.
+        for_ (str):
+            Entity name.
+        names:
+            If given, restrict the namespace to this set of resource names.
+    """
+
+    def __init__(self, builder, for_, names=None):
+        self.builder = builder
+        self.entity = for_
+        self._names = _filter_names(builder.names(), names)
+        self._values = {}
+
+    def __getitem__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            if name not in self._names:
+                raise
+            value = self._values[name] = self.builder.resource(name, self.entity)
+            return value
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __repr__(self):
+        return '<LazyNamespace for %r: %s>' % (self.entity, self._names)
+
+
+class Collection:
+    """
+    Base class for resources that store many entities in a single file.
+
+    Each entity is identified by the value of its key field.
+
+    Args:
+        path:
+            Path to the collection file.
+        key (str):
+            Name of the field that identifies each entity. Defaults to
+            DEFAULT_KEY.
+    """
+
+    def __init__(self, path, key=None):
+        self.path = path
+        self.key = key or DEFAULT_KEY
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def get(self, name, default=None):
+        """
+        Return the entity with the given name.
+        """
+        for key, value in self:
+            if key == name:
+                return value
+        return default
+
+    def names(self):
+        """
+        Iterate over all entity names.
+        """
+        return (key for key, _ in self)
+
+    def items(self):
+        """
+        Iterate over (name, entity) pairs.
+        """
+        return iter(self)
+
+    def _key_of(self, value, idx):
+        try:
+            return str(value[self.key])
+        except (KeyError, TypeError, IndexError):
+            msg = 'entry %s of %s has no %r field' % (idx, self.path, self.key)
+            raise ValueError(msg)
+
+
+class YamlStream(Collection):
+    """
+    A multi-document YAML file in which each document is an entity.
+
+    Documents are parsed lazily, only as far as needed to find the requested
+    entity, and are memoized afterwards.
+    """
+
+    def __init__(self, path, documents, key=None):
+        super().__init__(path, key)
+        self._documents = documents
+        self._index = {}
+        self._order = []
+
+    def __iter__(self):
+        for name in list(self._order):
+            yield name, self._index[name]
+        while self._documents is not None:
+            item = self._advance()
+            if item is not None:
+                yield item
+
+    def __getstate__(self):
+        self._consume()
+        return self.__dict__
+
+    def get(self, name, default=None):
+        while name not in self._index and self._documents is not None:
+            self._advance()
+        return self._index.get(name, default)
+
+    def _advance(self):
+        try:
+            value = next(self._documents)
+        except StopIteration:
+            self._documents = None
+            return None
+
+        name = self._key_of(value, len(self._order))
+        self._index[name] = value
+        self._order.append(name)
+        return name, value
+
+    def _consume(self):
+        while self._documents is not None:
+            self._advance()
+
+
+class IndexedCollection(Collection):
+    """
+    Base class for collections that can fetch a single entity without
+    scanning the whole file.
+
+    The index that maps entity names to locations in the file is built once,
+    on the first lookup. Subclasses must implement :meth:`_build_index` and
+    :meth:`_fetch`.
+    """
+
+    _index = None
 
-    # Choose the correct reference
-    if reference is None:
-        reference = locate_entities(base)
-    elif isinstance(reference, str):
-        pass
+    def get(self, name, default=None):
+        if self._index is None:
+            self._index = self._build_index()
+        try:
+            location = self._index[name]
+        except KeyError:
+            return default
+        return self._fetch(location)
 
-    resource_path = base / 'data' / reference
-    result = {}
-    for subpath in resource_path.iterdir():
-        if is_resource(subpath):
-            name = subpath.parts[-1].rpartition('.')[0]
-            result[name] = load_for(name, base)
-    return result
+    def names(self):
+        if self._index is None:
+            self._index = self._build_index()
+        return iter(self._index)
+
+    def _build_index(self):
+        raise NotImplementedError
+
+    def _fetch(self, location):
+        raise NotImplementedError
+
+
+class CsvCollection(IndexedCollection):
+    """
+    A CSV file with a header row in which each row is an entity.
+
+    The index maps entity names to the byte offset of their rows.
+    """
+
+    encoding = 'utf8'
+
+    def __iter__(self):
+        with open(self.path, 'rb') as F:
+            reader = csv.reader(self._lines(F))
+            header = self._header(next(reader))
+            for idx, row in enumerate(reader):
+                value = dict(zip(header, row))
+                yield self._key_of(value, idx), value
+
+    def _build_index(self):
+        index = {}
+        with open(self.path, 'rb') as F:
+            position = [0]
+            reader = csv.reader(self._lines(F, position))
+            self.header = self._header(next(reader))
+            start = position[0]
+            for idx, row in enumerate(reader):
+                value = dict(zip(self.header, row))
+                index[self._key_of(value, idx)] = start
+                start = position[0]
+        return index
+
+    def _fetch(self, location):
+        with open(self.path, 'rb') as F:
+            F.seek(location)
+            row = next(csv.reader(self._lines(F)))
+        return dict(zip(self.header, row))
+
+    def _lines(self, file, position=None):
+        for line in file:
+            if position is not None:
+                position[0] += len(line)
+            yield line.decode(self.encoding)
+
+    def _header(self, row):
+        if row:
+            row[0] = row[0].lstrip('\ufeff')
+        return row
+
+
+class SqliteCollection(IndexedCollection):
+    """
+    A table of a SQLite database in which each row is an entity.
+
+    It reads from the table with the same name as the file or from the single
+    table of the database. The index maps entity names to rowids.
+    """
+
+    _connection = None
+    _table_name = None
+
+    def __iter__(self):
+        cursor = self._cursor()
+        cursor.execute('SELECT * FROM %s' % self._table())
+        header = [col[0] for col in cursor.description]
+        for idx, row in enumerate(cursor):
+            value = dict(zip(header, row))
+            yield self._key_of(value, idx), value
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_connection', None)
+        return state
+
+    def _build_index(self):
+        cursor = self._cursor()
+        cursor.execute('SELECT rowid, %s FROM %s'
+                       % (_quote(self.key), self._table()))
+        return {str(key): rowid for rowid, key in cursor}
+
+    def _fetch(self, location):
+        cursor = self._cursor()
+        cursor.execute('SELECT * FROM %s WHERE rowid = ?' % self._table(),
+                       (location,))
+        header = [col[0] for col in cursor.description]
+        return dict(zip(header, cursor.fetchone()))
+
+    def _cursor(self):
+        if self._connection is None:
+            uri = Path(self.path).absolute().as_uri() + '?mode=ro'
+            # Documents may be rendered in the producer thread of a
+            # ConversionPipeline. Accesses are never concurrent.
+            self._connection = sqlite3.connect(uri, uri=True,
+                                               check_same_thread=False)
+        return self._connection.cursor()
+
+    def _table(self):
+        if self._table_name is None:
+            cursor = self._cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+            tables = [name for name, in cursor]
+            name = _resource_name(Path(self.path))
+            if name not in tables and len(tables) == 1:
+                name, = tables
+            elif name not in tables:
+                raise ValueError('cannot determine which table to use in %s'
+                                 % self.path)
+            self._table_name = _quote(name)
+        return self._table_name
+
+
+class SheetCollection(IndexedCollection):
+    """
+    The first sheet of a spreadsheet in which each row is an entity.
+
+    The first row must contain the column names.
+    """
+
+    def __init__(self, path, rows, key=None):
+        super().__init__(path, key)
+        if iter(rows) is rows:
+            rows = [tuple(row) for row in rows]
+        self.source = rows
+        self.header = None
+        self.rows = None
+
+    def __iter__(self):
+        rows = iter(self.source)
+        header = self._header(next(rows, ()))
+        for idx, row in enumerate(rows):
+            value = self._value(header, row)
+            yield self._key_of(value, idx), value
+
+    def _build_index(self):
+        rows = iter(self.source)
+        self.header = self._header(next(rows, ()))
+        self.rows = [tuple(row) for row in rows]
+        return {self._key_of(self._value(self.header, row), idx): idx
+                for idx, row in enumerate(self.rows)}
+
+    def _fetch(self, location):
+        return self._value(self.header, self.rows[location])
+
+    def _header(self, row):
+        return [str(col) for col in row]
+
+    def _value(self, header, row):
+        row = list(row)
+        row.extend([None] * (len(header) - len(row)))
+        return dict(zip(header, row))
+
+
+def _filter_names(names, selected):
+    if selected is None:
+        return list(names)
+    return [name for name in names if name in selected]
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
 
 
 def locate_entities(base):
@@ -149,6 +618,16 @@ def locate_entities(base):
 # File loaders
 #
 LOADER_MAP = {}
+COLLECTION_EXTENSIONS = set()
+
+# Collections use this field as key, unless the file name selects another
+# one, as in "person.name.csv"
+DEFAULT_KEY = 'id'
+
+# Parsed files are kept in memory while they do not change on disk. Use
+# RESOURCE_CACHE.resize() to change the budget.
+RESOURCE_CACHE = ResourceCache(max_bytes=256 * 2 ** 20)
+cached = RESOURCE_CACHE.cached
 
 
 def single_loader(ext):
@@ -163,19 +642,117 @@ def single_loader(ext):
     return decorator
 
 
+def collection_loader(ext):
+    """
+    Register function as a loader for a file extension that stores many
+    entities.
+
+    The loader must return a :class:`Collection` instance. The key field of
+    collections is given by file names such as "name.key.ext" and defaults
+    to :data:`DEFAULT_KEY`.
+    """
+    COLLECTION_EXTENSIONS.add(ext)
+    return single_loader(ext)
+
+
 @single_loader('yaml')
 @single_loader('yml')
-@lru_cache(1024)
+@cached(version=1)
 def load_yaml(path):
+    """
+    Load YAML file.
+
+    Files with multiple documents are loaded as a :class:`YamlStream`
+    collection.
+    """
     import yaml
-    return yaml.safe_load(open(path))
+
+    with open(path) as F:
+        data = F.read()
+
+    documents = yaml.load_all(data, Loader=yaml_loader())
+    first = next(documents, None)
+    try:
+        second = next(documents)
+    except StopIteration:
+        return first
+
+    return YamlStream(path, _chain_documents(first, second, documents))
 
 
 @single_loader('json')
-@lru_cache(1024)
+@cached
 def load_json(path):
     import json
-    return json.load(open(path))
+    with open(path) as F:
+        return json.load(F)
+
+
+@collection_loader('csv')
+@cached(version=1)
+def load_csv(path):
+    return CsvCollection(path, collection_key(path))
+
+
+@collection_loader('sqlite')
+@cached(version=1)
+def load_sqlite(path):
+    return SqliteCollection(path, collection_key(path))
+
+
+@collection_loader('ods')
+@cached(version=2)
+def load_ods(path):
+    from .readers import RowReader
+
+    return SheetCollection(path, RowReader(path), collection_key(path))
+
+
+@collection_loader('xlsx')
+@cached(version=2)
+def load_xlsx(path):
+    from .readers import RowReader
+
+    return SheetCollection(path, RowReader(path), collection_key(path))
+
+
+def collection_key(path):
+    """
+    Return the key field selected by the name of a collection file, or None.
+
+    "person.name.csv" is the "person" resource keyed by the "name" field.
+    """
+    return _split_name(Path(path).parts[-1])[1]
+
+
+def yaml_loader():
+    """
+    Return the fastest available safe YAML loader class.
+
+    Uses the LibYAML bindings if available, and falls back to the pure Python
+    implementation otherwise.
+    """
+    import yaml
+    return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def _chain_documents(first, second, documents):
+    yield first
+    yield second
+    yield from documents
+
+
+def _resource_name(path):
+    return _split_name(path.parts[-1])[0]
+
+
+def _split_name(file_name):
+    stem, ext = os.path.splitext(file_name)
+    if ext.lstrip('.') in COLLECTION_EXTENSIONS:
+        name, _, key = stem.rpartition('.')
+        if name and key:
+            return name, key
+    return stem, None
 
 
 def is_resource(file):
@@ -14,3 +14,24 @@ class SkipViewer(BurocaException):
     """
     Raised to tell that a viewer should be skipped.
     """
+
+
+class ConversionError(BurocaException):
+    """
+    Error raised when an external converter fails.
+    """
+
+    def __init__(self, cmd, returncode, stderr=''):
+        self.cmd = list(cmd)
+        self.returncode = returncode
+        self.stderr = stderr
+        msg = '%s exited with code %s' % (self.cmd[0], returncode)
+        if stderr.strip():
+            msg += ':\n' + stderr.strip()
+        super().__init__(msg)
+
+
+class PdfError(BurocaException):
+    """
+    Error raised when a PDF file cannot be read.
+    """
@@ -1,3 +1,12 @@
+import collections
+import contextlib
+import copy
+import html
+import io
+import itertools
+import os
+import re
+import struct
 import zipfile
 
 import lxml.etree as ET
@@ -5,7 +14,7 @@ from lazyutils import lazy
 from lxml.etree import XMLSyntaxError
 
 from .convert import _libreoffice_headless
-from .templates import as_template
+from .templates import as_template, find_dependencies, generate, render
 
 
 class DocTemplate:
@@ -21,6 +30,7 @@ class DocTemplate:
     }
 
     zipfile = lazy(lambda self: zipfile.ZipFile(self.path))
+    includes = ()
 
     def xml_tree(self):
         file = self.zipfile.open('content.xml')
@@ -30,44 +40,86 @@ class DocTemplate:
         self.is_closed = False
         self.path = path
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @lazy
+    def static_members(self):
+        """
+        Compressed zip members that are copied unchanged to every rendered
+        document.
+        """
+        return StaticMembers(self.zipfile, exclude=['content.xml'])
+
+    @lazy
+    def content(self):
+        """
+        Source of content.xml with split Jinja tags repaired.
+        """
+        return repair_jinja_tags(ET.tounicode(self.xml_tree().getroot()))
+
+    @lazy
+    def template(self):
+        """
+        Compiled Jinja template that renders content.xml.
+
+        Only the office:body element is treated as a template. The XML
+        processing and the Jinja compilation happen once and the template is
+        reused for every rendered document.
+        """
+        head, body, tail = _split_body(self.content)
+        return _BodyTemplate(head, as_template(body), tail)
+
+    @lazy
+    def dependencies(self):
+        """
+        Set of top-level variables used by the template.
+        """
+        return find_dependencies(_split_body(self.content)[1])
+
     def _check_open(self):
         if self.is_closed:
             raise RuntimeError('operation cannot be realized on closed file.')
 
     def render_template(self, namespace):
         """
-        Apply template at content.xml and write back on the zipfile.
+        Render content.xml with the given namespace and return it as a string.
         """
         self._check_open()
-
-        xml_root = self.xml_tree().getroot()
-        non_rendered = [xml_root.find('office:body', self.xmlns)]
-
-        while non_rendered:
-            node = non_rendered.pop()
-            node[:] = render_node(node, namespace)
-
-        return ET.tounicode(xml_root)
+        data = ''.join(self.template.generate(namespace))
+        try:
+            ET.fromstring(data.encode('utf8'))
+        except XMLSyntaxError:
+            raise ValueError('cannot create document from template!')
+        return data
 
     def render_at(self, namespace, dest):
         """
         Render template and save result on the given destination.
+
+        The rendered content.xml is written to the zip file in chunks while
+        Jinja produces it, and an incremental parser fed with the same
+        chunks checks that it is well formed. Other members are copied
+        without recompressing them. The template is not closed, so it can
+        render many documents.
         """
         self._check_open()
-        data = self.render_template(namespace)
 
-        with zipfile.ZipFile(dest, 'w') as zip:
-            for file in self.zipfile.namelist():
-                if file == 'content.xml':
-                    continue
-                with zip.open(file, 'w') as dest_file:
-                    with self.zipfile.open(file) as src_file:
-                        dest_file.write(src_file.read())
-
-            with zip.open('content.xml', 'w') as F:
-                F.write(data.encode('utf8'))
-
-        self.close()
+        # Errors opening dest propagate unchanged, and only files created
+        # here are removed
+        zip = zipfile.ZipFile(dest, 'w', zipfile.ZIP_DEFLATED)
+        try:
+            with zip:
+                self.static_members.write_to(zip)
+                with zip.open('content.xml', 'w') as F:
+                    write_xml_chunks(F, self.template.generate(namespace))
+        except Exception:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(dest)
+            raise
 
     def close(self):
         """
@@ -78,23 +130,292 @@ class DocTemplate:
         self.is_closed = True
 
 
-class CalcTemplate(DocTemplate):
+class StaticMembers:
     """
-    Process LibreOffice calc templates.
+    Raw compressed bytes of zip members that do not change between rendered
+    documents, kept in memory so they can be written to many zip files
+    without inflating and deflating them again.
+
+    The "mimetype" member is always the first one and is stored without
+    compression, as required by the open document format.
+
+    Args:
+        src (zipfile.ZipFile):
+            Source zip file.
+        exclude:
+            Names of members that are not copied.
     """
 
-    def render_template(self, namespace):
+    def __init__(self, src, exclude=()):
+        self.data = self.infos = self.members = None
+        members = []
+        if 'mimetype' in src.namelist():
+            info = zipfile.ZipInfo('mimetype', (1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_STORED
+            members.append((info, src.read('mimetype')))
+        infos = [info for info in src.infolist()
+                 if info.filename != 'mimetype' and info.filename not in exclude]
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zip:
+            if not _can_copy_raw(zip):
+                self.members = members + [(info, src.read(info))
+                                          for info in infos]
+                return
+            for info, data in members:
+                zip.writestr(info, data)
+            with open(src.filename, 'rb') as file:
+                for info in infos:
+                    _copy_raw(file, info, zip)
+            self.infos = zip.infolist()
+            self.data = buffer.getvalue()[:zip.start_dir]
+
+    def write_to(self, zip):
         """
-        Apply template at content.xml and write back on the zipfile.
+        Write all members to a zip file opened for writing.
         """
-        self._check_open()
+        if self.members is not None:
+            for info, data in self.members:
+                zip.writestr(copy.copy(info), data)
+            return
+
+        offset = zip.fp.tell()
+        zip.fp.write(self.data)
+        for info in self.infos:
+            info = copy.copy(info)
+            info.header_offset += offset
+            zip.filelist.append(info)
+            zip.NameToInfo[info.filename] = info
+        zip.start_dir = zip.fp.tell()
+        zip._didModify = True
+
+
+def _can_copy_raw(zip):
+    """
+    Raw copies rely on private attributes of zipfile.ZipFile. Members are
+    decompressed and written with writestr() if they are not available.
+    """
+    return all(hasattr(zip, name) for name in
+               ('fp', 'start_dir', '_didModify', 'filelist', 'NameToInfo'))
+
 
-        xml_root = self.xml_tree().getroot()
-        cells = xml_root.findall('table:cell')
+def _copy_raw(file, info, zip):
+    """
+    Copy the compressed data of a member from a source zip file object to
+    a ZipFile opened for writing.
+    """
+    file.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader,
+                           file.read(zipfile.sizeFileHeader))
+    name_length, extra_length = header[-2:]
+    file.seek(name_length + extra_length, io.SEEK_CUR)
+    data = file.read(info.compress_size)
+
+    info = copy.copy(info)
+    info.flag_bits &= ~0x08  # sizes are written in the local header
+    info.header_offset = zip.fp.tell()
+    zip.fp.write(info.FileHeader())
+    zip.fp.write(data)
+    zip.filelist.append(info)
+    zip.NameToInfo[info.filename] = info
+    zip.start_dir = zip.fp.tell()
+    zip._didModify = True
+
+
+class _BodyTemplate:
+    """
+    A compiled office:body template surrounded by static XML.
+    """
 
-        for cell in cells:
-            cell[:] = render_node(cell, namespace)
-        return ET.tounicode(xml_root)
+    def __init__(self, head, body, tail):
+        self.head = head
+        self.body = body
+        self.tail = tail
+
+    def generate(self, namespace):
+        yield self.head
+        yield from generate(self.body, namespace)
+        yield self.tail
+
+
+class CalcTemplate(DocTemplate):
+    """
+    Process LibreOffice calc templates.
+
+    Only cells that contain Jinja tags are rendered. A row in which some
+    cell starts with a {% for ... %} tag that is not closed in the same row
+    is repeated once for each item of the loop.
+    """
+
+    @lazy
+    def template(self):
+        return _SheetTemplate(self.content)
+
+    @lazy
+    def dependencies(self):
+        return self.template.dependencies
+
+
+class _SheetTemplate:
+    """
+    Templated cells and rows of a spreadsheet, indexed and compiled once.
+
+    The document is stored as a list of segments: static XML strings and
+    objects that render a cell, a repeated row or the trailing empty rows of
+    a table.
+    """
+
+    def __init__(self, xml):
+        root = ET.fromstring(xml)
+        specs = []
+
+        for table_idx, table in enumerate(root.iter(TABLE + 'table')):
+            rows = list(table.iter(TABLE + 'table-row'))
+            has_loops = False
+            for row in rows:
+                text = ''.join(row.itertext())
+                if not _has_jinja(text):
+                    continue
+                if _LOOP_TAG.search(text) and 'endfor' not in text:
+                    row.attrib.pop(TABLE + 'number-rows-repeated', None)
+                    specs.append(('loop', table_idx))
+                    _mark(row, len(specs) - 1)
+                    has_loops = True
+                    continue
+                for cell in row.iter(TABLE + 'table-cell'):
+                    if _has_jinja(''.join(cell.itertext())):
+                        specs.append(('cell', table_idx))
+                        _mark(cell, len(specs) - 1)
+
+            # Rows added by loops are taken from the block of repeated empty
+            # rows that usually ends a table, so the sheet size is preserved.
+            last = rows[-1] if rows else None
+            repeat = TABLE + 'number-rows-repeated'
+            if has_loops and int(last.get(repeat, 1)) > 1 \
+                    and not _has_jinja(''.join(last.itertext())):
+                specs.append(('padding', table_idx))
+                _mark(last, len(specs) - 1)
+
+        self.segments = []
+        sources = []
+        pos = 0
+        xml = ET.tounicode(root)
+        for match in _MARKED.finditer(xml):
+            kind, table_idx = specs[int(match.group(1))]
+            source = match.group(2)
+            self.segments.append(xml[pos:match.start()])
+            self.segments.append(_SEGMENT_TYPES[kind](source, table_idx))
+            if kind != 'padding':
+                sources.append(self.segments[-1].source)
+            pos = match.end()
+        self.segments.append(xml[pos:])
+        self.sources = sources
+
+    @lazy
+    def dependencies(self):
+        result = set()
+        for source in self.sources:
+            names = find_dependencies(source)
+            if names is None:
+                return None
+            result.update(names)
+        return result
+
+    def generate(self, namespace):
+        added_rows = collections.Counter()
+        for segment in self.segments:
+            if isinstance(segment, str):
+                yield segment
+            else:
+                yield from segment.generate(namespace, added_rows)
+
+
+class _Cell:
+    def __init__(self, source, table_idx):
+        self.source = source
+        self.template = as_template(source)
+
+    def generate(self, namespace, added_rows):
+        yield render(self.template, namespace)
+
+
+class _RowLoop:
+    """
+    A row repeated for each item of a loop.
+
+    The row is rendered by a single Jinja loop. Consecutive identical rows
+    are collapsed into a single element with table:number-rows-repeated.
+    """
+
+    def __init__(self, source, table_idx):
+        match = _LOOP_TAG.search(source)
+        row = source[:match.start()] + source[match.end():]
+        self.source = '%s%s%s{%% endfor %%}' % (match.group(), row, _ROW_END)
+        self.template = as_template(self.source)
+        self.table_idx = table_idx
+
+    def generate(self, namespace, added_rows):
+        rows = render(self.template, namespace).split(_ROW_END)[:-1]
+        added_rows[self.table_idx] += len(rows) - 1
+        for row, group in itertools.groupby(rows):
+            count = sum(1 for _ in group)
+            if count > 1:
+                row = row.replace(
+                    '<table:table-row',
+                    '<table:table-row table:number-rows-repeated="%s"' % count,
+                    1)
+            yield row
+
+
+class _Padding:
+    """
+    A block of repeated rows that shrinks by the number of rows added to the
+    table.
+    """
+
+    def __init__(self, source, table_idx):
+        match = re.search(r'table:number-rows-repeated="(\d+)"', source)
+        self.head = source[:match.start(1)]
+        self.tail = source[match.end(1):]
+        self.count = int(match.group(1))
+        self.table_idx = table_idx
+
+    def generate(self, namespace, added_rows):
+        count = max(1, self.count - added_rows[self.table_idx])
+        yield '%s%s%s' % (self.head, count, self.tail)
+
+
+TABLE = '{urn:oasis:names:tc:opendocument:xmlns:table:1.0}'
+_SEGMENT_TYPES = {'cell': _Cell, 'loop': _RowLoop, 'padding': _Padding}
+_LOOP_TAG = re.compile(r'\{%-?\s*for\s.*?%\}', re.DOTALL)
+_MARKED = re.compile(r'<\?buroca (\d+)\?>(.*?)<\?buroca-end ?\?>', re.DOTALL)
+_ROW_END = '\x00'
+
+
+def _has_jinja(text):
+    return '{{' in text or '{%' in text
+
+
+def _mark(element, idx):
+    """
+    Surround element with processing instructions, so its source can be
+    found after the tree is serialized.
+    """
+    tail, element.tail = element.tail, None
+    element.addprevious(ET.ProcessingInstruction('buroca', str(idx)))
+    end = ET.ProcessingInstruction('buroca-end')
+    end.tail = tail
+    element.addnext(end)
+
+
+def open_template(path):
+    """
+    Return a :class:`CalcTemplate` for spreadsheets and a
+    :class:`DocTemplate` for other open document files.
+    """
+    if str(path).endswith('.ods'):
+        return CalcTemplate(path)
+    return DocTemplate(path)
 
 
 def render_open_doc_template(template, dest, data):
@@ -112,8 +433,94 @@ def render_open_doc_template(template, dest, data):
     Returns:
         Nothing
     """
-    doc_template = DocTemplate(template)
-    doc_template.render_at(data, dest)
+    with open_template(template) as doc_template:
+        doc_template.render_at(data, dest)
+
+
+def write_xml_chunks(file, chunks, size=2 ** 16):
+    """
+    Write an iterable of XML string chunks to a binary file and check that
+    the result is well formed.
+
+    Chunks are grouped in blocks of about the given size, encoded and fed to
+    an incremental parser that does not build a tree, so the document is
+    never fully held in memory.
+
+    Raises:
+        ValueError: if the XML is not well formed.
+    """
+    parser = ET.XMLParser(target=_NullTarget())
+    buffer = []
+    buffered = 0
+
+    def flush():
+        data = ''.join(buffer).encode('utf8')
+        buffer.clear()
+        parser.feed(data)
+        file.write(data)
+
+    try:
+        for chunk in chunks:
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if buffered >= size:
+                flush()
+                buffered = 0
+        flush()
+        parser.close()
+    except XMLSyntaxError:
+        raise ValueError('cannot create document from template!')
+
+
+class _NullTarget:
+    """
+    Parser target that discards all events.
+    """
+
+    def close(self):
+        return None
+
+
+def repair_jinja_tags(xml):
+    """
+    Repair Jinja tags that an office suite split across XML elements.
+
+    Editors often break a tag such as {{ name }} into several text spans.
+    XML tags found inside Jinja delimiters are moved right after the Jinja
+    tag, which keeps the element structure valid, and XML entities and
+    typographic quotes are converted back to plain characters.
+    """
+    xml = _SPLIT_OPEN_DELIMITER.sub(r'\1{\2', xml)
+    xml = _SPLIT_CLOSE_DELIMITER.sub(r'\1}\2', xml)
+    return _JINJA_TAG.sub(_repair_tag, xml)
+
+
+_XML_TAG = re.compile(r'<[^>]*>')
+_SPLIT_OPEN_DELIMITER = re.compile(r'\{((?:<[^>]*>)+)([{%#])')
+_SPLIT_CLOSE_DELIMITER = re.compile(r'([}%#])((?:<[^>]*>)+)\}')
+_JINJA_TAG = re.compile(r'(\{\{|\{%|\{#)(.*?)(\}\}|%\}|#\})', re.DOTALL)
+_QUOTES = str.maketrans({'\u201c': '"', '\u201d': '"', '\u2018': "'",
+                         '\u2019': "'"})
+
+
+def _repair_tag(match):
+    start, code, end = match.groups()
+    tags = ''.join(_XML_TAG.findall(code))
+    code = html.unescape(_XML_TAG.sub('', code)).translate(_QUOTES)
+    return start + code + end + tags
+
+
+def _split_body(xml):
+    """
+    Split content.xml source into (head, body, tail), where body is the
+    contents of the office:body element.
+    """
+    start = xml.find('<office:body')
+    end = xml.rfind('</office:body>')
+    if start == -1 or end == -1:
+        return '', xml, ''
+    start = xml.index('>', start) + 1
+    return xml[:start], xml[start:end], xml[end:]
 
 
 def render_node(node, namespace):
@@ -124,7 +531,7 @@ def render_node(node, namespace):
     """
 
     data = ET.tounicode(node)
-    rendered = as_template(data).render(namespace)
+    rendered = render(as_template(data), namespace)
     try:
         return ET.fromstring(rendered)
     except XMLSyntaxError:
@@ -138,7 +545,8 @@ def launch_calc(fname):
     """
     return _libreoffice_headless(
         '--calc',
-        '--accept="socket,'
-        'host=localhost,port=2002;urp;StarOffice.ServiceManager"',
+        '--accept=socket,'
+        'host=localhost,port=2002;urp;StarOffice.ServiceManager',
         fname,
+        wait=False,
     )
@@ -0,0 +1,341 @@
+"""
+A pool of long-lived headless LibreOffice processes for document conversions.
+
+LibreOffice takes several seconds to start. Workers in the pool are started
+once and receive conversion jobs through UNO, each with its own user profile
+directory, so they can run side by side. If the UNO bindings are not
+installed, workers fall back to one "soffice --convert-to" call per job that
+still reuses a warm user profile.
+"""
+
+import atexit
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from .errors import ConversionError
+
+SOFFICE = 'soffice'
+PDF_FILTERS = {
+    'odt': 'writer_pdf_Export',
+    'ods': 'calc_pdf_Export',
+    'odp': 'impress_pdf_Export',
+    'odg': 'draw_pdf_Export',
+}
+
+
+class OfficePool:
+    """
+    A pool of headless LibreOffice workers.
+
+    Workers are started on demand, checked before each job, restarted after
+    a fixed number of jobs and stopped on shutdown.
+
+    Args:
+        size (int):
+            Maximum number of workers. Defaults to the number of CPUs.
+        max_jobs (int):
+            Restart a worker after it executes this number of jobs.
+        worker_factory (callable):
+            A function that returns new (not started) workers. Defaults to
+            :func:`new_worker`.
+    """
+
+    def __init__(self, size=None, max_jobs=100, worker_factory=None):
+        self.size = size or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.worker_factory = worker_factory or new_worker
+        self.workers = []
+        self.is_closed = False
+        self._idle = []
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def convert(self, src, dest, fmt=None):
+        """
+        Convert src file to dest using one of the workers.
+
+        If fmt is not given, it is inferred from the dest extension.
+        """
+        fmt = fmt or os.path.splitext(dest)[-1].lstrip('.')
+        worker = self._acquire()
+        try:
+            worker.convert(os.path.abspath(src), os.path.abspath(dest), fmt)
+        except Exception:
+            self._release(worker, restart=True)
+            raise
+        else:
+            self._release(worker, restart=worker.jobs >= self.max_jobs)
+
+    def shutdown(self):
+        """
+        Stop all workers.
+        """
+        with self._cond:
+            self.is_closed = True
+            workers, self.workers = self.workers, []
+            self._idle = []
+            self._cond.notify_all()
+        for worker in workers:
+            worker.stop()
+
+    def _acquire(self):
+        """
+        Return an idle worker, or start a new one if the pool is not full.
+        Otherwise, wait until a worker is released or discarded.
+        """
+        with self._cond:
+            while not self._idle and len(self.workers) >= self.size:
+                if self.is_closed:
+                    break
+                self._cond.wait()
+            if self.is_closed:
+                raise RuntimeError('pool was shut down')
+            if self._idle:
+                worker = self._idle.pop()
+                is_new = False
+            else:
+                # Reserve a slot, the worker is started without the lock
+                worker = self.worker_factory()
+                self.workers.append(worker)
+                is_new = True
+
+        try:
+            if is_new:
+                worker.start()
+            elif not worker.is_alive():
+                worker.stop()
+                worker.start()
+        except Exception:
+            self._discard(worker)
+            raise
+        return worker
+
+    def _release(self, worker, restart=False):
+        if restart and not self.is_closed:
+            try:
+                worker.stop()
+                worker.start()
+            except Exception:
+                self._discard(worker)
+                return
+        with self._cond:
+            if not self.is_closed:
+                self._idle.append(worker)
+                self._cond.notify()
+
+    def _discard(self, worker):
+        """
+        Stop a broken worker and free its slot for a replacement.
+        """
+        worker.stop()
+        with self._cond:
+            if worker in self.workers:
+                self.workers.remove(worker)
+            self._cond.notify()
+
+
+class OfficeWorker:
+    """
+    A headless soffice process that accepts UNO connections on a local
+    socket.
+    """
+
+    startup_timeout = 60
+
+    def __init__(self):
+        self.process = None
+        self.profile = None
+        self.port = None
+        self.desktop = None
+        self.jobs = 0
+
+    def start(self):
+        """
+        Start soffice and wait until it accepts connections.
+        """
+        import uno
+
+        self.jobs = 0
+        self.port = _free_port()
+        self.profile = tempfile.mkdtemp(prefix='buroca-soffice-')
+        accept = ('socket,host=127.0.0.1,port=%s;urp;StarOffice.ComponentContext'
+                  % self.port)
+        self.process = subprocess.Popen(
+            _soffice_args(self.profile, '--accept=' + accept),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext(
+            'com.sun.star.bridge.UnoUrlResolver', local)
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            try:
+                context = resolver.resolve('uno:%s' % accept)
+                break
+            except Exception:
+                exited = self.process.poll() is not None
+                if exited or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError('could not start LibreOffice')
+                time.sleep(0.25)
+
+        self.desktop = context.ServiceManager.createInstanceWithContext(
+            'com.sun.star.frame.Desktop', context)
+
+    def convert(self, src, dest, fmt):
+        """
+        Convert src file to dest.
+        """
+        import uno
+
+        self.jobs += 1
+        doc = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(src), '_blank', 0, _properties(Hidden=True))
+        if doc is None:
+            raise ConversionError([SOFFICE, src], 1, 'cannot load document')
+        try:
+            doc.storeToURL(uno.systemPathToFileUrl(dest),
+                           _properties(FilterName=_filter_name(src, fmt)))
+        finally:
+            doc.close(True)
+
+    def is_alive(self):
+        """
+        Check if the process is running and responding.
+        """
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            self.desktop.getFrames()
+        except Exception:
+            return False
+        return True
+
+    def stop(self):
+        """
+        Terminate soffice and remove the user profile.
+        """
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        _stop_process(self.process)
+        self.process = None
+        if self.profile is not None:
+            shutil.rmtree(self.profile, ignore_errors=True)
+            self.profile = None
+
+
+class CommandWorker:
+    """
+    A stand-in for :class:`OfficeWorker` used when UNO is not available.
+
+    Each job executes "soffice --convert-to", but all jobs of a worker share
+    the same warm user profile.
+    """
+
+    def __init__(self):
+        self.profile = None
+        self.jobs = 0
+
+    def start(self):
+        self.jobs = 0
+        self.profile = tempfile.mkdtemp(prefix='buroca-soffice-')
+
+    def convert(self, src, dest, fmt):
+        self.jobs += 1
+        with tempfile.TemporaryDirectory() as outdir:
+            args = _soffice_args(self.profile, '--convert-to', fmt,
+                                 '--outdir', outdir, src)
+            result = subprocess.run(args, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            out = Path(outdir) / (Path(src).stem + '.' + fmt)
+            if result.returncode != 0 or not out.exists():
+                output = result.stdout.decode('utf8', 'replace')
+                raise ConversionError(args, result.returncode, output)
+            shutil.move(str(out), dest)
+
+    def is_alive(self):
+        return self.profile is not None
+
+    def stop(self):
+        if self.profile is not None:
+            shutil.rmtree(self.profile, ignore_errors=True)
+            self.profile = None
+
+
+def new_worker():
+    """
+    Return a new :class:`OfficeWorker`, or a :class:`CommandWorker` if the
+    UNO bindings are not installed.
+    """
+    try:
+        import uno  # noqa: F401
+    except ImportError:
+        return CommandWorker()
+    return OfficeWorker()
+
+
+_DEFAULT_POOL = None
+
+
+def default_pool():
+    """
+    Return the process-wide pool. It is shut down when the interpreter exits.
+    """
+    global _DEFAULT_POOL
+    if _DEFAULT_POOL is None or _DEFAULT_POOL.is_closed:
+        _DEFAULT_POOL = OfficePool()
+        atexit.register(_DEFAULT_POOL.shutdown)
+    return _DEFAULT_POOL
+
+
+#
+# Auxiliary functions
+#
+def _soffice_args(profile, *args):
+    return [SOFFICE, '--headless', '--invisible', '--nologo', '--norestore',
+            '--nodefault', '--nolockcheck',
+            '-env:UserInstallation=' + Path(profile).as_uri(), *args]
+
+
+def _filter_name(src, fmt):
+    ext = os.path.splitext(src)[-1].lstrip('.').lower()
+    if fmt == 'pdf':
+        return PDF_FILTERS.get(ext, 'writer_pdf_Export')
+    raise ValueError('unsupported output format: %s' % fmt)
+
+
+def _properties(**kwargs):
+    from com.sun.star.beans import PropertyValue
+    return tuple(PropertyValue(Name=k, Value=v) for k, v in kwargs.items())
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _stop_process(process, timeout=10):
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
@@ -1,6 +1,7 @@
 import glob
 import os
 import pathlib
+import re
 from contextlib import contextmanager
 
 import click
@@ -27,6 +28,11 @@ def project_path(*args):
     return os.path.join(os.getcwd(), *args)
 
 
+def buroca_path(*args, base=None):
+    "Return a subpath into the project's .buroca/ folder"
+    return pathlib.Path(base or os.getcwd()).absolute().joinpath(BUROCA_DIR, *args)
+
+
 def expand_glob(*args):
     "Expand glob pattern inside the project's directory."
 
@@ -35,6 +41,19 @@ def expand_glob(*args):
     return data
 
 
+def natural_key(path):
+    """
+    Sort key that orders numbers inside names by value, so "report-2" comes
+    before "report-10".
+
+    >>> sorted(['a-10.pdf', 'a-2.pdf', 'a-1.pdf'], key=natural_key)
+    ['a-1.pdf', 'a-2.pdf', 'a-10.pdf']
+    """
+    parts = re.split(r'(\d+)', str(path))
+    return [(0, int(part), part) if part.isdigit() else (1, part.lower(), part)
+            for part in parts]
+
+
 @contextmanager
 def workdir(path):
     """
@@ -64,6 +83,17 @@ def name_for(template, for_, type=None):
     return pathlib.Path('%s-%s.%s' % (base, for_, ext))
 
 
+def joined_name_for(template, type=None):
+    """
+    Convert "template.ext" to the name of the file that joins the reports of
+    all entities.
+    """
+    base, ext = os.path.splitext(template)
+    if type is not None:
+        ext = '.' + EXT_ALIASES.get(type, type)
+    return pathlib.Path(base + ext)
+
+
 def as_report_path(path):
     """
     Convert a path at templates/ or data/ to reports
@@ -91,6 +121,7 @@ def normalize_path(template, required='templates/', glob=False):
     return path
 
 
+BUROCA_DIR = '.buroca'
 EXT_ALIASES = {
     'markdown': 'md',
     'latex': 'tex',
@@ -0,0 +1,661 @@
+"""
+Merge PDF files without re-rendering them.
+
+Pages of the input files are copied to the output together with all objects
+they reference (fonts, images, content streams, annotations, etc). Stream
+data is copied verbatim. Each input file is processed and written before the
+next one is opened, so memory use is bounded by the largest input instead of
+by the total number of pages.
+
+The reader understands classic cross-reference tables, cross-reference
+streams, object streams and incremental updates. Encrypted files are not
+supported.
+"""
+
+import mmap
+import os
+import re
+import zlib
+from array import array
+from collections import namedtuple
+
+from .errors import PdfError
+
+# Attributes that pages inherit from their ancestors in the page tree
+INHERITABLE = ('Resources', 'MediaBox', 'CropBox', 'Rotate')
+
+# Page attributes that point to document-level structures
+DROPPED_PAGE_KEYS = ('Parent', 'B', 'StructParents', 'PieceInfo')
+
+HEADER = b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n'
+
+
+def merge_pdfs(files, dest):
+    """
+    Join the pages of all input PDF files in a single document.
+
+    Args:
+        files:
+            A sequence of paths to the input files. Pages are joined in this
+            order.
+        dest:
+            Path to the output file.
+
+    Returns:
+        The number of pages in the output file.
+    """
+    dest = str(dest)
+    try:
+        with open(dest, 'wb') as file:
+            writer = PdfWriter(file)
+            catalog = writer.reserve()
+            root = writer.reserve()
+            kids = []
+            count = 0
+            for path in files:
+                with PdfReader(path) as reader:
+                    node, pages = _copy_pages(reader, writer, root)
+                kids.append(node)
+                count += pages
+            writer.write(root, {'Type': Name('Pages'), 'Kids': kids,
+                                'Count': count})
+            writer.write(catalog, {'Type': Name('Catalog'), 'Pages': root})
+            writer.close(catalog)
+    except BaseException:
+        if os.path.exists(dest):
+            os.unlink(dest)
+        raise
+    return count
+
+
+def _copy_pages(reader, writer, parent):
+    """
+    Copy all pages of reader as children of a new /Pages node and return
+    (node, number of pages).
+    """
+    node = writer.reserve()
+    pages = list(reader.pages())
+    mapping = dict.fromkeys(reader.page_tree_nodes, node)
+    for ref, _ in pages:
+        mapping[ref] = writer.reserve()
+    pending = []
+
+    def remap(obj):
+        if isinstance(obj, Ref):
+            try:
+                return mapping[obj]
+            except KeyError:
+                new = mapping[obj] = writer.reserve()
+                pending.append((obj, new))
+                return new
+        elif isinstance(obj, dict):
+            result = {k: remap(v) for k, v in obj.items()}
+            return Stream(result, obj.data) if isinstance(obj, Stream) \
+                else result
+        elif isinstance(obj, list):
+            return [remap(x) for x in obj]
+        return obj
+
+    kids = []
+    for ref, page in pages:
+        page = {k: v for k, v in page.items() if k not in DROPPED_PAGE_KEYS}
+        page = remap(page)
+        page['Parent'] = node
+        writer.write(mapping[ref], page)
+        kids.append(mapping[ref])
+        while pending:
+            old, new = pending.pop()
+            writer.write(new, remap(reader.get(old)))
+
+    writer.write(node, {'Type': Name('Pages'), 'Parent': parent,
+                        'Kids': kids, 'Count': len(kids)})
+    return node, len(kids)
+
+
+#
+# PDF objects
+#
+class Ref(namedtuple('Ref', ['num', 'gen'])):
+    """
+    A reference to an indirect object.
+    """
+
+
+class Name(str):
+    """
+    A PDF name, stored without the leading slash.
+    """
+
+
+class Raw(bytes):
+    """
+    A token that is copied verbatim to the output (strings and reals).
+    """
+
+
+class Stream(dict):
+    """
+    A stream object: its dictionary and the raw (encoded) data.
+    """
+
+    def __init__(self, dic, data):
+        super().__init__(dic)
+        self.data = data
+
+
+#
+# Reader
+#
+class PdfReader:
+    """
+    Random access to the objects of a PDF file.
+
+    Args:
+        path:
+            Path to the PDF file. It is memory mapped and should not change
+            while the reader is open.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._file = open(self.path, 'rb')
+        try:
+            self.buffer = mmap.mmap(self._file.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise PdfError('%s: empty file' % self.path)
+        self.xref = {}
+        self.trailer = {}
+        self.page_tree_nodes = set()
+        self._object_streams = {}
+        try:
+            self._load_xref()
+        except PdfError:
+            self.close()
+            raise
+        except (ValueError, IndexError, KeyError, TypeError, zlib.error) as ex:
+            self.close()
+            raise PdfError('%s: invalid PDF file (%s)' % (self.path, ex))
+        if 'Encrypt' in self.trailer:
+            self.close()
+            raise PdfError('%s: encrypted files are not supported' % self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Release the memory map and close the file.
+        """
+        self._object_streams.clear()
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+        self._file.close()
+
+    def get(self, ref):
+        """
+        Return the object with the given reference or None if it does not
+        exist.
+        """
+        try:
+            entry = self.xref.get(ref.num)
+            if entry is None:
+                return None
+            kind, a, b = entry
+            if kind == 1:
+                return self._read_indirect(a)[1]
+            return self._read_compressed(a, b)
+        except PdfError:
+            raise
+        except (ValueError, IndexError, KeyError, TypeError, zlib.error) as ex:
+            raise PdfError('%s: cannot read object %s (%s)'
+                           % (self.path, ref.num, ex))
+
+    def resolve(self, obj):
+        """
+        Follow references until obj is a direct object.
+        """
+        seen = set()
+        while isinstance(obj, Ref):
+            if obj in seen:
+                return None
+            seen.add(obj)
+            obj = self.get(obj)
+        return obj
+
+    def pages(self):
+        """
+        Iterate over (ref, page) pairs in document order.
+
+        Inheritable attributes are copied from the page tree to the page
+        dictionaries.
+        """
+        root = self.resolve(self.trailer.get('Root'))
+        if not isinstance(root, dict) or 'Pages' not in root:
+            raise PdfError('%s: document has no pages' % self.path)
+        stack = [(root['Pages'], {})]
+        seen = set()
+        while stack:
+            ref, inherited = stack.pop()
+            if ref in seen:
+                continue
+            seen.add(ref)
+            node = self.resolve(ref)
+            if not isinstance(node, dict):
+                continue
+            if node.get('Type') == 'Pages' or 'Kids' in node:
+                self.page_tree_nodes.add(ref)
+                inherited = dict(inherited)
+                inherited.update((k, node[k]) for k in INHERITABLE
+                                 if k in node)
+                kids = self.resolve(node.get('Kids')) or []
+                stack.extend((kid, inherited) for kid in reversed(kids))
+            else:
+                page = dict(inherited)
+                page.update(node)
+                yield ref, page
+
+    # Cross-reference tables -------------------------------------------------
+    def _load_xref(self):
+        buf = self.buffer
+        pos = buf.rfind(b'startxref', max(0, len(buf) - 2048))
+        if pos < 0:
+            raise PdfError('%s: startxref not found' % self.path)
+        offset, _ = _parse(buf, pos + len(b'startxref'))
+        seen = set()
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            pos = _skip_space(buf, offset)
+            if buf[pos:pos + 4] == b'xref':
+                trailer = self._read_xref_table(pos + 4)
+                if 'XRefStm' in trailer:
+                    self._read_xref_stream(trailer['XRefStm'])
+            else:
+                trailer = self._read_xref_stream(offset)
+            for key, value in trailer.items():
+                self.trailer.setdefault(key, value)
+            offset = trailer.get('Prev')
+
+    def _read_xref_table(self, pos):
+        buf = self.buffer
+        while True:
+            pos = _skip_space(buf, pos)
+            if buf[pos:pos + 7] == b'trailer':
+                trailer, _ = _parse(buf, pos + 7)
+                return trailer
+            match = _SUBSECTION.match(buf, pos)
+            if match is None:
+                raise PdfError('%s: invalid xref table' % self.path)
+            start, count = int(match[1]), int(match[2])
+            pos = match.end()
+            for num in range(start, start + count):
+                match = _XREF_ENTRY.match(buf, pos)
+                if match is None:
+                    raise PdfError('%s: invalid xref entry' % self.path)
+                pos = match.end()
+                if match[3] == b'n':
+                    self.xref.setdefault(num, (1, int(match[1]), 0))
+
+    def _read_xref_stream(self, offset):
+        _, stream = self._read_indirect(offset)
+        if not isinstance(stream, Stream) or stream.get('Type') != 'XRef':
+            raise PdfError('%s: invalid xref stream' % self.path)
+        data = _decode(stream)
+        widths = stream['W']
+        index = stream.get('Index', [0, stream['Size']])
+        pos = 0
+        for start, count in zip(index[::2], index[1::2]):
+            for num in range(start, start + count):
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(data[pos:pos + width], 'big'))
+                    pos += width
+                kind = fields[0] if widths[0] else 1
+                if kind == 1:
+                    self.xref.setdefault(num, (1, fields[1], 0))
+                elif kind == 2:
+                    self.xref.setdefault(num, (2, fields[1], fields[2]))
+        return {k: v for k, v in stream.items()
+                if k not in ('Type', 'W', 'Index', 'Length', 'Filter',
+                             'DecodeParms')}
+
+    # Objects ----------------------------------------------------------------
+    def _read_indirect(self, offset):
+        buf = self.buffer
+        match = _OBJ.match(buf, _skip_space(buf, offset))
+        if match is None:
+            raise PdfError('%s: no object at offset %s' % (self.path, offset))
+        obj, pos = _parse(buf, match.end())
+        pos = _skip_space(buf, pos)
+        if isinstance(obj, dict) and buf[pos:pos + 6] == b'stream':
+            obj = Stream(obj, self._stream_data(obj, pos + 6))
+        return int(match[1]), obj
+
+    def _stream_data(self, dic, pos):
+        buf = self.buffer
+        if buf[pos:pos + 2] == b'\r\n':
+            pos += 2
+        elif buf[pos:pos + 1] in (b'\n', b'\r'):
+            pos += 1
+        length = self.resolve(dic.get('Length'))
+        if isinstance(length, int):
+            end = _skip_space(buf, pos + length)
+            if buf[end:end + 9] == b'endstream':
+                return buf[pos:pos + length]
+
+        # Invalid /Length: the data ends at the endstream keyword
+        end = buf.find(b'endstream', pos)
+        if end < 0:
+            raise PdfError('%s: unterminated stream' % self.path)
+        if buf[end - 2:end] == b'\r\n':
+            end -= 2
+        elif buf[end - 1:end] in (b'\n', b'\r'):
+            end -= 1
+        return buf[pos:end]
+
+    def _read_compressed(self, stream_num, index):
+        try:
+            offsets, data = self._object_streams[stream_num]
+        except KeyError:
+            stream = self.get(Ref(stream_num, 0))
+            if not isinstance(stream, Stream):
+                raise PdfError('%s: invalid object stream %s'
+                               % (self.path, stream_num))
+            data = _decode(stream)
+            first = stream['First']
+            header = []
+            pos = 0
+            for _ in range(2 * stream['N']):
+                value, pos = _parse(data, pos)
+                header.append(value)
+            offsets = [first + offset for offset in header[1::2]]
+            self._object_streams[stream_num] = offsets, data
+        return _parse(data, offsets[index])[0]
+
+
+#
+# Writer
+#
+class PdfWriter:
+    """
+    Write indirect objects sequentially to a binary file.
+
+    Object numbers can be reserved before the objects are written, so
+    objects can reference others that are written later.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.offsets = array('Q')
+        self.position = 0
+        self._write(HEADER)
+
+    def reserve(self):
+        """
+        Return a reference to a new object that must be written later.
+        """
+        self.offsets.append(0)
+        return Ref(len(self.offsets), 0)
+
+    def write(self, ref, obj):
+        """
+        Write the object with the given (reserved) reference.
+        """
+        self.offsets[ref.num - 1] = self.position
+        self._write(b'%d 0 obj\n' % ref.num)
+        if isinstance(obj, Stream):
+            data = obj.data
+            dic = dict(obj, Length=len(data))
+            self._write(_serialize(dic))
+            self._write(b'\nstream\n')
+            self._write(data)
+            self._write(b'\nendstream')
+        else:
+            self._write(_serialize(obj))
+        self._write(b'\nendobj\n')
+
+    def close(self, root):
+        """
+        Write the cross-reference table and the trailer.
+        """
+        if 0 in self.offsets:
+            missing = self.offsets.index(0) + 1
+            raise PdfError('object %s was reserved but not written' % missing)
+        start = self.position
+        size = len(self.offsets) + 1
+        self._write(b'xref\n0 %d\n0000000000 65535 f \n' % size)
+        self._write(b''.join(b'%010d 00000 n \n' % offset
+                             for offset in self.offsets))
+        self._write(b'trailer\n')
+        self._write(_serialize({'Size': size, 'Root': root}))
+        self._write(b'\nstartxref\n%d\n%%%%EOF\n' % start)
+
+    def _write(self, data):
+        self.file.write(data)
+        self.position += len(data)
+
+
+#
+# Parser
+#
+_WHITESPACE = re.compile(rb'(?:[\x00\t\n\x0c\r ]+|%[^\r\n]*)*')
+_DELIMITERS = rb'()<>\[\]{}/%\x00\t\n\x0c\r '
+_TOKEN = re.compile(rb'[^' + _DELIMITERS + rb']+')
+_NAME = re.compile(rb'/([^' + _DELIMITERS + rb']*)')
+_INTEGER = re.compile(rb'[+-]?\d+$')
+_REF = re.compile(rb'\s+(\d+)\s+R(?![^' + _DELIMITERS + rb'])')
+_OBJ = re.compile(rb'(\d+)\s+(\d+)\s+obj')
+_SUBSECTION = re.compile(rb'(\d+)\s+(\d+)[^\S\r\n]*(?:\r\n|\r|\n)?')
+_XREF_ENTRY = re.compile(rb'\s*(\d{10}) (\d{5}) ([nf])[ \r\n]{0,2}')
+_HEX_STRING = re.compile(rb'<[0-9A-Fa-f\x00\t\n\x0c\r ]*>')
+_NAME_ESCAPE = re.compile(rb'#([0-9A-Fa-f]{2})')
+_NAME_SPECIAL = frozenset(b'#()<>[]{}/%')
+_KEYWORDS = {b'true': True, b'false': False, b'null': None}
+
+
+def _skip_space(buf, pos):
+    return _WHITESPACE.match(buf, pos).end()
+
+
+def _parse(buf, pos):
+    """
+    Parse a direct object (or a reference) from buf at the given position.
+
+    Returns:
+        A tuple (obj, end position).
+    """
+    pos = _skip_space(buf, pos)
+    char = buf[pos:pos + 1]
+    if char == b'/':
+        match = _NAME.match(buf, pos)
+        return _name(match[1]), match.end()
+    elif buf[pos:pos + 2] == b'<<':
+        return _parse_dict(buf, pos + 2)
+    elif char == b'[':
+        return _parse_array(buf, pos + 1)
+    elif char == b'(':
+        end = _string_end(buf, pos)
+        return Raw(buf[pos:end]), end
+    elif char == b'<':
+        match = _HEX_STRING.match(buf, pos)
+        if match is None:
+            raise PdfError('invalid hex string at offset %s' % pos)
+        return Raw(match[0]), match.end()
+    return _parse_token(buf, pos)
+
+
+def _parse_dict(buf, pos):
+    """
+    Parse the items of a dictionary that starts before pos.
+    """
+    result = {}
+    while True:
+        pos = _skip_space(buf, pos)
+        if buf[pos:pos + 2] == b'>>':
+            return result, pos + 2
+        key, pos = _parse(buf, pos)
+        if not isinstance(key, Name):
+            raise PdfError('invalid dictionary key at offset %s' % pos)
+        result[key], pos = _parse(buf, pos)
+
+
+def _parse_array(buf, pos):
+    """
+    Parse the items of an array that starts before pos.
+    """
+    result = []
+    while True:
+        pos = _skip_space(buf, pos)
+        if buf[pos:pos + 1] == b']':
+            return result, pos + 1
+        value, pos = _parse(buf, pos)
+        result.append(value)
+
+
+def _parse_token(buf, pos):
+    """
+    Parse a number, a reference, a keyword or another bare token.
+    """
+    match = _TOKEN.match(buf, pos)
+    if match is None:
+        raise PdfError('unexpected %r at offset %s' % (buf[pos:pos + 1], pos))
+    token, end = match[0], match.end()
+    if _INTEGER.match(token):
+        ref = _REF.match(buf, end)
+        if ref is not None and token.isdigit():
+            return Ref(int(token), int(ref[1])), ref.end()
+        return int(token), end
+    elif token in _KEYWORDS:
+        return _KEYWORDS[token], end
+    return Raw(token), end
+
+
+def _name(raw):
+    raw = _NAME_ESCAPE.sub(lambda m: bytes([int(m[1], 16)]), raw)
+    return Name(raw.decode('latin-1'))
+
+
+def _string_end(buf, pos):
+    depth = 0
+    while True:
+        char = buf[pos:pos + 1]
+        if not char:
+            raise PdfError('unterminated string')
+        if char == b'\\':
+            pos += 2
+            continue
+        if char == b'(':
+            depth += 1
+        elif char == b')':
+            depth -= 1
+            if depth == 0:
+                return pos + 1
+        pos += 1
+
+
+def _serialize(obj):
+    for cls in type(obj).__mro__:
+        try:
+            serializer = _SERIALIZERS[cls]
+        except KeyError:
+            continue
+        return serializer(obj)
+    raise TypeError('cannot serialize %r' % (obj,))
+
+
+def _serialize_dict(obj):
+    items = (b'/%s %s' % (_escape_name(k), _serialize(v))
+             for k, v in obj.items())
+    return b'<<' + b' '.join(items) + b'>>'
+
+
+def _serialize_float(obj):
+    return ('%.6f' % obj).rstrip('0').rstrip('.').encode('ascii')
+
+
+_SERIALIZERS = {
+    type(None): lambda obj: b'null',
+    bool: lambda obj: b'true' if obj else b'false',
+    Ref: lambda obj: b'%d %d R' % obj,
+    Name: lambda obj: b'/' + _escape_name(obj),
+    Raw: bytes,
+    int: lambda obj: b'%d' % obj,
+    float: _serialize_float,
+    dict: _serialize_dict,
+    list: lambda obj: b'[' + b' '.join(map(_serialize, obj)) + b']',
+}
+
+
+def _escape_name(name):
+    return b''.join(bytes([c]) if 33 <= c <= 126 and c not in _NAME_SPECIAL
+                    else b'#%02X' % c for c in name.encode('latin-1'))
+
+
+#
+# Stream filters
+#
+def _decode(stream):
+    """
+    Decode the data of xref and object streams.
+    """
+    filters = stream.get('Filter', [])
+    params = stream.get('DecodeParms', [])
+    if not isinstance(filters, list):
+        filters = [filters]
+    if not isinstance(params, list):
+        params = [params]
+    data = bytes(stream.data)
+    for idx, name in enumerate(filters):
+        param = (params[idx] if idx < len(params) else None) or {}
+        if name == 'FlateDecode':
+            data = _unpredict(zlib.decompress(data), param)
+        else:
+            raise PdfError('unsupported filter: %s' % name)
+    return data
+
+
+def _unpredict(data, params):
+    predictor = params.get('Predictor', 1)
+    if predictor == 1:
+        return data
+    if predictor < 10:
+        raise PdfError('unsupported predictor: %s' % predictor)
+
+    colors = params.get('Colors', 1)
+    bits = params.get('BitsPerComponent', 8)
+    columns = params.get('Columns', 1)
+    bpp = max(1, colors * bits // 8)
+    width = (colors * bits * columns + 7) // 8
+    result = bytearray()
+    prior = bytearray(width)
+    for start in range(0, len(data), width + 1):
+        kind = data[start]
+        row = bytearray(data[start + 1:start + 1 + width])
+        for i in range(len(row)):
+            left = row[i - bpp] if i >= bpp else 0
+            up = prior[i]
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif kind == 2:
+                row[i] = (row[i] + up) & 0xFF
+            elif kind == 3:
+                row[i] = (row[i] + (left + up) // 2) & 0xFF
+            elif kind == 4:
+                up_left = prior[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + _paeth(left, up, up_left)) & 0xFF
+        result.extend(row)
+        prior = row
+    return bytes(result)
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
@@ -0,0 +1,398 @@
+"""
+Streaming readers for spreadsheet files (.ods and .xlsx).
+
+Rows are parsed incrementally from the XML members of the zip file and
+yielded as tuples of typed values (str, int, float, bool, date, datetime,
+time or None). Processed elements are discarded as the parser advances and
+runs of repeated or empty cells are only expanded when they are followed by
+data, so memory use does not depend on the size of the sheet.
+"""
+
+import datetime
+import re
+import zipfile
+from posixpath import dirname, join, normpath
+
+import lxml.etree as ET
+
+OFFICE = '{urn:oasis:names:tc:opendocument:xmlns:office:1.0}'
+TABLE = '{urn:oasis:names:tc:opendocument:xmlns:table:1.0}'
+TEXT = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+XLSX = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_RELS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+XLSX_DOC_RELS = \
+    '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+# Qualified names used by the ODS reader
+_TABLE_TAG = TABLE + 'table'
+_CELL_TAGS = (TABLE + 'table-cell', TABLE + 'covered-table-cell')
+_ROWS_REPEATED = TABLE + 'number-rows-repeated'
+_COLUMNS_REPEATED = TABLE + 'number-columns-repeated'
+_VALUE_TYPE = OFFICE + 'value-type'
+_VALUE = OFFICE + 'value'
+_STRING_VALUE = OFFICE + 'string-value'
+_PARAGRAPHS = (TEXT + 'p', TEXT + 'h')
+
+# Number formats that represent dates in Excel files
+XLSX_DATE_FORMATS = {*range(14, 23), *range(27, 37), *range(45, 48),
+                     *range(50, 59)}
+
+
+def iter_rows(path, sheet=0):
+    """
+    Iterate over the rows of a sheet of an .ods or .xlsx file.
+
+    Args:
+        path:
+            Path to the spreadsheet file.
+        sheet (int or str):
+            Index or name of the sheet.
+
+    Returns:
+        An iterator over tuples of cell values. Trailing empty cells and
+        trailing empty rows are omitted.
+    """
+    for name, idx, rows in iter_sheets(path):
+        if sheet == idx or sheet == name:
+            yield from rows
+            return
+    raise ValueError('%s has no sheet %r' % (path, sheet))
+
+
+def iter_sheets(path):
+    """
+    Iterate over (name, index, rows) for all sheets of a spreadsheet file.
+
+    Each rows iterator must be consumed before advancing to the next sheet.
+    """
+    ext = str(path).rpartition('.')[-1].lower()
+    if ext == 'ods':
+        return _iter_ods_sheets(path)
+    elif ext == 'xlsx':
+        return _iter_xlsx_sheets(path)
+    raise ValueError('unsupported spreadsheet format: %s' % path)
+
+
+def read_sheets(path):
+    """
+    Return a dictionary mapping sheet names to lists of rows.
+
+    Rows are converted to lists.
+    """
+    return {name: [list(row) for row in rows]
+            for name, _, rows in iter_sheets(path)}
+
+
+class RowReader:
+    """
+    A re-iterable view of the rows of a sheet.
+
+    Each iteration reads the file again. Readers are cheap to create and to
+    pickle.
+    """
+
+    def __init__(self, path, sheet=0):
+        self.path = path
+        self.sheet = sheet
+
+    def __iter__(self):
+        return iter_rows(self.path, self.sheet)
+
+    def __repr__(self):
+        return 'RowReader(%r, %r)' % (str(self.path), self.sheet)
+
+
+#
+# Open document spreadsheets
+#
+def _iter_ods_sheets(path):
+    with zipfile.ZipFile(str(path)) as zip:
+        with zip.open('content.xml') as file:
+            events = ET.iterparse(file, events=('start', 'end'),
+                                  tag=(TABLE + 'table', TABLE + 'table-row'))
+            events = iter(events)
+            idx = 0
+            for event, elem in events:
+                if event == 'start' and elem.tag == _TABLE_TAG:
+                    name = elem.get(TABLE + 'name')
+                    rows = _ods_rows(events)
+                    yield name, idx, rows
+                    for _ in rows:
+                        pass
+                    idx += 1
+
+
+def _ods_rows(events):
+    empty_rows = 0
+    depth = 0
+    for event, elem in events:
+        # Tables nested in cells are parsed as part of the enclosing cell
+        if elem.tag == _TABLE_TAG:
+            depth += 1 if event == 'start' else -1
+            if depth < 0:
+                elem.clear()
+                return
+            continue
+        if event != 'end' or depth > 0:
+            continue
+
+        row = _ods_row(elem)
+        repeat = int(elem.get(_ROWS_REPEATED, 1))
+        _discard(elem)
+        if not row:
+            empty_rows += repeat
+            continue
+        for _ in range(empty_rows):
+            yield ()
+        empty_rows = 0
+        for _ in range(repeat):
+            yield row
+
+
+def _ods_row(row):
+    values = []
+    empty_cells = 0
+    for cell in row:
+        if cell.tag not in _CELL_TAGS:
+            continue
+        value = _ods_value(cell)
+        repeat = int(cell.get(_COLUMNS_REPEATED, 1))
+        if value is None:
+            empty_cells += repeat
+            continue
+        values.extend([None] * empty_cells)
+        values.extend([value] * repeat)
+        empty_cells = 0
+    return tuple(values)
+
+
+def _ods_value(cell):
+    kind = cell.get(_VALUE_TYPE)
+    if kind is None or kind == 'string':
+        return _ods_string(cell)
+    elif kind in ('float', 'percentage', 'currency'):
+        return _number(cell.get(_VALUE))
+    elif kind == 'boolean':
+        return cell.get(OFFICE + 'boolean-value') == 'true'
+    elif kind == 'date':
+        value = cell.get(OFFICE + 'date-value')
+        return _date(value)
+    elif kind == 'time':
+        return _duration(cell.get(OFFICE + 'time-value'))
+    return _ods_string(cell)
+
+
+def _ods_string(cell):
+    value = cell.get(_STRING_VALUE)
+    if value is not None:
+        return value
+    paragraphs = [_text(p) for p in cell.iterchildren(*_PARAGRAPHS)]
+    if not paragraphs:
+        return None
+    return '\n'.join(paragraphs)
+
+
+def _text(node):
+    if not len(node):
+        return node.text or ''
+    parts = [node.text or '']
+    for child in node:
+        if child.tag == TEXT + 's':
+            parts.append(' ' * int(child.get(TEXT + 'c', 1)))
+        elif child.tag == TEXT + 'tab':
+            parts.append('\t')
+        elif child.tag == TEXT + 'line-break':
+            parts.append('\n')
+        elif child.tag != OFFICE + 'annotation':
+            parts.append(_text(child))
+        parts.append(child.tail or '')
+    return ''.join(parts)
+
+
+def _date(value):
+    """
+    Parse an ISO 8601 date, date and time or time. A "Z" suffix is ignored.
+    """
+    value, _, fraction = value.rstrip('Z').partition('.')
+    microsecond = int(fraction[:6].ljust(6, '0')) if fraction else 0
+    if 'T' in value:
+        date = datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+        return date.replace(microsecond=microsecond)
+    elif ':' in value:
+        date = datetime.datetime.strptime(value, '%H:%M:%S')
+        return date.time().replace(microsecond=microsecond)
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _duration(value):
+    match = re.fullmatch(r'-?P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?'
+                         r'(?:([\d.]+)S)?', value)
+    if match is None:
+        return value
+    days, hours, minutes, seconds = [float(x or 0) for x in match.groups()]
+    delta = datetime.timedelta(days=days, hours=hours, minutes=minutes,
+                               seconds=seconds)
+    if value.startswith('-'):
+        return -delta
+    if delta < datetime.timedelta(days=1):
+        return (datetime.datetime.min + delta).time()
+    return delta
+
+
+#
+# Office Open XML spreadsheets
+#
+def _iter_xlsx_sheets(path):
+    with zipfile.ZipFile(str(path)) as zip:
+        workbook = ET.fromstring(zip.read('xl/workbook.xml'))
+        targets = _xlsx_relationships(zip, 'xl/workbook.xml')
+        strings = _xlsx_shared_strings(zip)
+        date_styles = _xlsx_date_styles(zip)
+        properties = workbook.find(XLSX + 'workbookPr')
+        epoch = datetime.datetime(1899, 12, 30)
+        if properties is not None and \
+                properties.get('date1904') in ('1', 'true'):
+            epoch = datetime.datetime(1904, 1, 1)
+
+        for idx, sheet in enumerate(workbook.iter(XLSX + 'sheet')):
+            target = targets[sheet.get(XLSX_DOC_RELS + 'id')]
+            with zip.open(target) as file:
+                rows = _xlsx_rows(file, strings, date_styles, epoch)
+                yield sheet.get('name'), idx, rows
+                for _ in rows:
+                    pass
+
+
+def _xlsx_relationships(zip, part):
+    base = dirname(part)
+    rels = join(base, '_rels', part.rpartition('/')[-1] + '.rels')
+    result = {}
+    for rel in ET.fromstring(zip.read(rels)).iter(XLSX_RELS + 'Relationship'):
+        target = rel.get('Target')
+        if target.startswith('/'):
+            target = target[1:]
+        else:
+            target = normpath(join(base, target))
+        result[rel.get('Id')] = target
+    return result
+
+
+def _xlsx_shared_strings(zip):
+    try:
+        file = zip.open('xl/sharedStrings.xml')
+    except KeyError:
+        return []
+    strings = []
+    with file:
+        for _, elem in ET.iterparse(file, tag=XLSX + 'si'):
+            strings.append(_xlsx_string(elem))
+            _discard(elem)
+    return strings
+
+
+def _xlsx_string(elem):
+    return ''.join(t.text or '' for t in elem.iter(XLSX + 't')
+                   if t.getparent().tag != XLSX + 'rPh')
+
+
+def _xlsx_date_styles(zip):
+    try:
+        styles = ET.fromstring(zip.read('xl/styles.xml'))
+    except KeyError:
+        return set()
+
+    date_formats = set(XLSX_DATE_FORMATS)
+    for fmt in styles.iter(XLSX + 'numFmt'):
+        code = re.sub(r'"[^"]*"|\[[^\]]*\]|\\.', '', fmt.get('formatCode'))
+        if re.search('[dmyhs]', code, re.IGNORECASE):
+            date_formats.add(int(fmt.get('numFmtId')))
+
+    cell_formats = styles.find(XLSX + 'cellXfs')
+    if cell_formats is None:
+        return set()
+    return {idx for idx, xf in enumerate(cell_formats.iter(XLSX + 'xf'))
+            if int(xf.get('numFmtId', 0)) in date_formats}
+
+
+def _xlsx_rows(file, strings, date_styles, epoch):
+    expected = 1
+    for _, elem in ET.iterparse(file, tag=XLSX + 'row'):
+        row = _xlsx_row(elem, strings, date_styles, epoch)
+        number = int(elem.get('r', expected))
+        _discard(elem)
+        if not row:
+            continue
+        for _ in range(number - expected):
+            yield ()
+        expected = number + 1
+        yield row
+
+
+def _xlsx_row(row, strings, date_styles, epoch):
+    values = []
+    for cell in row.iterchildren(XLSX + 'c'):
+        value = _xlsx_value(cell, strings, date_styles, epoch)
+        if value is None:
+            continue
+        ref = cell.get('r')
+        if ref is not None:
+            values.extend([None] * (_column_index(ref) - len(values)))
+        values.append(value)
+    return tuple(values)
+
+
+def _xlsx_value(cell, strings, date_styles, epoch):
+    kind = cell.get('t', 'n')
+    if kind == 'inlineStr':
+        elem = cell.find(XLSX + 'is')
+        return None if elem is None else _xlsx_string(elem)
+
+    elem = cell.find(XLSX + 'v')
+    if elem is None or elem.text is None:
+        return None
+    value = elem.text
+    if kind == 's':
+        return strings[int(value)]
+    elif kind == 'b':
+        return value == '1'
+    elif kind in ('str', 'e'):
+        return value
+    elif kind == 'd':
+        return _date(value)
+
+    number = float(value)
+    if int(cell.get('s', 0)) in date_styles:
+        if 0 <= number < 1:
+            return (epoch + datetime.timedelta(days=number)).time()
+        result = epoch + datetime.timedelta(days=number)
+        return result.date() if number.is_integer() else result
+    return _number(value)
+
+
+def _column_index(ref):
+    idx = 0
+    for char in ref:
+        if not char.isalpha():
+            break
+        idx = idx * 26 + ord(char.upper()) - ord('A') + 1
+    return idx - 1
+
+
+#
+# Auxiliary functions
+#
+def _number(value):
+    number = float(value)
+    if number.is_integer() and 'e' not in value.lower():
+        return int(number)
+    return number
+
+
+def _discard(elem):
+    """
+    Free memory used by an element processed by iterparse and by its
+    already processed siblings.
+    """
+    elem.clear()
+    while elem.getprevious() is not None:
+        del elem.getparent()[0]
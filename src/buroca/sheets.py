@@ -1,5 +1,7 @@
 import subprocess
 
+from .cache import ResourceCache
+
 LETTERS = list('abcdefghijklmnopqrstuvwxyz')
 for _letter in 'abcd':
     LETTERS.extend(_letter + c for c in 'abcdefghijklmnopqrstuvwxyz')
@@ -19,15 +21,16 @@ class Sheet:
 
     def kill(self):
         "Kill current libreoffice process"
-        self.process.kill()
-        self.process = None
+        if self.process is not None:
+            self.process.kill()
+            self.process = None
 
     def start(self):
         "Start calc process"
         cmd = [
             'libreoffice', '--calc',
-            '--accept="socket,host=localhost,port=2002;urp;'
-            'StarOffice.ServiceManager"',
+            '--accept=socket,host=localhost,port=2002;urp;'
+            'StarOffice.ServiceManager',
             self.file,
         ]
         self.process = subprocess.Popen(cmd)
@@ -47,23 +50,76 @@ class Sheet:
 
     def template_cells(self):
         """
-        Search all cells for jinja2 templates
+        Search all cells for jinja2 templates.
+
+        Returns a {cell name: template} map. The result is cached while the
+        file does not change, so it can be reused for every entity.
         """
-        sheet = self.sheet()
-        rows = 57
-        cols = LETTERS.index('m')
-        cell_map = {}
-
-        for i in range(rows):
-            for j in range(cols):
-                cell_name = cell(i, j)
-                data = sheet(cell_name).string.strip()
+        if self.process is None:
+            raise RuntimeError('must start libreoffice before starting.')
+        return TEMPLATE_CELLS.get(self.file, scan_template_cells)
+
+
+TEMPLATE_CELLS = ResourceCache(max_entries=64)
+
+
+def scan_template_cells(path):
+    """
+    Return the map of template cells of the active sheet of a running calc
+    instance with the document at path.
+    """
+    from oosheet import OOSheet
+
+    sheet = OOSheet().model.CurrentController.ActiveSheet
+    return find_template_cells(sheet)
+
+
+def find_template_cells(sheet, block_rows=1024):
+    """
+    Return a {cell name: template} map with the cells of an UNO sheet object
+    that contain jinja2 templates.
+
+    The used area of the sheet is detected first and then read in blocks of
+    rows with getDataArray(), so a full sheet is scanned in a handful of
+    calls.
+    """
+    n_rows, n_cols = used_area(sheet)
+    cell_map = {}
+
+    for start in range(0, n_rows, block_rows):
+        end = min(start + block_rows, n_rows) - 1
+        block = sheet.getCellRangeByPosition(0, start, n_cols - 1, end)
+        for i, row in enumerate(block.getDataArray(), start):
+            for j, data in enumerate(row):
+                if not isinstance(data, str):
+                    continue
+                data = data.strip()
                 if data.startswith('{') and data.endswith('}'):
-                    cell_map[cell_name] = data
+                    cell_map[cell(i, j)] = data
 
-        return cell_map
+    return cell_map
+
+
+def used_area(sheet):
+    """
+    Return the (rows, columns) size of the used area of an UNO sheet object.
+    """
+    cursor = sheet.createCursor()
+    cursor.gotoEndOfUsedArea(False)
+    address = cursor.getRangeAddress()
+    return address.EndRow + 1, address.EndColumn + 1
 
 
 def cell(i, j):
     "Convert coordinates i,j to cell names"
-    return LETTERS[j] + str(i + 1)
+    return column_name(j) + str(i + 1)
+
+
+def column_name(j):
+    "Convert a zero-based column index to a column name"
+    name = ''
+    j += 1
+    while j:
+        j, rem = divmod(j - 1, 26)
+        name = LETTERS[rem] + name
+    return name
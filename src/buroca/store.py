@@ -0,0 +1,307 @@
+"""
+Compile the /data/ folder of a project into a single indexed SQLite file.
+
+The compiled store is an alternative backend to :class:`db.NamespaceBuilder`
+that fetches entities on demand instead of holding all data in memory.
+"""
+
+import os
+import pickle
+import sqlite3
+from collections import defaultdict
+from pathlib import Path
+
+from . import db
+from .paths import buroca_path
+
+STORE_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    name TEXT,
+    mtime_ns INTEGER,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS resources (
+    name TEXT,
+    entity TEXT,
+    source TEXT,
+    data BLOB,
+    PRIMARY KEY (name, entity)
+);
+CREATE INDEX IF NOT EXISTS resources_entity ON resources (entity);
+CREATE INDEX IF NOT EXISTS resources_source ON resources (source);
+"""
+
+
+def store_path(base=None):
+    """
+    Return the path of the compiled data store of a project.
+    """
+    return buroca_path('data.sqlite', base=base)
+
+
+def open_store(base=None):
+    """
+    Return the compiled DataStore of the project or None if "buroca db
+    compile" was never executed.
+    """
+    path = store_path(base)
+    if not path.exists():
+        return None
+    return DataStore(path, base)
+
+
+class DataStore:
+    """
+    A SQLite file that stores all resources of a project.
+
+    Global resources are stored with an empty entity name. Each row records
+    the source file it came from, so :meth:`compile` only parses files that
+    changed since the last compilation.
+
+    Args:
+        path:
+            Path to the SQLite file.
+        base (str):
+            Project directory. Must contain a /data/ folder.
+    """
+
+    def __init__(self, path, base=None):
+        self.path = Path(path)
+        self.base = (Path(base or '.')).absolute()
+        self.datadir = self.base / 'data'
+        self._connection = None
+        self._globals = None
+        self._entity_names = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Documents may be rendered in the producer thread of a
+            # ConversionPipeline. Accesses are never concurrent.
+            self._connection = sqlite3.connect(str(self.path),
+                                               check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+            if self._meta('version') != str(STORE_VERSION):
+                self._reset()
+        return self._connection
+
+    def close(self):
+        """
+        Close connection to the database.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def is_up_to_date(self):
+        """
+        Return True if the store was compiled from the current contents of
+        the data/ folder.
+        """
+        stored = self._stored_sources()
+        for path, name in self._scan_sources():
+            stat = os.stat(path)
+            signature = (name, stat.st_mtime_ns, stat.st_size)
+            if stored.pop(path, None) != signature:
+                return False
+        return not stored
+
+    #
+    # Reading data
+    #
+    def names(self):
+        """
+        Return a list with all resource names.
+        """
+        if self._globals is None:
+            self._load_globals()
+        return list(self._globals) + self._entity_names
+
+    def resource(self, name, for_):
+        """
+        Return the named resource for the given entity.
+        """
+        if self._globals is None:
+            self._load_globals()
+        if name in self._globals:
+            return self._globals[name]
+
+        row = self.connection.execute(
+            "SELECT data FROM resources WHERE name = ? AND entity = ?",
+            (name, for_)).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def namespace(self, for_, lazy=False, names=None):
+        """
+        Return the namespace for the given entity.
+
+        If lazy is True, return a :class:`db.LazyNamespace` that only fetches
+        resources when they are accessed. If names is given, the namespace
+        only includes resources in this set.
+        """
+        if lazy:
+            return db.LazyNamespace(self, for_, names)
+        if self._globals is None:
+            self._load_globals()
+
+        ns = dict(self._globals)
+        ns.update(dict.fromkeys(self._entity_names))
+        rows = self.connection.execute(
+            "SELECT name, data FROM resources WHERE entity = ? AND entity != ''",
+            (for_,))
+        ns.update((name, pickle.loads(data)) for name, data in rows)
+        if names is not None:
+            ns = {name: value for name, value in ns.items() if name in names}
+        return ns
+
+    def sources(self, for_, names=None):
+        """
+        Return a list of data files read to build the namespace of the given
+        entity.
+        """
+        rows = self.connection.execute(
+            "SELECT name, source FROM resources WHERE entity IN ('', ?)",
+            (for_,))
+        return sorted({source for name, source in rows
+                       if names is None or name in names})
+
+    def entities(self, reference=None):
+        """
+        Return a list of entity names for the reference resource.
+        """
+        if reference is None:
+            reference = self._meta('reference')
+        rows = self.connection.execute(
+            'SELECT entity FROM resources WHERE name = ? ORDER BY entity',
+            (reference,))
+        return [entity for entity, in rows]
+
+    def _load_globals(self):
+        rows = self.connection.execute(
+            "SELECT name, data FROM resources WHERE entity = ''")
+        self._globals = {name: pickle.loads(data) for name, data in rows}
+        rows = self.connection.execute(
+            "SELECT DISTINCT name FROM resources WHERE entity != ''")
+        self._entity_names = [name for name, in rows]
+
+    #
+    # Compilation
+    #
+    def compile(self):
+        """
+        Update the store with the contents of the data/ folder.
+
+        Only sources whose modification time or size changed are parsed
+        again.
+
+        Returns:
+            A dictionary with the number of 'added', 'updated', 'removed' and
+            'unchanged' source files.
+        """
+        conn = self.connection
+        stored = self._stored_sources()
+        stats = dict.fromkeys(['added', 'updated', 'removed', 'unchanged'], 0)
+
+        with conn:
+            for path, name in self._scan_sources():
+                stat = os.stat(path)
+                signature = (name, stat.st_mtime_ns, stat.st_size)
+                old = stored.pop(path, None)
+                if old == signature:
+                    stats['unchanged'] += 1
+                    continue
+
+                stats['updated' if old else 'added'] += 1
+                conn.execute('DELETE FROM resources WHERE source = ?', (path,))
+                conn.executemany(
+                    'INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?)',
+                    ((name, entity, path, _dumps(data))
+                     for entity, data in self._read_source(path, name)))
+                conn.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                             (path,) + signature)
+
+            for path in stored:
+                stats['removed'] += 1
+                conn.execute('DELETE FROM resources WHERE source = ?', (path,))
+                conn.execute('DELETE FROM sources WHERE path = ?', (path,))
+
+            self._set_meta('reference', self._reference())
+
+        self._globals = None
+        return stats
+
+    def _stored_sources(self):
+        return {path: (name, mtime, size) for path, name, mtime, size
+                in self.connection.execute('SELECT * FROM sources')}
+
+    def _scan_sources(self):
+        names = defaultdict(list)
+        for path in self.datadir.iterdir():
+            names[db._resource_name(path)].append(path)
+
+        for name, paths in sorted(names.items()):
+            path = db.select_path(paths)
+            if path.is_dir():
+                for subpath in sorted(path.iterdir()):
+                    if db.is_resource(subpath):
+                        yield str(subpath), name
+            else:
+                yield str(path), name
+
+    def _read_source(self, path, name):
+        path = Path(path)
+        if path.parent != self.datadir:
+            ext = os.path.splitext(path)[-1].lstrip('.')
+            yield db._resource_name(path), db.LOADER_MAP[ext](path)
+            return
+
+        data = db.resource_from_path(path, None)
+        if isinstance(data, db.Collection):
+            yield from data.items()
+        else:
+            yield '', data
+
+    def _reference(self):
+        folders = [path for path in self.datadir.iterdir() if path.is_dir()]
+        if folders:
+            reference = db.locate_entities(self.base)
+            return os.path.basename(reference)
+
+        row = self.connection.execute(
+            "SELECT name FROM resources WHERE entity != '' ORDER BY name"
+        ).fetchone()
+        return row and row[0]
+
+    def _meta(self, key):
+        row = self.connection.execute(
+            'SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row and row[0]
+
+    def _set_meta(self, key, value):
+        self.connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                                (key, value))
+
+    def _reset(self):
+        with self._connection as conn:
+            conn.execute('DELETE FROM resources')
+            conn.execute('DELETE FROM sources')
+            conn.execute('DELETE FROM meta')
+            conn.execute('INSERT INTO meta VALUES (?, ?)',
+                         ('version', str(STORE_VERSION)))
+
+
+def _dumps(data):
+    return pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
@@ -1,19 +1,44 @@
+import collections
+import hashlib
+import json
+import math
+import multiprocessing
 import os
 import pathlib
-from functools import singledispatch
+import shutil
+import tempfile
+from collections import ChainMap
+from contextlib import contextmanager
+from functools import lru_cache, partial, singledispatch
 from pathlib import Path
 
 import jinja2
+from jinja2 import meta
 
 from . import db
+from .build import Manifest, manifest_path, build_record
 from .convert import intermediate_conversion, convert_file
+from .convert import ConversionPipeline, get_format
 from .errors import TemplateError
 from .filters import FILTERS
 from .global_functions import GLOBALS
-from .paths import name_for, as_report_path
+from .paths import name_for, joined_name_for, as_report_path, buroca_path
 
+ODF_EXTENSIONS = ['.ods', '.odt']
 
-def save_rendered_for(template_path, dest, for_, type=None, base=None):
+# Page breaks between documents in single outputs, by template format.
+# Markdown passes raw blocks through, so the break of the output format is
+# used for markdown templates.
+PAGE_BREAKS = {
+    'markdown': '\n\n\\newpage\n\n',
+    'latex': '\n\\newpage\n',
+    'html': '\n\n<div style="page-break-after: always"></div>\n\n',
+}
+_ENVIRONMENTS = {}
+
+
+def save_rendered_for(template_path, dest, for_, type=None, base=None,
+                      force=False):
     """
     Save rendered template for the given entity.
 
@@ -26,21 +51,38 @@ def save_rendered_for(template_path, dest, for_, type=None, base=None):
             Entity name.
         base (path):
             Optional base path for the project's files. If not given, uses CWD.
+        force (bool):
+            If True, render the template even if dest is up-to-date.
+
+    Returns:
+        True if the file was created and False if it was skipped.
     """
-    ext = os.path.splitext(template_path)[-1]
-    namespace = db.load_for(for_, base=base)
+    new_template = partial(load_template, template_path, base)
+    with _owned(None, new_template) as template, \
+            db.namespace_builder(base) as builder:
+        manifest = Manifest(manifest_path(base))
+        names = template.dependencies
+        record = build_record(template_path, builder.sources(for_, names),
+                              type, includes=template.includes)
+        if not force and manifest.is_up_to_date(dest, record):
+            return False
 
-    if ext in ['.ods', '.odt']:
-        raise NotImplementedError
-    else:
-        template = load_jinja_template(template_path)
+        namespace = builder.namespace(for_, lazy=True, names=names)
         save_rendered_template(template, namespace, dest, type=type)
+    manifest.update(dest, record)
+    manifest.save()
+    return True
 
 
-def save_rendered_all(template_path, dest=None, type=None, base=None):
+def save_rendered_all(template_path, dest=None, type=None, base=None,
+                      force=False, jobs=1, template=None, builder=None,
+                      entities=None):
     """
     Save rendered templates for multiple entities.
 
+    Reports that are up-to-date with their template and data files are
+    skipped.
+
     Args:
         template_path (path):
             The source template path.
@@ -49,22 +91,348 @@ def save_rendered_all(template_path, dest=None, type=None, base=None):
             corresponding destination path.
         base (path):
             Optional base path for the project's files. If not given, uses CWD.
-    """
-    ext = os.path.splitext(template_path)[-1]
-    namespaces = db.load_all(base=base)
-    reports_path = as_report_path(template_path)
+        force (bool):
+            If True, render all templates even if they are up-to-date.
+        jobs (int):
+            Number of worker processes used to render documents. Worker
+            processes load the template and the builder from disk, so
+            documents are rendered in the current process if template or
+            builder are given.
+        template:
+            The template loaded from template_path by :func:`load_template`.
+            Loaded from disk if not given.
+        builder:
+            The namespace builder of the project. Created if not given.
+        entities (list):
+            If given, only reports for these entities are considered.
 
+    Returns:
+        A tuple with the lists of (rebuilt, skipped) entity names.
+    """
+    base = os.path.abspath(base or os.getcwd())
+    if template is not None or builder is not None:
+        jobs = 1
     if dest is None:
+        reports_path = as_report_path(Path(template_path))
         dest = (lambda x: name_for(reports_path, x, type))
+    new_template = partial(load_template, template_path, base)
+    new_builder = partial(db.namespace_builder, base)
+    with _owned(template, new_template) as template, \
+            _owned(builder, new_builder) as builder:
+        if entities is None:
+            entities = builder.entities()
+        return _save_rendered_many(template, template_path, dest, entities,
+                                   builder, type, base, force, jobs)
 
-    if ext in ['.ods', '.odt']:
-        raise NotImplementedError
-    else:
-        template = load_jinja_template(template_path)
-        n_items = len(namespaces)
-        for idx, (name, namespace) in enumerate(namespaces.items(), 1):
+
+def save_rendered_single(template_path, dest=None, type=None, base=None,
+                         force=False, jobs=1, separator=None, template=None,
+                         builder=None, entities=None):
+    """
+    Join the rendered templates of multiple entities in a single output and
+    convert it only once.
+
+    Args:
+        template_path (path):
+            The source template path.
+        dest (path):
+            Path of the output file.
+        separator (str):
+            String inserted between documents. The default is a page break
+            in the format of the template (see :data:`PAGE_BREAKS`).
+
+    Other arguments are the same as in :func:`save_rendered_all`.
+
+    Returns:
+        A tuple with the lists of (rebuilt, skipped) entity names.
+    """
+    base = os.path.abspath(base or os.getcwd())
+    if template is not None or builder is not None:
+        jobs = 1
+    if dest is None:
+        dest = joined_name_for(as_report_path(Path(template_path)), type)
+    if separator is None:
+        separator = _page_break(template_path, type)
+    new_template = partial(load_template, template_path, base)
+    new_builder = partial(db.namespace_builder, base)
+    with _owned(template, new_template) as template, \
+            _owned(builder, new_builder) as builder:
+        if entities is None:
+            entities = builder.entities()
+        return _save_rendered_single(template, template_path, dest, entities,
+                                     builder, type, base, force, jobs,
+                                     separator)
+
+
+def _save_rendered_many(template, template_path, dest, entities, builder,
+                        type, base, force, jobs):
+    """
+    Implements save_rendered_all().
+    """
+    names = template.dependencies
+    manifest = Manifest(manifest_path(base))
+    records = {}
+    skipped = []
+    n_items = len(entities)
+
+    # Select outdated reports
+    outdated = []
+    for idx, name in enumerate(entities, 1):
+        sources = builder.sources(name, names)
+        record = build_record(template_path, sources, type,
+                              includes=template.includes)
+        if not force and manifest.is_up_to_date(dest(name), record):
+            skipped.append(name)
+        else:
+            records[name] = record
+            outdated.append((idx, name))
+
+    # Reports are registered in the manifest as soon as they are done, so
+    # interrupted runs do not need to rebuild them
+    targets = {name: str(dest(name)) for _, name in outdated}
+    finished = set()
+
+    def done(name):
+        manifest.update(targets[name], records[name])
+        finished.add(name)
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Templates are rendered to intermediate files if conversion is
+            # necessary. They are converted while other documents render.
+            tmp_name = Path(template_path).parts[-1]
+            tasks = []
+            for idx, name in outdated:
+                if type is None:
+                    tasks.append((idx, name, targets[name]))
+                else:
+                    tmp = os.path.join(tmp_dir, '%s-%s' % (idx, tmp_name))
+                    tasks.append((idx, name, tmp))
+
+            # Documents are handed to the conversion pipeline one at a
+            # time, so the number of intermediate files is bounded
+            batch_size = None if type is None else 1
+            with _render_tasks(template, builder, base, tasks, jobs,
+                               batch_size) as results:
+                errors = _consume_results(results, n_items, targets, type,
+                                          jobs, done)
+    finally:
+        manifest.save()
+
+    rebuilt = [name for _, name in outdated if name in finished]
+    print('%s rebuilt, %s up-to-date.' % (len(rebuilt), len(skipped)))
+    if errors:
+        raise TemplateError('\n'.join(errors[name] for _, name in outdated
+                                      if name in errors))
+    return rebuilt, skipped
+
+
+def _save_rendered_single(template, template_path, dest, entities, builder,
+                          type, base, force, jobs, separator):
+    """
+    Implements save_rendered_single().
+    """
+    if os.path.splitext(str(template_path))[-1] in ODF_EXTENSIONS:
+        raise TemplateError('open document templates cannot be joined in a '
+                            'single output')
+
+    names = template.dependencies
+    sources = []
+    for name in entities:
+        sources.extend(builder.sources(name, names))
+    record = build_record(template_path, list(dict.fromkeys(sources)), type,
+                          includes=template.includes)
+    record['single'] = {'entities': list(entities), 'separator': separator}
+    manifest = Manifest(manifest_path(base))
+    if not force and manifest.is_up_to_date(dest, record):
+        print('%s is up-to-date.' % dest)
+        return [], list(entities)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_name = Path(template_path).parts[-1]
+        joined = os.path.join(tmp_dir, tmp_name)
+        tasks = [(idx, name, os.path.join(tmp_dir, '%s-%s' % (idx, tmp_name)))
+                 for idx, name in enumerate(entities, 1)]
+        with open(joined, 'w') as out:
+            with _render_tasks(template, builder, base, tasks, jobs) as results:
+                errors = _join_results(results, len(tasks), out, separator)
+        if errors:
+            raise TemplateError('\n'.join(errors[name] for name in entities
+                                          if name in errors))
+
+        Path(dest).parent.mkdir(parents=True, exist_ok=True)
+        if type is None:
+            shutil.move(joined, str(dest))
+        else:
+            convert_file(joined, dest)
+
+    manifest.update(dest, record)
+    manifest.save()
+    print('%s documents saved at %s.' % (len(entities), dest))
+    return list(entities), []
+
+
+def _page_break(template_path, type):
+    fmt = get_format(template_path)
+    if fmt == 'markdown' and type is not None:
+        if get_format(template_path, type) == 'html':
+            fmt = 'html'
+    return PAGE_BREAKS.get(fmt, '\n\n')
+
+
+@contextmanager
+def _owned(value, factory):
+    """
+    Yield value if it is not None. Otherwise, yield the result of factory()
+    and close it on exit.
+    """
+    if value is not None:
+        yield value
+        return
+    value = factory()
+    try:
+        yield value
+    finally:
+        if hasattr(value, 'close'):
+            value.close()
+
+
+def _join_results(results, n_items, out, separator):
+    """
+    Print progress for each rendered document and append it to the out file,
+    separating documents with the given separator.
+
+    Returns a mapping from entity names to error messages.
+    """
+    errors = {}
+    is_first = True
+    for batch in results:
+        for idx, name, path, error in batch:
             print('(%s/%s) creating document for "%s".' % (idx, n_items, name))
-            save_rendered_template(template, namespace, dest(name), type=type)
+            if error is not None:
+                errors[name] = error
+                continue
+            if not is_first:
+                out.write(separator)
+            is_first = False
+            with open(path) as F:
+                shutil.copyfileobj(F, out)
+            os.unlink(path)
+    return errors
+
+
+@contextmanager
+def _render_tasks(template, builder, base, tasks, jobs, batch_size=None):
+    """
+    Render (idx, name, dest) tasks with jobs processes and yield an iterator
+    over batches of results in task order.
+
+    At most 2 * jobs batches are rendered ahead of the consumer. The default
+    batch size splits tasks in a few batches per process.
+    """
+    if jobs > 1 and len(tasks) > 1:
+        args = (template.path, base, None)
+        with multiprocessing.Pool(jobs, _init_worker, args) as pool:
+            batches = _batches(tasks, jobs, batch_size)
+            yield _bounded_imap(pool, _render_batch, batches, 2 * jobs)
+    else:
+        renderer = _Renderer(template, builder)
+        yield map(renderer, _batches(tasks, 1, batch_size))
+
+
+def _consume_results(results, n_items, targets, type=None, jobs=1,
+                     done=None):
+    """
+    Print progress for each rendered document and convert intermediate files
+    if type is given. The done(name) callback is called for each finished
+    report.
+
+    Returns a mapping from entity names to error messages.
+    """
+    errors = {}
+
+    def rendered():
+        for batch in results:
+            for idx, name, path, error in batch:
+                print('(%s/%s) creating document for "%s".'
+                      % (idx, n_items, name))
+                if error is not None:
+                    errors[name] = error
+                elif type is not None:
+                    yield name, path, targets[name]
+                elif done is not None:
+                    done(name)
+
+    if type is None:
+        list(rendered())
+    else:
+        failed = ConversionPipeline(jobs).run(rendered(), done)
+        for name, ex in failed.items():
+            errors[name] = '%s: %s' % (targets[name], ex)
+    return errors
+
+
+def _bounded_imap(pool, func, iterable, depth):
+    """
+    Like pool.imap(func, iterable), but never keeps more than depth tasks
+    submitted to the pool.
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= depth:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _batches(tasks, jobs, size=None):
+    if size is None:
+        size = max(1, math.ceil(len(tasks) / (4 * jobs)))
+    for i in range(0, len(tasks), size):
+        yield tasks[i:i + size]
+
+
+class _Renderer:
+    """
+    Render batches of (idx, name, dest) tasks in the current process.
+
+    Errors are reported for each entity instead of interrupting the batch.
+    """
+
+    def __init__(self, template, builder, type=None):
+        self.template = template
+        self.builder = builder
+        self.type = type
+
+    def __call__(self, batch):
+        results = []
+        names = self.template.dependencies
+        for idx, name, dest in batch:
+            try:
+                namespace = self.builder.namespace(name, lazy=True, names=names)
+                save_rendered_template(self.template, namespace, dest,
+                                       type=self.type)
+            except Exception as ex:
+                if not isinstance(ex, TemplateError):
+                    ex = '%s (%s): %s' % (dest, ex.__class__.__name__, ex)
+                results.append((idx, name, dest, str(ex)))
+            else:
+                results.append((idx, name, dest, None))
+        return results
+
+
+_WORKER_RENDERER = None
+
+
+def _init_worker(template_path, base, type):
+    global _WORKER_RENDERER
+    template = load_template(template_path, base)
+    _WORKER_RENDERER = _Renderer(template, db.namespace_builder(base), type)
+
+
+def _render_batch(batch):
+    return _WORKER_RENDERER(batch)
 
 
 def save_rendered_template(template, namespace, dest, type=None):
@@ -109,7 +477,7 @@ def render_template_at(template, namespace, dest):
 @render_template_at.register(jinja2.Template)
 def _(template, namespace, dest):
     try:
-        data = template.render(namespace)
+        data = render(template, namespace)
     except Exception as ex:
         msg = 'Error when rendering %r (%s): %s'
         msg = msg % (dest, type(ex).__name__, ex)
@@ -118,23 +486,254 @@ def _(template, namespace, dest):
         F.write(data)
 
 
-def load_jinja_template(path):
+def render(template, namespace):
+    """
+    Render Jinja template with the given namespace.
+
+    Unlike template.render(namespace), it does not copy the namespace into a
+    new dictionary, so values of lazy mappings are only fetched when the
+    template uses them.
+    """
+    vars = ChainMap(namespace, template.globals)
+    context = template.new_context(vars, shared=True)
+    try:
+        return template.environment.concat(template.root_render_func(context))
+    except Exception:
+        return template.environment.handle_exception()
+
+
+def generate(template, namespace):
+    """
+    Like :func:`render`, but yield the output in chunks as the template
+    produces them.
+    """
+    vars = ChainMap(namespace, template.globals)
+    context = template.new_context(vars, shared=True)
+    try:
+        yield from template.root_render_func(context)
+    except Exception:
+        template.environment.handle_exception()
+
+
+def load_template(path, base=None):
+    """
+    Load a text or an open document template from path.
+
+    Open document templates are compiled once and can render many documents.
+    """
+    if os.path.splitext(path)[-1] in ODF_EXTENSIONS:
+        from .loffice import open_template
+
+        return open_template(Path(path))
+    return load_jinja_template(path, base)
+
+
+def load_jinja_template(path, base=None):
     """
     Load template from path.
+
+    Templates inside the project's templates/ folder are loaded through the
+    shared project environment, which caches compiled templates and resolves
+    {% include %} and {% extends %} tags.
     """
+    env = project_environment(base)
     template_path = Path(path)
-    ext = os.path.splitext(template_path)[-1].lstrip('.')
     with template_path.open() as F:
-        jinja_template = as_template(F.read(), ext)
+        source = F.read()
+
+    name = _template_name(env, template_path)
+    if name is None:
+        jinja_template = env.from_string(source)
+    else:
+        jinja_template = env.get_template(name)
     jinja_template.path = template_path
+    jinja_template.dependencies, jinja_template.includes = \
+        _analyze_dependencies(env, source)
     return jinja_template
 
 
-def as_template(data, type='text'):
+def find_dependencies(source, environment=None):
     """
-    Return a Jinja2 template from the given template string.
+    Return the set of top-level variables used by a Jinja template source,
+    including the variables used by the templates it includes or extends.
+
+    Resources that are not in this set are never needed to render the
+    template. Returns None if the template references other templates by
+    dynamic names, since its dependencies cannot be known in advance.
+    """
+    return _analyze_dependencies(environment or ENVIRONMENT, source)[0]
+
+
+def template_dependencies(path, base=None):
     """
-    env = jinja2.Environment()
+    Return the set of top-level variables used by the template at path.
+
+    Works with text and with open document templates.
+    """
+    ext = os.path.splitext(path)[-1]
+    if ext in ODF_EXTENSIONS:
+        from .loffice import open_template
+
+        with open_template(path) as template:
+            return template.dependencies
+    return load_jinja_template(path, base).dependencies
+
+
+def compile_templates(base=None):
+    """
+    Compile all text templates of the project and store the results in the
+    bytecode cache, so later runs skip parsing them.
+
+    Returns:
+        A tuple with the list of compiled template names and a mapping from
+        the names of broken templates to error messages.
+    """
+    env = project_environment(base)
+    templates_dir = Path(env.loader.searchpath[0])
+    compiled = []
+    errors = {}
+    for name in env.list_templates():
+        if os.path.splitext(name)[-1] in ODF_EXTENSIONS:
+            continue
+        try:
+            load_jinja_template(templates_dir / name, base)
+        except (jinja2.TemplateError, UnicodeDecodeError, OSError) as ex:
+            errors[name] = '%s: %s' % (type(ex).__name__, ex)
+        else:
+            compiled.append(name)
+    return compiled, errors
+
+
+def project_environment(base=None):
+    """
+    Return the shared Jinja environment of the project at base.
+
+    Templates are loaded from the templates/ folder and compiled templates
+    are cached under .buroca/jinja/. The environment is created once per
+    project.
+    """
+    base = os.path.abspath(base or os.getcwd())
+    try:
+        return _ENVIRONMENTS[base]
+    except KeyError:
+        pass
+
+    templates_dir = os.path.join(base, 'templates')
+    bytecode_cache = cache_dir = None
+    if os.path.isdir(templates_dir):
+        cache_dir = buroca_path('jinja', base=base)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(str(cache_dir))
+    env = new_environment(loader=jinja2.FileSystemLoader(templates_dir),
+                          bytecode_cache=bytecode_cache)
+    env.dependency_cache = cache_dir
+    _ENVIRONMENTS[base] = env
+    return env
+
+
+def new_environment(**kwargs):
+    """
+    Return a new Jinja environment with buroca's filters and globals.
+    """
+    env = jinja2.Environment(**kwargs)
     env.filters.update(FILTERS)
     env.globals.update(GLOBALS)
-    return env.from_string(data)
+    env.dependency_cache = None
+    return env
+
+
+ENVIRONMENT = new_environment()
+
+
+def as_template(data, type='text'):
+    """
+    Return a Jinja2 template from the given template string.
+
+    Templates are compiled in a shared environment and memoized, so the same
+    string is compiled only once.
+    """
+    return _compile_string(data)
+
+
+@lru_cache(maxsize=1024)
+def _compile_string(data):
+    return ENVIRONMENT.from_string(data)
+
+
+def _template_name(env, path):
+    """
+    Return the loader name of the template at path or None if path is not
+    in the loader's search path.
+    """
+    for root in env.loader.searchpath:
+        try:
+            name = path.absolute().relative_to(os.path.abspath(root))
+        except ValueError:
+            continue
+        return name.as_posix()
+    return None
+
+
+def _analyze_dependencies(env, source, seen=None):
+    """
+    Return the set of variables used by source and by the templates it
+    references and the list of files of the referenced templates.
+    """
+    seen = set() if seen is None else seen
+    variables, references = _parse_dependencies(env, source)
+    names = set(variables)
+    files = []
+    for ref in references:
+        if ref is None:
+            names = None
+            continue
+        if ref in seen or env.loader is None:
+            continue
+        seen.add(ref)
+        try:
+            ref_source, filename, _ = env.loader.get_source(env, ref)
+        except jinja2.TemplateNotFound:
+            continue
+        files.append(filename)
+        ref_names, ref_files = _analyze_dependencies(env, ref_source, seen)
+        files.extend(ref_files)
+        if names is not None:
+            names = None if ref_names is None else names | ref_names
+    return names, files
+
+
+def _parse_dependencies(env, source):
+    """
+    Return the variables and the referenced templates of source.
+
+    Results are stored next to the bytecode cache, if the environment has
+    one, so templates are not parsed again in later runs.
+    """
+    if env.dependency_cache is None:
+        return _parse_dependencies_uncached(env, source)
+
+    digest = hashlib.sha1(source.encode('utf8')).hexdigest()
+    path = os.path.join(str(env.dependency_cache), 'deps-%s.json' % digest)
+    try:
+        with open(path) as F:
+            data = json.load(F)
+        return data['variables'], data['references']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    variables, references = _parse_dependencies_uncached(env, source)
+    tmp = '%s.%s.tmp' % (path, os.getpid())
+    try:
+        with open(tmp, 'w') as F:
+            json.dump({'variables': variables, 'references': references}, F)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    return variables, references
+
+
+def _parse_dependencies_uncached(env, source):
+    ast = env.parse(source)
+    variables = sorted(meta.find_undeclared_variables(ast))
+    references = list(meta.find_referenced_templates(ast))
+    return variables, references
@@ -0,0 +1,367 @@
+"""
+Rebuild reports when files in data/ or templates/ change.
+
+A :class:`WatchSession` keeps the loaded templates, the namespace builder
+and the list of entities in memory between rebuilds. Parsed data files stay
+in :data:`buroca.db.RESOURCE_CACHE`, so only files that changed are parsed
+again, and only the reports that depend on the changed files are rendered.
+
+File changes are detected with inotify on Linux and by polling modification
+times elsewhere.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from pathlib import Path
+
+import jinja2
+
+from . import db
+from .errors import BurocaException
+from .templates import load_template, save_rendered_all
+
+# inotify constants (from <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_CREATE | IN_DELETE
+WATCH_MASK |= IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF
+_EVENT = struct.Struct('iIII')
+
+
+class WatchSession:
+    """
+    Keep the state needed to render a group of templates warm and rebuild
+    only the reports affected by changed files.
+
+    Args:
+        templates (list):
+            Paths of the watched templates.
+        type (str):
+            Output type passed to the converter.
+        base (path):
+            Optional base path for the project's files. If not given, uses CWD.
+    """
+
+    def __init__(self, templates, type=None, base=None):
+        self.base = Path(base or os.getcwd()).absolute()
+        self.datadir = self.base / 'data'
+        self.type = type
+        self.templates = {Path(path).absolute(): None for path in templates}
+        self.builder = None
+        self.entities = None
+        self._known = set()
+
+    def build(self, force=False):
+        """
+        Load all state and build all outdated reports.
+
+        Returns:
+            A mapping from template paths to (rebuilt, skipped) tuples.
+        """
+        self._refresh_data()
+        return {path: self._render(path, self.entities, force)
+                for path in self.templates if self._load(path)}
+
+    def update(self, paths):
+        """
+        Refresh state after the given files changed and rebuild the reports
+        that depend on them.
+
+        Returns:
+            A mapping from template paths to (rebuilt, skipped) tuples for
+            the templates that were rebuilt.
+        """
+        paths = {Path(path).absolute() for path in paths}
+        if any(path.is_dir() for path in paths):
+            # Watchers report their root directories when events were lost
+            # (e.g., inotify queue overflow). Reload everything and rebuild
+            # all outdated reports.
+            return self.build()
+
+        data_paths = {path for path in paths if _is_inside(path, self.datadir)}
+        if data_paths:
+            self._refresh_data(data_paths)
+
+        results = {}
+        for path in self.templates:
+            template = self.templates[path]
+            includes = {Path(p).absolute() for p in
+                        getattr(template, 'includes', ())}
+            if template is None or path in paths or includes & paths:
+                if not self._load(path):
+                    continue
+                entities = self.entities
+            else:
+                entities = self.affected_entities(template, data_paths)
+            if entities:
+                results[path] = self._render(path, entities)
+        return results
+
+    def affected_entities(self, template, paths):
+        """
+        Return the list of entities whose reports for template depend on any
+        of the given data files.
+        """
+        names = template.dependencies
+        selected = set()
+        for path in paths:
+            parts = path.relative_to(self.datadir).parts
+            if not parts:
+                return self.entities
+            name = db._resource_name(Path(parts[0]))
+            if names is not None and name not in names:
+                continue
+            if len(parts) == 1:
+                return self.entities
+            selected.add(os.path.splitext(parts[-1])[0])
+        return [name for name in self.entities if name in selected]
+
+    def _load(self, path):
+        """
+        (Re)load template and return True on success.
+        """
+        old = self.templates[path]
+        if old is not None and hasattr(old, 'close'):
+            old.close()
+        try:
+            self.templates[path] = load_template(str(path), self.base)
+        except (OSError, BurocaException, jinja2.TemplateError) as ex:
+            self.templates[path] = None
+            print('%s: %s' % (path, ex))
+            return False
+        return True
+
+    def _render(self, path, entities, force=False):
+        try:
+            return save_rendered_all(
+                str(path), type=self.type, base=self.base, force=force,
+                template=self.templates[path], builder=self.builder,
+                entities=entities)
+        except BurocaException as ex:
+            print(ex)
+            return [], []
+
+    def _refresh_data(self, paths=None):
+        """
+        Create a new namespace builder. Unchanged data files are not parsed
+        again since they are kept in the resource cache. The list of entities
+        is only computed again if files were created or removed.
+        """
+        from .store import open_store
+
+        store = open_store(self.base)
+        if store is not None:
+            store.compile()
+            store.close()
+        if self.builder is not None:
+            self.builder.close()
+        self.builder = db.namespace_builder(self.base)
+        if paths is None or self.entities is None \
+                or any(not path.exists() or path.is_dir() for path in paths) \
+                or any(str(path) not in self._known for path in paths):
+            self.entities = self.builder.entities()
+            self._known = {str(path) for path in _walk(self.datadir)}
+
+
+#
+# File watchers
+#
+class InotifyWatcher:
+    """
+    Watch directory trees using the Linux inotify API.
+
+    Raises OSError if inotify is not available.
+    """
+
+    def __init__(self, paths):
+        name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.roots = [Path(path).absolute() for path in paths]
+        self.watches = {}
+        for root in self.roots:
+            self._add_tree(root)
+
+    def poll(self, timeout=None):
+        """
+        Wait up to timeout seconds (forever if None) and return the set of
+        paths that changed.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changed = set()
+        for mask, path in self._read_events():
+            if path is None:
+                changed.update(self.roots)
+            elif mask & IN_ISDIR:
+                # Files inside deleted directories have their own events,
+                # but not the files of directories moved elsewhere
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(path)
+                    changed.update(_walk(path))
+                elif mask & IN_MOVED_FROM:
+                    changed.add(path)
+            elif not _is_ignored(path):
+                changed.add(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def _read_events(self):
+        """
+        Read pending events and yield (mask, path) pairs. The path is None
+        if the event queue overflowed and events were lost.
+        """
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, size = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = os.fsdecode(data[pos:pos + size].rstrip(b'\0'))
+            pos += size
+            if mask & IN_Q_OVERFLOW:
+                yield mask, None
+            elif mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            elif wd in self.watches and name:
+                yield mask, self.watches[wd] / name
+
+    def _add_tree(self, root):
+        for directory, _, _ in os.walk(str(root)):
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                              WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = Path(directory)
+
+
+class PollingWatcher:
+    """
+    Watch directory trees by comparing the modification time and size of
+    files at regular intervals.
+    """
+
+    def __init__(self, paths, interval=1.0):
+        self.roots = [Path(path).absolute() for path in paths]
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def poll(self, timeout=None):
+        """
+        Wait up to timeout seconds (forever if None) and return the set of
+        paths that changed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._scan()
+            changed = {path for path in snapshot.keys() | self.snapshot.keys()
+                       if snapshot.get(path) != self.snapshot.get(path)}
+            self.snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is None:
+                delay = self.interval
+            else:
+                delay = min(self.interval, deadline - time.monotonic())
+                if delay <= 0:
+                    return set()
+            time.sleep(delay)
+
+    def close(self):
+        pass
+
+    def _scan(self):
+        result = {}
+        for root in self.roots:
+            for path in _walk(root):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                result[path] = (stat.st_mtime_ns, stat.st_size)
+        return result
+
+
+def new_watcher(paths, polling=False, interval=1.0):
+    """
+    Return an :class:`InotifyWatcher` for the given directories, or a
+    :class:`PollingWatcher` if inotify is not available or polling is True.
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError, TypeError):
+            pass
+    return PollingWatcher(paths, interval)
+
+
+def changes(watcher, delay=0.2):
+    """
+    Iterate over sets of changed paths.
+
+    Changes separated by less than delay seconds are grouped together, so
+    editors that write files in several steps trigger a single rebuild.
+    """
+    while True:
+        changed = watcher.poll()
+        while True:
+            more = watcher.poll(delay)
+            if not more:
+                break
+            changed |= more
+        if changed:
+            yield changed
+
+
+#
+# Auxiliary functions
+#
+def _walk(root):
+    for directory, _, files in os.walk(str(root)):
+        for name in files:
+            path = Path(directory, name)
+            if not _is_ignored(path):
+                yield path
+
+
+def _is_ignored(path):
+    """
+    Ignore hidden files and editor backups.
+    """
+    name = path.name
+    return name.startswith(('.', '#')) or name.endswith(('~', '.swp', '.tmp'))
+
+
+def _is_inside(path, directory):
+    try:
+        path.relative_to(directory)
+    except ValueError:
+        return False
+    return True
@@ -12,3 +12,12 @@ def bump_version(ctx, part='patch'):
         raise SystemExit(msg)
     
     ctx.run('bumpversion --config-file bumpversion.cfg %s' % part)
+
+
+@task(
+    help={'files': 'number of converted files'}
+)
+def bench_convert(ctx, files=200):
+    "Compare in-process and pandoc conversion costs per file."
+
+    ctx.run('PYTHONPATH=src python benchmarks/bench_convert.py %s' % files)
@@ -0,0 +1,185 @@
+import asyncio
+import os
+import shutil
+
+import mock
+import pytest
+
+from buroca.build import Manifest, build_record, file_hash
+from buroca.errors import TemplateError
+from buroca.templates import save_rendered_all, save_rendered_for
+from buroca.templates import load_template, save_rendered_single
+from tests.conftest import simple_example, get_data
+
+path = simple_example
+
+
+def touch(path, data):
+    with open(path, 'w') as F:
+        F.write(data)
+    os.utime(path, ns=(10 ** 18, 10 ** 18))
+
+
+@pytest.mark.usefixtures('path')
+class TestIncrementalBuild:
+    def test_skips_up_to_date_reports(self):
+        rebuilt, skipped = save_rendered_all('templates/phrase.md')
+        assert len(rebuilt) == 4 and skipped == []
+
+        rebuilt, skipped = save_rendered_all('templates/phrase.md')
+        assert rebuilt == [] and len(skipped) == 4
+
+        touch('data/person/john.yml', 'name: John\nrole: guitar player')
+        rebuilt, skipped = save_rendered_all('templates/phrase.md')
+        assert rebuilt == ['john'] and len(skipped) == 3
+        assert get_data('reports/phrase-john.md') == \
+            "John is Beatles's guitar player."
+
+    def test_interrupted_build_keeps_finished_reports(self):
+        from buroca.templates import save_rendered_template as render
+        calls = []
+
+        def interrupt(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+            return render(*args, **kwargs)
+
+        with mock.patch('buroca.templates.save_rendered_template', interrupt):
+            with pytest.raises(KeyboardInterrupt):
+                save_rendered_all('templates/phrase.md')
+
+        rebuilt, skipped = save_rendered_all('templates/phrase.md')
+        assert len(rebuilt) == 2 and len(skipped) == 2
+
+    def test_global_changes_rebuild_everything(self):
+        save_rendered_all('templates/phrase.md')
+        touch('data/band.yml', 'name: The Beatles')
+        rebuilt, skipped = save_rendered_all('templates/phrase.md')
+        assert len(rebuilt) == 4 and skipped == []
+
+    def test_force_and_deleted_outputs(self):
+        save_rendered_all('templates/phrase.md')
+        os.unlink('reports/phrase-paul.md')
+        assert save_rendered_all('templates/phrase.md')[0] == ['paul']
+
+        rebuilt, _ = save_rendered_all('templates/phrase.md', force=True)
+        assert len(rebuilt) == 4
+
+    def test_save_rendered_for(self):
+        args = ('templates/phrase.md', 'reports/john.md', 'john')
+        assert save_rendered_for(*args) is True
+        assert save_rendered_for(*args) is False
+        assert save_rendered_for(*args, type='markdown') is True
+
+
+class TestManifest:
+    def test_records_persist(self, temp_dir):
+        template = os.path.join(temp_dir, 'template.md')
+        dest = os.path.join(temp_dir, 'dest.md')
+        touch(template, '{{ foo }}')
+        touch(dest, 'bar')
+        record = build_record(template, [os.path.join(temp_dir, 'missing')])
+        assert record['template'] == file_hash(template)
+
+        manifest = Manifest(os.path.join(temp_dir, 'manifest.json'))
+        manifest.update(dest, record)
+        manifest.save()
+        assert Manifest(manifest.path).is_up_to_date(dest, record)
+
+    def test_records_converter_and_tool_version(self, temp_dir):
+        template = os.path.join(temp_dir, 'template.md')
+        touch(template, '{{ foo }}')
+        with mock.patch('buroca.convert.tool_version', return_value='v1'):
+            old = build_record(template, [], 'html')
+        with mock.patch('buroca.convert.tool_version', return_value='v2'):
+            new = build_record(template, [], 'html')
+        assert old != new
+        assert new['conversion']['converter']['args'][0] == 'pandoc'
+        assert 'v2' in new['conversion']['converter']['versions']
+
+
+@pytest.mark.usefixtures('path')
+class TestParallelBuild:
+    def test_render_with_process_pool(self, capsys):
+        rebuilt, _ = save_rendered_all('templates/phrase.md', jobs=2)
+        assert sorted(rebuilt) == ['george', 'john', 'paul', 'ringo']
+        assert get_data('reports/phrase-ringo.md') == \
+            "Ringo is Beatles's drummer."
+
+        lines = capsys.readouterr().out.splitlines()
+        assert [line[:5] for line in lines[:4]] == \
+            ['(1/4)', '(2/4)', '(3/4)', '(4/4)']
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_intermediate_files_are_bounded(self, jobs):
+        for idx in range(40):
+            touch('data/person/p%s.yml' % idx, 'name: P%s\nrole: x' % idx)
+        os.mkdir('reports')
+        waiting = []
+
+        async def convert(src, dest, infmt=None, outfmt=None):
+            waiting.append(len(os.listdir(os.path.dirname(src))))
+            await asyncio.sleep(0.005)
+            shutil.copyfile(src, dest)
+
+        with mock.patch('buroca.convert.convert_file_async', convert):
+            rebuilt, _ = save_rendered_all('templates/phrase.md', type='md',
+                                           jobs=jobs)
+        assert len(rebuilt) == 44
+
+        # Rendered ahead + queued + converting + held by the producer
+        assert max(waiting) <= 2 * jobs + 2 * jobs + jobs + 1
+
+    def test_given_template_is_used(self):
+        touch('templates/other.md', '{{ person.name }} plays.')
+        template = load_template('templates/other.md')
+        touch('templates/other.md', 'changed on disk')
+        save_rendered_all('templates/phrase.md', jobs=2, template=template)
+        assert get_data('reports/phrase-ringo.md') == 'Ringo plays.'
+
+    def test_errors_are_reported_in_order(self):
+        touch('templates/phrase.md', '{{ person.name.foo() }}')
+        with pytest.raises(TemplateError) as ex:
+            save_rendered_all('templates/phrase.md', jobs=2)
+        assert str(ex.value).count('\n') == 3
+
+
+@pytest.mark.usefixtures('path')
+class TestSingleOutput:
+    def test_join_documents(self, capsys):
+        rebuilt, _ = save_rendered_single('templates/phrase.md',
+                                          separator='\n---\n')
+        assert len(rebuilt) == 4
+        data = get_data('reports/phrase.md')
+        assert data.count('\n---\n') == 3
+        names = [part.split()[0].lower() for part in data.split('\n---\n')]
+        assert names == [str(entity) for entity in rebuilt]
+
+        rebuilt, skipped = save_rendered_single('templates/phrase.md',
+                                                separator='\n---\n')
+        assert rebuilt == [] and len(skipped) == 4
+
+    def test_converts_once(self):
+        with mock.patch('buroca.templates.convert_file') as convert:
+            save_rendered_single('templates/phrase.md', type='pdf', jobs=2)
+        (src, dest), _ = convert.call_args
+        assert convert.call_count == 1 and str(dest) == 'reports/phrase.pdf'
+
+    def test_page_breaks_depend_on_template_format(self):
+        joined = []
+
+        def convert(src, dest):
+            with open(src) as F:
+                joined.append(F.read())
+
+        touch('templates/phrase.html', '<p>{{ person.name }}</p>')
+        with mock.patch('buroca.templates.convert_file', convert):
+            save_rendered_single('templates/phrase.md', type='html')
+            save_rendered_single('templates/phrase.md', type='pdf')
+            save_rendered_single('templates/phrase.html', type='pdf')
+        md_html, md_pdf, html_pdf = joined
+        assert md_html.count('<div style="page-break-after') == 3
+        assert md_pdf.count('\\newpage') == 3
+        assert html_pdf.count('<div style="page-break-after') == 3
+        assert '\\newpage' not in html_pdf
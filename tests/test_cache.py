@@ -0,0 +1,150 @@
+import os
+
+from buroca.cache import ResourceCache, DiskCache, ConversionCache
+
+
+def read(path):
+    with open(path) as F:
+        return F.read()
+
+
+def write(path, data, mtime_ns=None):
+    with open(path, 'w') as F:
+        F.write(data)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+class TestResourceCache:
+    def test_reuses_value_of_unchanged_file(self, temp_dir):
+        path = os.path.join(temp_dir, 'a.txt')
+        write(path, 'foo')
+        cache = ResourceCache()
+
+        assert cache.get(path, read) == 'foo'
+        assert cache.get(path, read) == 'foo'
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+
+    def test_reloads_changed_file(self, temp_dir):
+        path = os.path.join(temp_dir, 'a.txt')
+        write(path, 'foo', mtime_ns=10 ** 18)
+        cache = ResourceCache()
+        assert cache.get(path, read) == 'foo'
+
+        write(path, 'bar', mtime_ns=10 ** 18 + 1)
+        assert cache.get(path, read) == 'bar'
+        assert cache.stats()['misses'] == 2
+        assert len(cache) == 1
+
+    def test_evicts_by_entries_and_bytes(self, temp_dir):
+        paths = [os.path.join(temp_dir, '%s.txt' % i) for i in range(4)]
+        for path in paths:
+            write(path, 'x' * 10)
+
+        cache = ResourceCache(max_entries=2)
+        for path in paths:
+            cache.get(path, read)
+        assert len(cache) == 2
+        assert cache.stats()['evictions'] == 2
+
+        cache.resize(max_bytes=15)
+        assert len(cache) == 1
+        assert cache.stats()['bytes'] == 10
+
+
+class TestDiskCache:
+    def test_persists_values_between_instances(self, temp_dir):
+        path = os.path.join(temp_dir, 'a.txt')
+        write(path, 'foo')
+        cache_dir = os.path.join(temp_dir, 'cache')
+
+        cache = DiskCache(cache_dir)
+        assert cache.get(path, read) == 'foo'
+        assert cache.stats()['misses'] == 1
+
+        cache = DiskCache(cache_dir)
+        assert cache.get(path, read) == 'foo'
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['entries'] == 1
+
+        cache.clear()
+        assert cache.stats()['entries'] == 0
+
+    def test_invalidates_changed_files(self, temp_dir):
+        path = os.path.join(temp_dir, 'a.txt')
+        write(path, 'foo', mtime_ns=10 ** 18)
+        cache = DiskCache(os.path.join(temp_dir, 'cache'))
+        cache.get(path, read)
+
+        write(path, 'foobar', mtime_ns=10 ** 18 + 1)
+        assert DiskCache(cache.path).get(path, read) == 'foobar'
+
+    def test_unloadable_entries_are_misses(self, temp_dir):
+        path = os.path.join(temp_dir, 'a.txt')
+        write(path, 'foo')
+        cache = DiskCache(os.path.join(temp_dir, 'cache'))
+        cache.get(path, read)
+        entry, = cache._entries()
+
+        # A pickle of a class that was moved or renamed
+        with open(str(entry), 'wb') as F:
+            F.write(b'\x80\x03cno_such_module\nThing\nq\x00.')
+        assert cache.get(path, read) == 'foo'
+        assert cache.stats()['misses'] == 2
+        assert DiskCache(cache.path).get(path, read) == 'foo'
+
+    def test_write_errors_are_ignored(self, temp_dir):
+        path = os.path.join(temp_dir, 'a.txt')
+        write(path, 'foo')
+        cache_dir = os.path.join(temp_dir, 'cache')
+        write(cache_dir, 'not a directory')
+        assert DiskCache(cache_dir).get(path, read) == 'foo'
+
+
+class TestConversionCache:
+    def test_restores_results_by_content(self, temp_dir):
+        cache = ConversionCache(os.path.join(temp_dir, 'cache'))
+        paths = {name: os.path.join(temp_dir, name)
+                 for name in ['a.md', 'a.html', 'b.md', 'b.html']}
+        write(paths['a.md'], 'foo')
+        write(paths['a.html'], 'bar')
+        write(paths['b.md'], 'foo')
+
+        key = cache.key(paths['a.md'], 'markdown', 'html')
+        assert not cache.get(key, paths['a.html'])
+        cache.put(key, paths['a.html'])
+        assert cache.key(paths['a.md'], 'markdown', 'pdf') != key
+
+        assert cache.get(cache.key(paths['b.md'], 'markdown', 'html'),
+                         paths['b.html'])
+        assert read(paths['b.html']) == 'bar'
+        assert cache.stats() == \
+            {'hits': 1, 'misses': 1, 'entries': 1, 'bytes': 3}
+
+    def test_restored_files_are_writable_copies(self, temp_dir):
+        cache = ConversionCache(os.path.join(temp_dir, 'cache'))
+        path = os.path.join(temp_dir, 'out')
+        write(path, 'foo')
+        cache.put('0' * 8, path)
+        os.unlink(path)
+
+        assert cache.get('0' * 8, path)
+        write(path, 'bar')
+        entry = cache._entry_path('0' * 8)
+        assert not os.path.samefile(path, str(entry))
+        assert read(str(entry)) == 'foo'
+
+    def test_evicts_least_recently_used(self, temp_dir):
+        cache = ConversionCache(os.path.join(temp_dir, 'cache'), max_bytes=10)
+        path = os.path.join(temp_dir, 'out')
+        for idx, data in enumerate(['aaaa', 'bbbb', 'cccc']):
+            write(path, data)
+            cache.put(str(idx) * 8, path)
+            entry = cache._entry_path(str(idx) * 8)
+            os.utime(str(entry), ns=(idx * 10 ** 9, idx * 10 ** 9))
+            os.unlink(path)
+
+        assert cache.stats()['bytes'] == 8
+        assert not cache.get('0' * 8, path)
+        assert cache.get('2' * 8, path)
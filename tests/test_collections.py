@@ -0,0 +1,80 @@
+import sqlite3
+
+import pytest
+
+from buroca.db import load_for, load_all, CsvCollection, SqliteCollection
+from buroca.db import NamespaceBuilder
+
+BAND = {'data/band.yml': 'name: Beatles'}
+CSV_DATA = (
+    'id,name,role\n'
+    'john,John,singer\n'
+    'paul,Paul,"bass\nplayer"\n'
+    'ringo,Ringo,drummer\n'
+)
+
+
+class TestCsvCollection:
+    def test_load_for_and_all(self, tree):
+        with tree(dict(BAND, **{'data/person.csv': CSV_DATA})):
+            assert load_for('ringo') == {
+                'band': {'name': 'Beatles'},
+                'person': {'id': 'ringo', 'name': 'Ringo', 'role': 'drummer'},
+            }
+            assert list(load_all()) == ['john', 'paul', 'ringo']
+
+    def test_index_handles_multiline_rows(self, tree):
+        with tree({'person.csv': CSV_DATA}):
+            people = CsvCollection('person.csv')
+            assert people.get('paul')['role'] == 'bass\nplayer'
+            assert people.get('ringo')['name'] == 'Ringo'
+            assert people.get('george') is None
+            assert list(people.names()) == ['john', 'paul', 'ringo']
+
+    def test_configurable_key(self, tree):
+        with tree({'person.csv': CSV_DATA}):
+            people = CsvCollection('person.csv', key='name')
+            assert people.get('John')['id'] == 'john'
+
+    def test_key_from_file_name(self, tree):
+        with tree(dict(BAND, **{'data/person.name.csv': CSV_DATA})):
+            builder = NamespaceBuilder()
+            assert sorted(builder.names()) == ['band', 'person']
+            assert sorted(builder.entities()) == ['John', 'Paul', 'Ringo']
+            assert builder.namespace('John')['person']['id'] == 'john'
+
+    def test_collection_has_priority_over_folder(self, tree):
+        data = dict(BAND, **{
+            'data/person.csv': CSV_DATA,
+            'data/person/john.yml': 'name: Other John',
+        })
+        with tree(data):
+            assert load_for('john')['person']['name'] == 'John'
+
+
+class TestSqliteCollection:
+    def test_load_from_table(self, tree):
+        with tree(BAND):
+            conn = sqlite3.connect('data/person.sqlite')
+            conn.execute('CREATE TABLE person (id TEXT, name TEXT, age INT)')
+            conn.executemany('INSERT INTO person VALUES (?, ?, ?)', [
+                ('john', 'John', 40), ('paul', 'Paul', 78),
+            ])
+            conn.commit()
+            conn.close()
+
+            assert load_for('paul')['person'] == \
+                {'id': 'paul', 'name': 'Paul', 'age': 78}
+            people = SqliteCollection('data/person.sqlite')
+            assert dict(people.items())['john']['age'] == 40
+
+
+class TestSpreadsheetCollection:
+    def test_load_ods(self, tree):
+        pyexcel_ods3 = pytest.importorskip('pyexcel_ods3')
+        with tree(BAND):
+            pyexcel_ods3.save_data('data/person.ods', {'people': [
+                ['id', 'name'], ['john', 'John'], ['paul', 'Paul'],
+            ]})
+            assert load_for('john')['person'] == {'id': 'john', 'name': 'John'}
+            assert sorted(load_all()) == ['john', 'paul']
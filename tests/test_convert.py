@@ -0,0 +1,159 @@
+import os
+
+import mock
+import pytest
+
+from buroca import convert
+from buroca.cache import ConversionCache
+from buroca.convert import ConversionScheduler, ConversionPipeline
+from buroca.convert import CONVERTERS, Converter, get_converter, convert_file
+from buroca.errors import ConversionError
+
+
+def fake_command(src, dest, formats):
+    if 'fail' in str(src):
+        return ['sh', '-c', 'echo oops >&2; exit 3']
+    return ['cp', str(src), str(dest)]
+
+
+def fake_converters():
+    converter = Converter(fake_command, True, None, 100)
+    return mock.patch.dict(CONVERTERS, {('markdown', 'html'): [converter]})
+
+
+class TestConversionScheduler:
+    def test_runs_jobs_and_reports_errors(self, temp_dir):
+        scheduler = ConversionScheduler(max_jobs=2)
+        for name in ['a', 'fail', 'b']:
+            src = os.path.join(temp_dir, name + '.md')
+            with open(src, 'w') as F:
+                F.write(name)
+            scheduler.submit(src, os.path.join(temp_dir, name + '.html'))
+
+        with fake_converters():
+            results = scheduler.run(check=False)
+
+        assert results[0] is None and results[2] is None
+        assert results[1].returncode == 3
+        assert results[1].stderr.strip() == 'oops'
+        with open(os.path.join(temp_dir, 'b.html')) as F:
+            assert F.read() == 'b'
+
+    def test_check_raises_first_error(self, temp_dir):
+        scheduler = ConversionScheduler()
+        scheduler.submit(os.path.join(temp_dir, 'fail.md'), 'out.html')
+        with fake_converters():
+            with pytest.raises(ConversionError):
+                scheduler.run()
+
+    def test_copies_files_of_same_format(self, temp_dir):
+        src = os.path.join(temp_dir, 'a.md')
+        with open(src, 'w') as F:
+            F.write('foo')
+        scheduler = ConversionScheduler()
+        scheduler.submit(src, os.path.join(temp_dir, 'b.markdown'))
+        assert scheduler.run() == [None]
+
+
+class TestConversionPipeline:
+    def test_converts_items_while_they_are_produced(self, temp_dir):
+        produced = []
+
+        def items():
+            for name in ['a', 'fail', 'b', 'c']:
+                src = os.path.join(temp_dir, name + '.md')
+                with open(src, 'w') as F:
+                    F.write(name)
+                produced.append(name)
+                yield name, src, os.path.join(temp_dir, name + '.html')
+
+        pipeline = ConversionPipeline(max_jobs=1, depth=1)
+        with fake_converters():
+            errors = pipeline.run(items())
+
+        assert produced == ['a', 'fail', 'b', 'c']
+        assert list(errors) == ['fail']
+        assert sorted(os.listdir(temp_dir)) == ['a.html', 'b.html', 'c.html']
+
+    def test_callback_errors_do_not_stop_consumers(self, temp_dir):
+        def items():
+            for idx in range(10):
+                src = os.path.join(temp_dir, '%s.md' % idx)
+                with open(src, 'w') as F:
+                    F.write(str(idx))
+                yield idx, src, os.path.join(temp_dir, '%s.html' % idx)
+
+        def callback(key):
+            finished.append(key)
+            if key == 0:
+                raise ValueError(key)
+
+        finished = []
+        pipeline = ConversionPipeline(max_jobs=1, depth=1)
+        with fake_converters(), pytest.raises(ValueError):
+            pipeline.run(items(), callback)
+        assert finished == list(range(10))
+        assert not [name for name in os.listdir(temp_dir)
+                    if name.endswith('.md')]
+
+
+class TestConverterRegistry:
+    def test_prefers_available_in_process_converters(self):
+        with mock.patch('buroca.convert._has_module', lambda name: True):
+            assert get_converter('a.md', 'markdown', 'html').command
+            with mock.patch('buroca.convert.IN_PROCESS_CONVERTERS', True):
+                assert not get_converter('a.md', 'markdown', 'html').command
+        with mock.patch('buroca.convert._has_module', lambda name: False), \
+                mock.patch('buroca.convert.IN_PROCESS_CONVERTERS', True):
+            assert get_converter('a.md', 'markdown', 'html').command
+        assert get_converter('a.md', 'markdown', 'markdown') is None
+        with pytest.raises(RuntimeError):
+            get_converter('a.md', 'markdown', 'odt')
+
+    def test_in_process_markdown_to_html(self, temp_dir):
+        pytest.importorskip('markdown')
+        src = os.path.join(temp_dir, 'a.md')
+        with open(src, 'w') as F:
+            F.write('*foo*')
+        with mock.patch('buroca.convert.IN_PROCESS_CONVERTERS', True):
+            convert_file(src, os.path.join(temp_dir, 'a.html'))
+        with open(os.path.join(temp_dir, 'a.html')) as F:
+            assert F.read() == '<p><em>foo</em></p>\n'
+
+    def test_in_process_markdown_matches_pandoc_quotes(self, temp_dir):
+        pytest.importorskip('markdown')
+        src = os.path.join(temp_dir, 'a.md')
+        with open(src, 'w') as F:
+            F.write("John is Beatles's singer.")
+        with mock.patch('buroca.convert.IN_PROCESS_CONVERTERS', True):
+            convert_file(src, os.path.join(temp_dir, 'a.html'))
+
+        # Same output as pandoc in tests/test_cli.py
+        with open(os.path.join(temp_dir, 'a.html')) as F:
+            assert F.read() == "<p>John is Beatles\u2019s singer.</p>\n"
+
+
+class TestCachedConversions:
+    def test_identical_inputs_are_converted_once(self, temp_dir):
+        calls = []
+
+        def fake_convert(src, dest, formats):
+            calls.append(src)
+            with open(dest, 'w') as F:
+                F.write('<p>%s</p>' % open(src).read())
+
+        converter = Converter(fake_convert, False, None, 100)
+        cache = ConversionCache(os.path.join(temp_dir, 'cache'))
+        paths = [os.path.join(temp_dir, name) for name in 'abc']
+        for path, data in zip(paths, ['foo', 'foo', 'bar']):
+            with open(path + '.md', 'w') as F:
+                F.write(data)
+
+        with mock.patch.dict(CONVERTERS, {('markdown', 'html'): [converter]}), \
+                mock.patch.object(convert, 'CONVERSION_CACHE', cache):
+            for path in paths + paths:
+                convert_file(path + '.md', path + '.html')
+
+        assert len(calls) == 2
+        with open(paths[1] + '.html') as F:
+            assert F.read() == '<p>foo</p>'
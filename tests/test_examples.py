@@ -1,8 +1,13 @@
+import os
+
+import mock
 import pytest
 
-from buroca.db import load_for, load_all
-from buroca.templates import save_rendered_for
-from tests.conftest import simple_example
+from buroca.db import load_for, load_all, NamespaceBuilder
+from buroca.templates import save_rendered_for, save_rendered_all
+from buroca.templates import as_template, render, load_jinja_template
+from buroca.templates import compile_templates, project_environment
+from tests.conftest import simple_example, get_data
 
 path = simple_example
 
@@ -45,3 +50,90 @@ class TestSimpleExample:
         save_rendered_for('templates/phrase.md', 'result.md', 'john')
         with open('result.md') as F:
             assert F.read() == "John is Beatles's singer."
+
+    def test_render_template_for_all(self):
+        save_rendered_all('templates/phrase.md')
+        with open('reports/phrase-ringo.md') as F:
+            assert F.read() == "Ringo is Beatles's drummer."
+
+    def test_loaded_templates_are_closed(self):
+        template = load_jinja_template('templates/phrase.md')
+        with mock.patch.object(template, 'close', create=True) as close, \
+                mock.patch('buroca.templates.load_template',
+                           return_value=template):
+            save_rendered_for('templates/phrase.md', 'result.md', 'john')
+            save_rendered_all('templates/phrase.md', force=True)
+            assert close.call_count == 2
+
+            save_rendered_all('templates/phrase.md', force=True,
+                              template=template)
+            assert close.call_count == 2
+
+    def test_namespace_builder_shares_globals(self):
+        builder = NamespaceBuilder()
+        assert sorted(builder.entities()) == ['george', 'john', 'paul', 'ringo']
+        john = builder.namespace('john')
+        paul = builder.namespace('paul')
+        assert john['band'] is paul['band']
+        assert john['person'] == dict(name='John', role='singer')
+
+    def test_lazy_namespace_only_loads_used_resources(self):
+        builder = NamespaceBuilder()
+        namespace = builder.namespace('john', lazy=True)
+        template = as_template('{{ person.name }}')
+
+        with mock.patch.object(builder, 'resource',
+                               wraps=builder.resource) as resource:
+            assert render(template, namespace) == 'John'
+            resource.assert_called_once_with('person', 'john')
+        assert 'band' in namespace
+        assert namespace == load_for('john')
+
+    def test_template_dependencies_prune_namespace(self):
+        template = load_jinja_template('templates/phrase.md')
+        assert template.dependencies == {'person', 'band'}
+
+        builder = NamespaceBuilder()
+        namespace = builder.namespace('john', names={'person', 'cronogram'})
+        assert namespace == {'person': dict(name='John', role='singer')}
+        assert list(builder.namespace('john', lazy=True, names={'band'})) \
+            == ['band']
+
+
+@pytest.mark.usefixtures('path')
+class TestProjectEnvironment:
+    def write(self, path, data):
+        with open(path, 'w') as F:
+            F.write(data)
+
+    def test_environment_is_shared(self):
+        assert project_environment() is project_environment('.')
+        assert as_template('{{ x }}') is as_template('{{ x }}')
+
+    def test_include_and_extends(self):
+        self.write('templates/base.md', '{% block body %}{% endblock %}!')
+        self.write('templates/name.md', '{{ person.name }}')
+        self.write('templates/hello.md',
+                   '{% extends "base.md" %}'
+                   '{% block body %}{% include "name.md" %}{% endblock %}')
+        template = load_jinja_template('templates/hello.md')
+        assert template.dependencies == {'person'}
+        assert len(template.includes) == 2
+
+        save_rendered_all('templates/hello.md')
+        assert get_data('reports/hello-john.md') == 'John!'
+
+    def test_compile_populates_bytecode_cache(self):
+        self.write('templates/broken.md', '{% if %}')
+        compiled, errors = compile_templates()
+        assert compiled == ['phrase.md'] and list(errors) == ['broken.md']
+        assert os.listdir('.buroca/jinja')
+
+    def test_compile_skips_odf_and_reports_unreadable_templates(self):
+        with open('templates/binary.md', 'wb') as F:
+            F.write(b'\xff\xfe{{ name }}')
+        with open('templates/report.odt', 'wb') as F:
+            F.write(b'PK\x03\x04')
+        compiled, errors = compile_templates()
+        assert compiled == ['phrase.md'] and list(errors) == ['binary.md']
+        assert errors['binary.md'].startswith('UnicodeDecodeError')
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from buroca.errors import ConversionError
+from buroca.officepool import OfficePool
+
+
+class FakeWorker:
+    instances = []
+
+    def __init__(self, fail=False):
+        self.starts = 0
+        self.jobs = 0
+        self.alive = False
+        self.fail = fail
+        self.instances.append(self)
+
+    def start(self):
+        self.starts += 1
+        self.jobs = 0
+        self.alive = True
+
+    def convert(self, src, dest, fmt):
+        self.jobs += 1
+        if self.fail:
+            raise ConversionError(['soffice'], 1)
+        with open(dest, 'w') as F:
+            F.write(fmt)
+
+    def is_alive(self):
+        return self.alive
+
+    def stop(self):
+        self.alive = False
+
+
+@pytest.fixture
+def pool():
+    FakeWorker.instances = []
+    with OfficePool(size=1, max_jobs=2, worker_factory=FakeWorker) as pool:
+        yield pool
+
+
+class TestOfficePool:
+    def test_worker_is_reused_and_recycled(self, pool, temp_dir):
+        for i in range(3):
+            pool.convert('doc.odt', '%s/doc-%s.pdf' % (temp_dir, i))
+        worker, = FakeWorker.instances
+        assert worker.starts == 2 and worker.jobs == 1
+
+    def test_dead_workers_are_restarted(self, pool, temp_dir):
+        pool.convert('doc.odt', temp_dir + '/doc.pdf')
+        worker, = pool.workers
+        worker.alive = False
+        pool.convert('doc.odt', temp_dir + '/doc.pdf')
+        assert worker.starts == 2 and worker.alive
+
+    def test_failed_jobs_restart_worker(self, pool, temp_dir):
+        pool.convert('doc.odt', temp_dir + '/doc.pdf')
+        worker, = pool.workers
+        worker.fail = True
+        with pytest.raises(ConversionError):
+            pool.convert('doc.odt', temp_dir + '/doc.pdf')
+        assert worker.starts == 2
+
+    def test_shutdown_stops_workers(self, pool, temp_dir):
+        pool.convert('doc.odt', temp_dir + '/doc.pdf')
+        worker, = pool.workers
+        pool.shutdown()
+        assert not worker.alive and pool.workers == []
+        with pytest.raises(RuntimeError):
+            pool.convert('doc.odt', temp_dir + '/doc.pdf')
+
+    def test_discarded_workers_free_their_slot(self, temp_dir):
+        class BrokenWorker(FakeWorker):
+            def start(self):
+                if self.starts:
+                    raise RuntimeError('cannot restart')
+                super().start()
+
+            def convert(self, src, dest, fmt):
+                time.sleep(0.1)  # let the other thread wait for the worker
+                super().convert(src, dest, fmt)
+
+        pool = OfficePool(size=1, worker_factory=lambda: BrokenWorker(True))
+        errors = []
+
+        def convert(name):
+            try:
+                pool.convert('doc.odt', '%s/%s.pdf' % (temp_dir, name))
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=convert, args=(name,),
+                                    daemon=True)
+                   for name in 'ab']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        assert not any(thread.is_alive() for thread in threads)
+        assert len(errors) == 2 and pool.workers == []
+        pool.shutdown()
@@ -1,7 +1,38 @@
+import copy
+import io
 import os
+import zipfile
+
+import mock
+import pytest
 
 from buroca.convert import odt_to_txt, read_ods
+from buroca.loffice import CalcTemplate, DocTemplate, StaticMembers
 from buroca.loffice import render_open_doc_template
+from buroca.loffice import repair_jinja_tags, write_xml_chunks
+from buroca.templates import save_rendered_all
+from tests.conftest import simple_example
+
+path = simple_example
+
+
+def copy_template(src, dest, replace):
+    """
+    Copy an open document template replacing strings in content.xml.
+    """
+    with zipfile.ZipFile(str(src)) as src:
+        with zipfile.ZipFile(dest, 'w') as dest:
+            for file in src.namelist():
+                data = src.read(file)
+                if file == 'content.xml':
+                    for old, new in replace.items():
+                        data = data.replace(old.encode(), new.encode())
+                dest.writestr(file, data)
+
+
+def read_content(path):
+    with zipfile.ZipFile(path) as zip:
+        return zip.read('content.xml').decode('utf8')
 
 
 class TestOpenDocTemplate:
@@ -32,3 +63,137 @@ class TestOpenDocTemplate:
         )
 
         assert read_ods(result) == [['answer', '42']]
+
+    def test_template_renders_many_documents(self, examples, temp_dir):
+        with DocTemplate(examples / 'template.odt') as template:
+            for name in ['john', 'paul']:
+                dest = os.path.join(temp_dir, name + '.odt')
+                template.render_at({'title': 'Hi', 'name': name}, dest)
+                assert 'Hello <text:span text:style-name="T1">%s</text:span>' \
+                    % name in read_content(dest)
+        assert template.dependencies == {'title', 'name'}
+
+    def test_save_rendered_all_with_odt_template(self, examples, path):
+        copy_template(examples / 'template.odt', 'templates/letter.odt',
+                      {'{{ name }}': '{{ person.name }}'})
+
+        rebuilt, _ = save_rendered_all('templates/letter.odt')
+        assert len(rebuilt) == 4
+        assert '>Ringo</text:span>!' in read_content('reports/letter-ringo.odt')
+
+
+class TestCalcTemplate:
+    row = ('<table:table-row table:style-name="ro1">'
+           '<table:table-cell office:value-type="string">'
+           '<text:p>%s</text:p></table:table-cell></table:table-row>')
+    padding = ('<table:table-row table:number-rows-repeated="100">'
+               '<table:table-cell/></table:table-row></table:table>')
+
+    def make_template(self, examples, temp_dir, cell):
+        path = os.path.join(temp_dir, 'template.ods')
+        copy_template(examples / 'template.ods', path, {
+            '</table:table-row></table:table>':
+                '</table:table-row>%s%s' % (self.row % cell, self.padding),
+        })
+        return CalcTemplate(path)
+
+    def test_only_templated_cells_are_indexed(self, examples, temp_dir):
+        with self.make_template(examples, temp_dir, 'static') as template:
+            kinds = [type(x).__name__ for x in template.template.segments
+                     if not isinstance(x, str)]
+            assert kinds == ['_Cell', '_Cell']
+            assert template.dependencies == {'name', 'value'}
+
+    def test_rows_are_repeated(self, examples, temp_dir):
+        cell = '{% for x in items %}{{ x }}'
+        dest = os.path.join(temp_dir, 'result.ods')
+        with self.make_template(examples, temp_dir, cell) as template:
+            assert template.dependencies == {'name', 'value', 'items'}
+            ns = {'name': 'n', 'value': 'v', 'items': ['a', 'b', 'b', 'c']}
+            template.render_at(ns, dest)
+
+        content = read_content(dest)
+        assert content.count('table:number-rows-repeated="2"') == 1
+        assert 'table:number-rows-repeated="97"' in content
+        assert read_ods(dest)[:5] == \
+            [['n', 'v'], ['a', ''], ['b', ''], ['b', ''], ['c', '']]
+
+
+class TestStreamingWriter:
+    def test_chunks_are_checked_and_written(self):
+        file = io.BytesIO()
+        write_xml_chunks(file, ['<a>', '<b>x</b>' * 10, '</a>'], size=8)
+        assert file.getvalue() == b'<a>' + b'<b>x</b>' * 10 + b'</a>'
+
+    def test_invalid_xml(self):
+        with pytest.raises(ValueError):
+            write_xml_chunks(io.BytesIO(), ['<a>', '<b>', '</a>'])
+
+    def test_failed_render_removes_output(self, examples, temp_dir):
+        dest = os.path.join(temp_dir, 'doc.odt')
+        with DocTemplate(examples / 'template.odt') as template:
+            with pytest.raises(ValueError):
+                template.render_at({'title': '<', 'name': 'x'}, dest)
+        assert not os.path.exists(dest)
+
+    def test_render_at_missing_directory(self, examples, temp_dir):
+        dest = os.path.join(temp_dir, 'missing', 'doc.odt')
+        with DocTemplate(examples / 'template.odt') as template:
+            with pytest.raises(FileNotFoundError) as ex:
+                template.render_at({'title': 'Hi', 'name': 'x'}, dest)
+        assert ex.value.filename == dest and ex.value.__context__ is None
+
+
+class TestStaticMembers:
+    @pytest.mark.parametrize('raw', [True, False])
+    def test_members_are_copied_without_changes(self, examples, temp_dir,
+                                                raw):
+        dest = os.path.join(temp_dir, 'doc.odt')
+        with mock.patch('buroca.loffice._can_copy_raw', return_value=raw), \
+                DocTemplate(examples / 'template.odt') as template:
+            template.render_at({'title': 'Hi', 'name': 'x'}, dest)
+            src = template.zipfile
+
+            with zipfile.ZipFile(dest) as zip:
+                assert zip.testzip() is None
+                first = zip.infolist()[0]
+                assert first.filename == 'mimetype'
+                assert first.compress_type == zipfile.ZIP_STORED
+                assert not first.extra
+                for info in src.infolist():
+                    if info.filename != 'content.xml':
+                        assert zip.read(info.filename) == src.read(info)
+                        assert zip.getinfo(info.filename).compress_type == \
+                            info.compress_type
+
+    def test_output_matches_plain_zipfile_copy(self, examples, temp_dir):
+        with zipfile.ZipFile(str(examples / 'template.odt')) as src:
+            expected = os.path.join(temp_dir, 'expected.zip')
+            with zipfile.ZipFile(expected, 'w') as zip:
+                for info in src.infolist():
+                    zip.writestr(copy.copy(info), src.read(info))
+
+            dest = os.path.join(temp_dir, 'dest.zip')
+            with zipfile.ZipFile(dest, 'w') as zip:
+                StaticMembers(src).write_to(zip)
+
+        with zipfile.ZipFile(expected) as exp, zipfile.ZipFile(dest) as zip:
+            assert zip.testzip() is None
+            assert zip.namelist() == exp.namelist()
+            for info in exp.infolist():
+                assert zip.read(info.filename) == exp.read(info)
+                assert zip.getinfo(info.filename).CRC == info.CRC
+
+
+class TestRepairJinjaTags:
+    def test_tags_inside_expressions_are_moved(self):
+        xml = '<p>{{ na<s>me</s> }}</p>'
+        assert repair_jinja_tags(xml) == '<p>{{ name }}<s></s></p>'
+
+    def test_split_delimiters(self):
+        xml = '<p>{<s>{ name }</s>}</p>'
+        assert repair_jinja_tags(xml) == '<p><s>{{ name }}</s></p>'
+
+    def test_entities_and_quotes(self):
+        xml = '{% if x &gt; 1 %}{{ \u201ca\u201d }}{% endif %}'
+        assert repair_jinja_tags(xml) == '{% if x > 1 %}{{ "a" }}{% endif %}'
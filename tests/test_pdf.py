@@ -0,0 +1,195 @@
+import os
+import zlib
+
+import pytest
+
+from buroca.cli import join_pdf
+from buroca.convert import join_pdfs
+from buroca.errors import PdfError
+from buroca.pdf import PdfReader, merge_pdfs, Name, Raw, Ref
+from buroca.pdf import _parse, _serialize
+from tests.conftest import simple_example
+
+path = simple_example
+
+
+def make_pdf(path, texts, compressed=False):
+    """
+    Write a PDF file with one page per text.
+
+    Pages inherit the MediaBox and share a font. If compressed is True, the
+    file uses an xref stream and keeps dictionaries in an object stream.
+    """
+    n = len(texts)
+    pages = list(range(4, 4 + n))
+    contents = list(range(4 + n, 4 + 2 * n))
+    objects = {
+        1: b'<< /Type /Catalog /Pages 2 0 R >>',
+        2: b'<< /Type /Pages /Kids [%s] /Count %d /MediaBox [0 0 200 100] >>'
+           % (b' '.join(b'%d 0 R' % p for p in pages), n),
+        3: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    }
+    for page, content in zip(pages, contents):
+        objects[page] = (b'<< /Type /Page /Parent 2 0 R /Contents %d 0 R '
+                         b'/Resources << /Font << /F1 3 0 R >> >> >>'
+                         % content)
+    out = bytearray(b'%PDF-1.5\n')
+    offsets = {}
+    for content, text in zip(contents, texts):
+        data = b'BT /F1 12 Tf 10 50 Td (%s) Tj ET' % text.encode()
+        write_object(out, offsets, content, b'<< /Length %d >>\nstream\n'
+                     b'%s\nendstream' % (len(data), data))
+
+    if compressed:
+        write_compressed_objects(out, offsets, objects, max(contents) + 1)
+    else:
+        write_objects(out, offsets, objects)
+    with open(path, 'wb') as file:
+        file.write(out)
+
+
+def write_object(out, offsets, num, body):
+    offsets[num] = len(out)
+    out.extend(b'%d 0 obj\n%s\nendobj\n' % (num, body))
+
+
+def write_objects(out, offsets, objects):
+    """
+    Write objects followed by an xref table.
+    """
+    for num, body in objects.items():
+        write_object(out, offsets, num, body)
+    start = len(out)
+    size = max(offsets) + 1
+    out.extend(b'xref\n0 %d\n0000000000 65535 f \n' % size)
+    for num in range(1, size):
+        out.extend(b'%010d 00000 n \n' % offsets[num])
+    out.extend(b'trailer\n<< /Size %d /Root 1 0 R >>\n' % size)
+    out.extend(b'startxref\n%d\n%%%%EOF\n' % start)
+
+
+def write_compressed_objects(out, offsets, objects, stm):
+    """
+    Write objects in an object stream followed by an xref stream.
+    """
+    header, body = [], b''
+    for num, data in objects.items():
+        header.append(b'%d %d' % (num, len(body)))
+        body += data + b'\n'
+    header = b' '.join(header) + b'\n'
+    data = zlib.compress(header + body)
+    write_object(out, offsets, stm,
+                 b'<< /Type /ObjStm /N %d /First %d /Length %d /Filter '
+                 b'/FlateDecode >>\nstream\n%s\nendstream'
+                 % (len(objects), len(header), len(data), data))
+
+    xref = stm + 1
+    offsets[xref] = len(out)
+    rows = [b'\x00\x00\x00\x00']
+    for num in range(1, xref + 1):
+        if num in objects:
+            idx = list(objects).index(num)
+            rows.append(bytes([2]) + stm.to_bytes(2, 'big') + bytes([idx]))
+        else:
+            rows.append(bytes([1]) + offsets[num].to_bytes(2, 'big') + b'\x00')
+
+    # PNG "Up" predictor, as written by most producers
+    encoded, prior = b'', bytes(4)
+    for row in rows:
+        encoded += b'\x02' + bytes((a - b) & 0xFF for a, b in zip(row, prior))
+        prior = row
+    data = zlib.compress(encoded)
+    out.extend(b'%d 0 obj\n<< /Type /XRef /Size %d /W [1 2 1] /Root 1 0 R '
+               b'/Filter /FlateDecode /DecodeParms << /Predictor 12 '
+               b'/Columns 4 >> /Length %d >>\nstream\n%s\nendstream\nendobj\n'
+               % (xref, xref + 1, len(data), data))
+    out.extend(b'startxref\n%d\n%%%%EOF\n' % offsets[xref])
+
+
+def page_texts(path):
+    with PdfReader(path) as reader:
+        result = []
+        for _, page in reader.pages():
+            content = reader.resolve(page['Contents'])
+            text = bytes(content.data).split(b'(')[1].split(b')')[0]
+            result.append(text.decode())
+        return result
+
+
+class TestPdfReader:
+    @pytest.mark.parametrize('compressed', [False, True])
+    def test_read_pages(self, temp_dir, compressed):
+        src = os.path.join(temp_dir, 'a.pdf')
+        make_pdf(src, ['one', 'two'], compressed=compressed)
+        assert page_texts(src) == ['one', 'two']
+
+        with PdfReader(src) as reader:
+            _, page = next(reader.pages())
+            assert page['MediaBox'] == [0, 0, 200, 100]
+            font = page['Resources']['Font']['F1']
+            assert font == Ref(3, 0)
+            assert reader.get(font)['BaseFont'] == 'Helvetica'
+
+    def test_rejects_invalid_files(self, temp_dir):
+        src = os.path.join(temp_dir, 'a.pdf')
+        with open(src, 'wb') as file:
+            file.write(b'not a pdf')
+        with pytest.raises(PdfError):
+            PdfReader(src)
+
+
+class TestSerialize:
+    def test_round_trip(self):
+        obj = {'A': [1, -2, Raw(b'1.5'), True, False, None, Ref(3, 0)],
+               'B': {'N': Name('a b'), 'S': Raw(b'(x (y))'), 'H': Raw(b'<0a>')}}
+        data = _serialize(obj)
+        assert data.startswith(b'<</A [1 -2 1.5 true false null 3 0 R]')
+        assert _parse(data, 0) == (obj, len(data))
+        assert _serialize(2.50) == b'2.5'
+        with pytest.raises(TypeError):
+            _serialize(object())
+
+
+class TestMergePdfs:
+    def test_merge_keeps_order_and_resources(self, temp_dir):
+        files = []
+        for idx, compressed in enumerate([False, True, False]):
+            files.append(os.path.join(temp_dir, '%s.pdf' % idx))
+            make_pdf(files[-1], ['%s-a' % idx, '%s-b' % idx], compressed)
+        dest = os.path.join(temp_dir, 'out.pdf')
+
+        assert merge_pdfs(files, dest) == 6
+        assert page_texts(dest) == ['0-a', '0-b', '1-a', '1-b', '2-a', '2-b']
+
+        with PdfReader(dest) as reader:
+            fonts = set()
+            for _, page in reader.pages():
+                assert page['MediaBox'] == [0, 0, 200, 100]
+                font = page['Resources']['Font']['F1']
+                assert reader.get(font)['BaseFont'] == 'Helvetica'
+                fonts.add(font)
+
+            # Shared objects are copied once per input file
+            assert len(fonts) == 3
+
+    def test_failed_merge_removes_output(self, temp_dir):
+        src = os.path.join(temp_dir, 'a.pdf')
+        bad = os.path.join(temp_dir, 'bad.pdf')
+        dest = os.path.join(temp_dir, 'out.pdf')
+        make_pdf(src, ['one'])
+        with open(bad, 'wb') as file:
+            file.write(b'%PDF-1.4\ngarbage')
+        with pytest.raises(PdfError):
+            join_pdfs([src, bad], dest)
+        assert not os.path.exists(dest)
+
+
+@pytest.mark.usefixtures('path')
+class TestJoinPdfCommand:
+    def test_join_in_natural_order(self):
+        os.makedirs('reports', exist_ok=True)
+        for idx in [10, 2, 1]:
+            make_pdf('reports/report-%s.pdf' % idx, ['page %s' % idx])
+        join_pdf.main(['report'], standalone_mode=False)
+        assert page_texts('reports/report.pdf') == \
+            ['page 1', 'page 2', 'page 10']
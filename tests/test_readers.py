@@ -0,0 +1,167 @@
+import datetime
+import tracemalloc
+import zipfile
+
+import pytest
+
+from buroca.convert import read_ods
+from buroca.db import SheetCollection
+from buroca.readers import RowReader, iter_rows, read_sheets
+
+ODS_HEAD = (
+    '<office:document-content '
+    'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+    'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" '
+    'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0">'
+    '<office:body><office:spreadsheet>'
+)
+ODS_TAIL = '</office:spreadsheet></office:body></office:document-content>'
+XLSX_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+XLSX_REL_NS = \
+    'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+
+def cell(text, **attrs):
+    attrs = ''.join(' %s="%s"' % (k.replace('_', ':', 1).replace('_', '-'), v)
+                    for k, v in attrs.items())
+    body = '' if text is None else '<text:p>%s</text:p>' % text
+    return '<table:table-cell%s>%s</table:table-cell>' % (attrs, body)
+
+
+def row(*cells, repeat=None):
+    attr = '' if repeat is None else \
+        ' table:number-rows-repeated="%s"' % repeat
+    return '<table:table-row%s>%s</table:table-row>' % (attr, ''.join(cells))
+
+
+def write_ods(path, tables):
+    body = ''.join('<table:table table:name="%s">%s</table:table>'
+                   % (name, ''.join(rows)) for name, rows in tables.items())
+    with zipfile.ZipFile(path, 'w') as zip:
+        zip.writestr('mimetype', 'application/vnd.oasis.opendocument.spreadsheet')
+        zip.writestr('content.xml', ODS_HEAD + body + ODS_TAIL)
+
+
+def write_ods_rows(path, rows):
+    with zipfile.ZipFile(path, 'w') as zip:
+        with zip.open('content.xml', 'w') as F:
+            F.write((ODS_HEAD + '<table:table table:name="s">').encode())
+            for data in rows:
+                F.write(row(*map(cell, data)).encode())
+            F.write(('</table:table>' + ODS_TAIL).encode())
+
+
+class TestOdsReader:
+    def test_typed_values(self, temp_dir):
+        path = temp_dir + '/data.ods'
+        write_ods(path, {'people': [
+            row(cell('id'), cell('age'), cell('born'), cell('ok')),
+            row(cell('john'),
+                cell('40', office_value_type='float', office_value='40'),
+                cell('1940', office_value_type='date',
+                     office_date_value='1940-10-09'),
+                cell('TRUE', office_value_type='boolean',
+                     office_boolean_value='true')),
+            row(cell('a<text:s text:c="2"/>b'),
+                cell('1.5', office_value_type='percentage',
+                     office_value='1.5'),
+                cell('12:30', office_value_type='time',
+                     office_time_value='PT12H30M00S'),
+                cell('1980', office_value_type='date',
+                     office_date_value='1980-12-08T22:50:00.25'),
+                cell('-1:30', office_value_type='time',
+                     office_time_value='-PT1H30M00S')),
+        ]})
+        assert list(iter_rows(path, 'people')) == [
+            ('id', 'age', 'born', 'ok'),
+            ('john', 40, datetime.date(1940, 10, 9), True),
+            ('a  b', 1.5, datetime.time(12, 30),
+             datetime.datetime(1980, 12, 8, 22, 50, 0, 250000),
+             -datetime.timedelta(hours=1, minutes=30)),
+        ]
+
+    def test_repeated_cells_and_rows_are_expanded_lazily(self, temp_dir):
+        path = temp_dir + '/data.ods'
+        empty = cell(None, table_number_columns_repeated=16384)
+        write_ods(path, {'s': [
+            row(cell('a', table_number_columns_repeated=2),
+                cell(None, table_number_columns_repeated=2), cell('b'), empty),
+            row(empty, repeat=2),
+            row(cell('c'), repeat=2),
+            row(empty, repeat=1048570),
+        ]})
+        assert list(iter_rows(path)) == [
+            ('a', 'a', None, None, 'b'), (), (), ('c',), ('c',),
+        ]
+
+        # read_ods() keeps the shape of rows returned by pyexcel
+        assert read_ods(path) == [
+            ['a', 'a', '', '', 'b'], [''] * 5, [''] * 5,
+            ['c', '', '', '', ''], ['c', '', '', '', ''],
+        ]
+
+    def test_multiple_sheets(self, temp_dir):
+        path = temp_dir + '/data.ods'
+        write_ods(path, {'a': [row(cell('1'))], 'b': [row(cell('2'))]})
+        assert read_sheets(path) == {'a': [['1']], 'b': [['2']]}
+        assert read_ods(path) == {'a': [['1']], 'b': [['2']]}
+        assert list(iter_rows(path, 1)) == [('2',)]
+        with pytest.raises(ValueError):
+            list(iter_rows(path, 'c'))
+
+    def test_memory_does_not_grow_with_rows(self, temp_dir):
+        path = temp_dir + '/data.ods'
+        write_ods_rows(path, ([str(i), 'name %s' % i] for i in range(20000)))
+        tracemalloc.start()
+        try:
+            count = sum(1 for _ in iter_rows(path))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert count == 20000
+        assert peak < 2 * 2 ** 20
+
+    def test_sheet_collection_streams_rows(self, temp_dir):
+        path = temp_dir + '/data.ods'
+        write_ods(path, {'s': [row(cell('id'), cell('name')),
+                               row(cell('john'), cell('John'))]})
+        people = SheetCollection(path, RowReader(path))
+        assert dict(people) == {'john': {'id': 'john', 'name': 'John'}}
+        assert people.rows is None
+        assert people.get('john') == {'id': 'john', 'name': 'John'}
+
+
+class TestXlsxReader:
+    def test_read_rows(self, temp_dir):
+        path = temp_dir + '/data.xlsx'
+        with zipfile.ZipFile(path, 'w') as zip:
+            zip.writestr('xl/workbook.xml', (
+                '<workbook xmlns="%s" xmlns:r="%s"><sheets>'
+                '<sheet name="people" sheetId="1" r:id="rId1"/>'
+                '</sheets></workbook>') % (XLSX_NS, XLSX_REL_NS))
+            zip.writestr('xl/_rels/workbook.xml.rels', (
+                '<Relationships xmlns="http://schemas.openxmlformats.org/'
+                'package/2006/relationships"><Relationship Id="rId1" '
+                'Target="worksheets/sheet1.xml"/></Relationships>'))
+            zip.writestr('xl/sharedStrings.xml', (
+                '<sst xmlns="%s"><si><t>id</t></si>'
+                '<si><r><t>jo</t></r><r><t>hn</t></r></si></sst>') % XLSX_NS)
+            zip.writestr('xl/styles.xml', (
+                '<styleSheet xmlns="%s"><cellXfs><xf numFmtId="0"/>'
+                '<xf numFmtId="14"/></cellXfs></styleSheet>') % XLSX_NS)
+            zip.writestr('xl/worksheets/sheet1.xml', (
+                '<worksheet xmlns="%s"><sheetData>'
+                '<row r="1"><c r="A1" t="s"><v>0</v></c></row>'
+                '<row r="3"><c r="A3" t="s"><v>1</v></c>'
+                '<c r="C3" s="1"><v>14893</v></c>'
+                '<c r="D3" t="b"><v>1</v></c>'
+                '<c r="E3"><v>2.5</v></c>'
+                '<c r="F3" t="d"><v>1980-12-08T22:50:00Z</v></c>'
+                '<c r="G3" t="d"><v>1980-12-08</v></c></row>'
+                '</sheetData></worksheet>') % XLSX_NS)
+
+        assert list(iter_rows(path)) == [
+            ('id',), (),
+            ('john', None, datetime.date(1940, 10, 9), True, 2.5,
+             datetime.datetime(1980, 12, 8, 22, 50), datetime.date(1980, 12, 8)),
+        ]
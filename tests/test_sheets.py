@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+from buroca.sheets import cell, find_template_cells
+
+
+class FakeSheet:
+    def __init__(self, data):
+        self.data = data
+        self.reads = 0
+
+    def createCursor(self):
+        address = SimpleNamespace(EndRow=len(self.data) - 1,
+                                  EndColumn=len(self.data[0]) - 1)
+        return SimpleNamespace(gotoEndOfUsedArea=lambda expand: None,
+                               getRangeAddress=lambda: address)
+
+    def getCellRangeByPosition(self, col0, row0, col1, row1):
+        self.reads += 1
+        rows = [row[col0:col1 + 1] for row in self.data[row0:row1 + 1]]
+        return SimpleNamespace(getDataArray=lambda: tuple(map(tuple, rows)))
+
+
+class TestTemplateCells:
+    def test_cell_names(self):
+        assert [cell(0, 0), cell(9, 25), cell(0, 26), cell(0, 701)] == \
+            ['a1', 'z10', 'aa1', 'zz1']
+
+    def test_bulk_reads(self):
+        data = [['', 1.0, ' {{ x }} '] for _ in range(10)]
+        data[-1] = ['{% if y %}', 'text', '']
+        sheet = FakeSheet(data)
+        cells = find_template_cells(sheet, block_rows=4)
+        assert sheet.reads == 3
+        assert len(cells) == 10
+        assert cells['c1'] == '{{ x }}' and cells['a10'] == '{% if y %}'
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from buroca.db import load_for, load_all, namespace_builder
+from buroca.store import DataStore, store_path
+from buroca.templates import save_rendered_all
+from tests.conftest import simple_example, get_data
+
+path = simple_example
+
+
+@pytest.mark.usefixtures('path')
+class TestDataStore:
+    def test_compiled_store_matches_data_folder(self):
+        expected = load_all()
+        store = DataStore(store_path())
+        assert store.compile()['added'] == 5
+        assert isinstance(namespace_builder(), DataStore)
+        assert load_all() == expected
+        assert load_for('john') == expected['john']
+
+    def test_compile_only_updates_changed_sources(self):
+        store = DataStore(store_path())
+        store.compile()
+        stats = store.compile()
+        assert stats['unchanged'] == 5
+        assert stats['added'] == stats['updated'] == 0
+
+        with open('data/person/john.yml', 'w') as F:
+            F.write('name: John Lennon\nrole: singer\n')
+        os.utime('data/person/john.yml', ns=(10 ** 18, 10 ** 18))
+        os.unlink('data/person/ringo.yml')
+
+        stats = store.compile()
+        assert stats['updated'] == 1
+        assert stats['removed'] == 1
+        assert store.namespace('john')['person']['name'] == 'John Lennon'
+        assert store.entities() == ['george', 'john', 'paul']
+
+    def test_stale_store_is_not_used(self):
+        DataStore(store_path()).compile()
+        with namespace_builder() as builder:
+            assert isinstance(builder, DataStore)
+
+        with open('data/person/john.yml', 'w') as F:
+            F.write('name: John Lennon\nrole: singer\n')
+        os.utime('data/person/john.yml', ns=(10 ** 18, 10 ** 18))
+        with namespace_builder() as builder:
+            assert not isinstance(builder, DataStore)
+        assert load_for('john')['person']['name'] == 'John Lennon'
+
+    def test_render_and_convert_from_store(self):
+        # Conversions run in a background thread that renders documents
+        DataStore(store_path()).compile()
+        os.mkdir('reports')
+        rebuilt, _ = save_rendered_all('templates/phrase.md', type='md')
+        assert sorted(rebuilt) == ['george', 'john', 'paul', 'ringo']
+        assert get_data('reports/phrase-john.md') == \
+            "John is Beatles's singer."
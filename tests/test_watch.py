@@ -0,0 +1,143 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from buroca.store import DataStore, store_path
+from buroca.watch import WatchSession, InotifyWatcher, PollingWatcher
+from buroca.watch import changes, new_watcher
+from tests.conftest import simple_example, get_data
+
+path = simple_example
+
+
+def write(path, data):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as F:
+        F.write(data)
+
+    # Make sure the modification time changes in coarse-grained filesystems
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+@pytest.mark.usefixtures('path')
+class TestWatchSession:
+    def rebuilt(self, results):
+        return {path.name: sorted(rebuilt)
+                for path, (rebuilt, _) in results.items()}
+
+    def test_rebuild_changed_entity(self):
+        session = WatchSession(['templates/phrase.md'])
+        assert len(self.rebuilt(session.build())['phrase.md']) == 4
+
+        write('data/person/john.yml', 'name: John\nrole: rhythm guitar')
+        results = session.update([os.path.abspath('data/person/john.yml')])
+        assert self.rebuilt(results) == {'phrase.md': ['john']}
+        assert get_data('reports/phrase-john.md') == \
+            "John is Beatles's rhythm guitar."
+
+    def test_rebuild_all_on_global_or_template_change(self):
+        session = WatchSession(['templates/phrase.md'])
+        session.build()
+
+        write('data/band.yml', 'name: The Beatles')
+        results = session.update(['data/band.yml'])
+        assert len(self.rebuilt(results)['phrase.md']) == 4
+        assert get_data('reports/phrase-paul.md') == \
+            "Paul is The Beatles's bass player."
+
+        write('templates/phrase.md',
+              '{{ person.name }} plays in {{ band.name }}.')
+        results = session.update(['templates/phrase.md'])
+        assert len(self.rebuilt(results)['phrase.md']) == 4
+        assert get_data('reports/phrase-paul.md') == \
+            'Paul plays in The Beatles.'
+
+    def test_new_entity_and_unrelated_files(self):
+        session = WatchSession(['templates/phrase.md'])
+        session.build()
+
+        write('data/person/pete.yml', 'name: Pete\nrole: drummer')
+        results = session.update(['data/person/pete.yml'])
+        assert self.rebuilt(results) == {'phrase.md': ['pete']}
+        assert 'pete' in session.entities
+
+        write('data/unused.yml', 'foo: bar')
+        assert session.update(['data/unused.yml']) == {}
+
+    def test_conversions_with_compiled_store(self):
+        # Documents are rendered from the store in the conversion thread
+        DataStore(store_path()).compile()
+        os.mkdir('reports')
+        session = WatchSession(['templates/phrase.md'], type='md')
+        assert len(self.rebuilt(session.build())['phrase.md']) == 4
+
+        write('data/person/john.yml', 'name: John\nrole: rhythm guitar')
+        results = session.update([os.path.abspath('data/person/john.yml')])
+        assert self.rebuilt(results) == {'phrase.md': ['john']}
+        assert get_data('reports/phrase-john.md') == \
+            "John is Beatles's rhythm guitar."
+
+    def test_lost_events_reload_everything(self):
+        session = WatchSession(['templates/phrase.md'])
+        session.build()
+
+        write('templates/phrase.md', '{{ person.name }} ({{ person.role }})')
+        write('data/person/pete.yml', 'name: Pete\nrole: drummer')
+        results = session.update([os.path.abspath('data'),
+                                  os.path.abspath('templates')])
+        assert len(self.rebuilt(results)['phrase.md']) == 5
+        assert get_data('reports/phrase-pete.md') == 'Pete (drummer)'
+
+    def test_template_errors_do_not_stop_the_session(self, capsys):
+        session = WatchSession(['templates/phrase.md'])
+        session.build()
+
+        write('templates/phrase.md', '{{ person.name ')
+        assert session.update(['templates/phrase.md']) == {}
+        assert 'phrase.md' in capsys.readouterr().out
+
+        write('templates/phrase.md', '{{ person.name }}')
+        results = session.update(['templates/phrase.md'])
+        assert len(self.rebuilt(results)['phrase.md']) == 4
+
+
+class TestWatchers:
+    def check_watcher(self, watcher, root):
+        try:
+            assert watcher.poll(0.05) == set()
+            write(root / 'a.yml', 'a: 1')
+            write(root / 'sub' / 'b.yml', 'b: 1')
+            write(root / '.hidden.swp', '')
+            changed = set()
+            for _ in range(20):
+                changed |= watcher.poll(0.1)
+                if len(changed) >= 2:
+                    break
+            assert changed >= {root / 'a.yml', root / 'sub' / 'b.yml'}
+            assert root / '.hidden.swp' not in changed
+        finally:
+            watcher.close()
+
+    def test_polling_watcher(self, temp_dir):
+        root = Path(temp_dir).absolute()
+        self.check_watcher(PollingWatcher([root], interval=0.02), root)
+
+    def test_inotify_watcher(self, temp_dir):
+        root = Path(temp_dir).absolute()
+        try:
+            watcher = InotifyWatcher([root])
+        except OSError:
+            pytest.skip('inotify is not available')
+        self.check_watcher(watcher, root)
+
+    def test_changes_are_debounced(self, temp_dir):
+        root = Path(temp_dir).absolute()
+        watcher = new_watcher([root], polling=True, interval=0.01)
+        write(root / 'a.yml', 'a: 1')
+        start = time.monotonic()
+        changed = next(changes(watcher, delay=0.1))
+        assert changed == {root / 'a.yml'}
+        assert time.monotonic() - start >= 0.1
@@ -0,0 +1,71 @@
+import pathlib
+
+import pytest
+import yaml
+
+from buroca.db import load_for, load_all, load_yaml, YamlStream
+from tests.conftest import SIMPLE_BEATLES_DATA
+
+PROJECT = pathlib.Path(__file__).parent / 'project' / 'data'
+FIXTURES = sorted(PROJECT.glob('**/*.yml'))
+DOCUMENTS = [
+    'name: John\nrole: singer',
+    'date: 1960-08-17\ntags: [rock, pop]\ncount: 4\nratio: 0.5\nok: yes',
+    'text: |\n  multi\n  line\nnull_value: ~\nnested: {a: [1, {b: 2}]}',
+    'unicode: "Fábio Macêdo"\nescaped: "\\u00e9\\t"\nanchor: &x [1, 2]\nref: *x',
+    '---\nid: john\n---\nid: paul\n...\n',
+]
+requires_libyaml = pytest.mark.skipif(
+    not getattr(yaml, '__with_libyaml__', False),
+    reason='LibYAML bindings are not available',
+)
+
+
+@requires_libyaml
+class TestLoaderParity:
+    @pytest.mark.parametrize('path', FIXTURES, ids=lambda p: p.name)
+    def test_project_fixtures(self, path):
+        data = path.read_text()
+        expected = yaml.load(data, Loader=yaml.SafeLoader)
+        assert yaml.load(data, Loader=yaml.CSafeLoader) == expected
+        assert load_yaml.uncached(path) == expected
+
+    @pytest.mark.parametrize('data', DOCUMENTS)
+    def test_documents(self, data):
+        assert (list(yaml.load_all(data, Loader=yaml.CSafeLoader))
+                == list(yaml.load_all(data, Loader=yaml.SafeLoader)))
+
+    @pytest.mark.parametrize('path', [p for p in sorted(SIMPLE_BEATLES_DATA)
+                                      if p.endswith('.yml')])
+    def test_simple_example(self, path):
+        data = SIMPLE_BEATLES_DATA[path]
+        assert (yaml.load(data, Loader=yaml.CSafeLoader)
+                == yaml.load(data, Loader=yaml.SafeLoader))
+
+
+class TestMultiDocumentYaml:
+    def test_load_yaml_returns_stream(self, tree):
+        data = {'people.yml': 'id: john\nname: John\n---\nid: paul\nname: Paul'}
+        with tree(data):
+            stream = load_yaml(pathlib.Path('people.yml').absolute())
+            assert isinstance(stream, YamlStream)
+            assert stream.get('paul') == {'id': 'paul', 'name': 'Paul'}
+            assert list(stream.names()) == ['john', 'paul']
+
+    def test_single_document_is_not_a_stream(self, tree):
+        with tree({'band.yml': '---\nname: Beatles\n'}):
+            path = pathlib.Path('band.yml').absolute()
+            assert load_yaml(path) == {'name': 'Beatles'}
+
+    def test_stream_provides_entities(self, tree):
+        data = {
+            'data/band.yml': 'name: Beatles',
+            'data/person.yml': 'id: john\nrole: singer\n---\n'
+                               'id: ringo\nrole: drummer',
+        }
+        with tree(data):
+            assert load_for('ringo') == {
+                'band': {'name': 'Beatles'},
+                'person': {'id': 'ringo', 'role': 'drummer'},
+            }
+            assert sorted(load_all()) == ['john', 'ringo']